@@ -0,0 +1,319 @@
+import gc
+import json
+import os
+import multiprocessing
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Callable, Dict, List
+
+from block import Block, BlockChain, Input, Output, Transaction
+from codec import decode_block, encode_block
+from keystore import Keystore
+from snapshot import ChainSnapshot, read_snapshot, snapshot_path, write_snapshot
+from storage import BlockStore
+from wallet import Wallet
+
+
+def synthetic_blocks(n_blocks: int, txs_per_block: int, n_keys: int = 1000) -> List[Block]:
+    """
+    生成测试用的区块链：每笔交易 1 个输入 2 个输出，公钥从 n_keys 个中重复使用，
+    签名和哈希是随机字节，不做签名校验
+    """
+    pubkeys = [os.urandom(64).hex() for _ in range(n_keys)]
+    blocks = []
+    prev_hash = "0" * 64
+    for height in range(n_blocks):
+        transactions = []
+        for i in range(txs_per_block):
+            k = (height * txs_per_block + i) % n_keys
+            tx = Transaction(
+                Hash=os.urandom(32).hex(),
+                Vin=[Input(txid=os.urandom(32).hex(), vout=0, signature=os.urandom(64).hex(), pubkey=pubkeys[k])],
+                Vout=[Output(value=5, pubkey=pubkeys[(k + 1) % n_keys]),
+                      Output(value=95.5, pubkey=pubkeys[k])])
+            transactions.append(tx)
+        block = Block(datetime.now(timezone.utc), transactions, prev_hash, "", 0, height)
+        block.set_hash()
+        prev_hash = block.Hash
+        blocks.append(block)
+    return blocks
+
+
+def _timeit(func: Callable, repeat: int = 3) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        begin = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - begin)
+    return best
+
+
+def bench_codec(n_blocks: int = 20, txs_per_block: int = 500) -> Dict[str, Dict[str, float]]:
+    """对比 JSON 与二进制编码的大小和编解码速度"""
+    blocks = synthetic_blocks(n_blocks, txs_per_block)
+    json_data = [json.dumps({'block': b.to_dict()}).encode() for b in blocks]
+    binary_data = [encode_block(b) for b in blocks]
+    n_tx = n_blocks * txs_per_block
+    results = {
+        'json': {
+            'bytes_per_tx': sum(map(len, json_data)) / n_tx,
+            'encode_us_per_tx': _timeit(lambda: [json.dumps({'block': b.to_dict()}).encode() for b in blocks]) / n_tx * 1e6,
+            'decode_us_per_tx': _timeit(lambda: [Block.from_dict(json.loads(d)['block']) for d in json_data]) / n_tx * 1e6,
+        },
+        'binary': {
+            'bytes_per_tx': sum(map(len, binary_data)) / n_tx,
+            'encode_us_per_tx': _timeit(lambda: [encode_block(b) for b in blocks]) / n_tx * 1e6,
+            'decode_us_per_tx': _timeit(lambda: [decode_block(d) for d in binary_data]) / n_tx * 1e6,
+        },
+    }
+    return results
+
+
+def _rss_bytes() -> int:
+    """当前进程的常驻内存"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _peak_rss_bytes() -> int:
+    """进程常驻内存的峰值；ru_maxrss 在 exec 后会沿用父进程的值，优先读 VmHWM"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+@dataclass
+class _BaselineInput:
+    txid: str
+    vout: int
+    signature: str
+    pubkey: str
+
+
+@dataclass
+class _BaselineOutput:
+    value: float
+    pubkey: str
+
+
+@dataclass
+class _BaselineTransaction:
+    Hash: str
+    Vin: List[_BaselineInput]
+    Vout: List[_BaselineOutput]
+    Version: int = 1
+
+
+@dataclass
+class _BaselineBlock:
+    Timestamp: datetime
+    Transactions: List[_BaselineTransaction]
+    PrevBlockHash: str
+    Hash: str
+    Nonce: int
+    Height: int
+    Difficulty: int
+    _merkle_levels: List[bytes]
+    _tx_positions: Dict[str, int] = field(default=None)
+
+    def __post_init__(self):
+        self._tx_positions = {}
+        for i, tx in enumerate(self.Transactions):
+            self._tx_positions.setdefault(tx.Hash, i)
+
+
+def _to_baseline(block: Block) -> _BaselineBlock:
+    """
+    换成 Input/Output 改为 __slots__ + 原始字节之前的内存布局：带 __dict__ 的 dataclass，
+    哈希、签名、公钥都是各自独立的 hex 字符串，区块创建时就建立交易位置索引
+    """
+    transactions = [
+        _BaselineTransaction(
+            Hash=tx.Hash,
+            Vin=[_BaselineInput(i.txid, i.vout, i.signature, i._pubkey.hex()) for i in tx.Vin],
+            Vout=[_BaselineOutput(o.value, o._pubkey.hex()) for o in tx.Vout])
+        for tx in block.Transactions]
+    return _BaselineBlock(block.Timestamp, transactions, block.PrevBlockHash, block.Hash, block.Nonce,
+                          block.Height, block.Difficulty, block._merkle_levels)
+
+
+def _measure_memory(layout: str, n_tx: int, txs_per_block: int) -> Dict[str, float]:
+    """在全新的子进程中解码 n_tx 笔交易，返回常驻内存的增长"""
+    template = synthetic_blocks(1, txs_per_block)[0]
+    n_blocks = n_tx // txs_per_block
+    gc.collect()
+    before = _rss_bytes()
+    begin = time.perf_counter()
+    chain = []
+    for height in range(n_blocks):
+        # 每个区块使用不同的交易哈希，避免解码结果之间共享字符串
+        for tx in template.Transactions:
+            tx.Hash = os.urandom(32).hex()
+        template.Height = height
+        block = decode_block(encode_block(template))
+        chain.append(_to_baseline(block) if layout == 'baseline' else block)
+    elapsed = time.perf_counter() - begin
+    gc.collect()
+    used = _rss_bytes() - before
+    return {'transactions': n_blocks * txs_per_block,
+            'rss_mb': used / 1024 / 1024,
+            'bytes_per_tx': used / (n_blocks * txs_per_block),
+            'load_seconds': elapsed}
+
+
+def bench_memory(n_tx: int = 1000000, txs_per_block: int = 1000) -> Dict[str, Dict[str, float]]:
+    """
+    内存中区块链每笔交易占用的字节数，对比之前的内存布局（baseline）与现在的（current）
+
+    区块先编码成二进制再逐个解码进内存，和从存储或网络加载时一样，每个公钥、签名都是新对象；
+    两种布局各在一个子进程中测量，互不影响
+    """
+    context = multiprocessing.get_context('spawn')
+    results = {}
+    for layout in ('baseline', 'current'):
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            results[layout] = executor.submit(_measure_memory, layout, n_tx, txs_per_block).result()
+    return results
+
+
+def _load_chain(mode: str, path: str) -> Dict[str, float]:
+    """在全新的子进程中加载区块链，返回耗时和内存"""
+    gc.collect()
+    before = _rss_bytes()
+    begin = time.perf_counter()
+    if mode == 'json':
+        chain = BlockChain.read_blockchain(path)
+    elif mode == 'snapshot':
+        chain = BlockStore(path).load_blockchain(lazy=True, snapshot=read_snapshot(snapshot_path(path)))
+    else:
+        chain = BlockStore(path).load_blockchain(lazy=(mode == 'lazy'))
+    elapsed = time.perf_counter() - begin
+    gc.collect()
+    # 启动后读最新的区块（如打包新区块时），按需加载只解码这一个
+    chain[chain.height - 1].merkle_root
+    return {'seconds': elapsed,
+            'rss_mb': (_rss_bytes() - before) / 1024 / 1024,
+            'peak_rss_mb': _peak_rss_bytes() / 1024 / 1024,
+            'height': chain.height}
+
+
+def bench_startup(n_tx: int = 200000, txs_per_block: int = 1000) -> Dict[str, Dict[str, float]]:
+    """
+    节点启动加载区块链的耗时和内存：JSON 文件、区块存储全部解码、区块存储按需解码、
+    按需解码并从最后 10 个区块之前的快照恢复
+
+    每种方式在单独的子进程中运行，互不影响
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        store_path = os.path.join(directory, 'store')
+        json_path = os.path.join(directory, 'chain.json')
+        store = BlockStore(store_path)
+        blocks = synthetic_blocks(n_tx // txs_per_block, txs_per_block)
+        for block in blocks:
+            store.append(block)
+        store.close()
+        chain = BlockChain(blocks, blocks[-1].Hash, len(blocks))
+        chain.save_blockchain(json_path)
+        write_snapshot(snapshot_path(store_path),
+                       ChainSnapshot.encode_chain(BlockChain(blocks[:-10], blocks[-11].Hash, len(blocks) - 10)))
+        del blocks, chain
+        results = {}
+        context = multiprocessing.get_context('spawn')
+        for mode, path in (('json', json_path), ('store', store_path), ('lazy', store_path),
+                           ('snapshot', store_path)):
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                results[mode] = executor.submit(_load_chain, mode, path).result()
+        return results
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def bench_keys(n_keys: int = 2000, n_tx: int = 500) -> Dict[str, Dict[str, float]]:
+    """
+    对比逐个 new_address + 每个钱包一个 JSON 文件，与 Keystore 批量生成 + 单个二进制文件；
+    以及每次签名都解析私钥与使用缓存的 SigningKey
+    """
+    from ecdsa import SigningKey, SECP256k1
+    directory = tempfile.mkdtemp(prefix='bench_keys_')
+    try:
+        begin = time.perf_counter()
+        wallets = [Wallet().new_address() for _ in range(n_keys)]
+        wallet_seconds = time.perf_counter() - begin
+        for i, wallet in enumerate(wallets):
+            wallet.save_to_file(os.path.join(directory, f'wallet_{i}.json'))
+        wallet_bytes = sum(os.path.getsize(os.path.join(directory, f'wallet_{i}.json')) for i in range(n_keys))
+
+        begin = time.perf_counter()
+        keystore = Keystore.generate(n_keys)
+        keystore_seconds = time.perf_counter() - begin
+        path = os.path.join(directory, 'keys.bin')
+        keystore.save(path)
+        begin = time.perf_counter()
+        loaded = Keystore.load(path)
+        load_seconds = time.perf_counter() - begin
+
+        wallet = loaded[0]
+        def transactions():
+            return [Transaction(Hash="", Vin=[Input(os.urandom(32).hex(), 0, "", wallet.pub_key)],
+                                Vout=[Output(5, wallet.pub_key)]) for _ in range(n_tx)]
+        def sign_uncached(txs):
+            for tx in txs:
+                signing_key = SigningKey.from_string(bytes.fromhex(wallet.private_key), curve=SECP256k1)
+                for input_obj in tx.Vin:
+                    input_obj.signature = signing_key.sign(input_obj.signing_message()).hex()
+        txs = transactions()
+        begin = time.perf_counter()
+        sign_uncached(txs)
+        uncached_seconds = time.perf_counter() - begin
+        txs = transactions()
+        begin = time.perf_counter()
+        for tx in txs:
+            tx.sign(wallet.private_key)
+        cached_seconds = time.perf_counter() - begin
+        return {
+            'keygen': {
+                'new_address_keys_per_s': n_keys / wallet_seconds,
+                'keystore_keys_per_s': n_keys / keystore_seconds,
+                'workers': os.cpu_count() or 1,
+            },
+            'storage': {
+                'json_bytes_per_key': wallet_bytes / n_keys,
+                'keystore_bytes_per_key': os.path.getsize(path) / n_keys,
+                'keystore_load_ms': load_seconds * 1e3,
+            },
+            'signing': {
+                'uncached_tx_per_s': n_tx / uncached_seconds,
+                'cached_tx_per_s': n_tx / cached_seconds,
+            },
+        }
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+BENCHMARKS = {
+    'codec': bench_codec,
+    'memory': bench_memory,
+    'startup': bench_startup,
+    'keys': bench_keys,
+}
+
+if __name__ == '__main__':
+    # python bench.py codec
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        print(name, json.dumps(BENCHMARKS[name](), indent=4))
@@ -1,26 +1,122 @@
-from datetime import datetime,timezone
+from datetime import datetime,timedelta,timezone
 from typing import List
 import hashlib
 import json
+import re
+import struct
 import string
 import random
-import ecdsa
-from typing import Dict
-from ecdsa import SigningKey, VerifyingKey, SECP256k1
+from typing import Callable, Dict, Optional, Tuple
 from dataclasses import dataclass, field
+from keystore import get_signing_key
 from wallet import Wallet
+from utxo import UTXOSet
+from verifier import SignatureJob, verify_signature
 
 def generate_random_string(length: int) -> str:
     """生成指定长度的随机字符串"""
     letters = string.ascii_letters + string.digits
     return ''.join(random.choice(letters) for _ in range(length))
 
-@dataclass
+_pubkey_pool: Dict[bytes, bytes] = {}   # 公钥驻留池，同一个公钥在内存中只保存一份
+
+def _to_bytes(value):
+    '''hex 字符串转成原始字节保存；不是规范的小写 hex 时保持原样，保证读出来的值不变'''
+    if isinstance(value, (bytes, bytearray)):
+        return bytes(value)
+    try:
+        raw = bytes.fromhex(value)
+    except ValueError:
+        return value
+    return raw if raw.hex() == value else value
+
+def _to_hex(value) -> str:
+    return value.hex() if isinstance(value, bytes) else value
+
+# 交易和区块头规范序列化使用的定长字段，整数都是小端序
+_U16 = struct.Struct('<H')
+_U32 = struct.Struct('<I')
+_INT_VALUE = struct.Struct('<Bq')
+_FLOAT_VALUE = struct.Struct('<Bd')
+_HEADER_FIELDS = struct.Struct('<qII')   # Timestamp（微秒）, Height, Difficulty
+_NONCE = struct.Struct('<Q')
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_HEX = re.compile('(?:[0-9a-fA-F]{2})*')   # bytes.fromhex 还接受空白，这里只认紧凑的 hex
+
+def _pack_field(value) -> bytes:
+    '''
+    规范序列化中的变长字段：u16 长度 + 原始字节
+    大小写混合的 hex 也先解码，与经过 codec 往返（解码后总是小写）的同一笔交易哈希相同；不是 hex 的字符串按 utf-8 编码
+    '''
+    if isinstance(value, bytes):
+        raw = value
+    else:
+        raw = bytes.fromhex(value) if _HEX.fullmatch(value) else value.encode()
+    return _U16.pack(len(raw)) + raw
+
+def _pack_value(value) -> bytes:
+    # 与 codec 相同，保留整数和浮点数的区别
+    return _INT_VALUE.pack(0, value) if isinstance(value, int) else _FLOAT_VALUE.pack(1, value)
+
+def _timestamp_micros(timestamp: datetime) -> int:
+    '''时间戳转成 UTC 微秒数，没有时区的按 UTC 处理'''
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return (timestamp - _EPOCH) // timedelta(microseconds=1)
+
+def intern_pubkey(value):
+    '''返回驻留后的公钥（原始字节），重复出现的公钥共享同一个对象'''
+    raw = _to_bytes(value)
+    if isinstance(raw, bytes):
+        return _pubkey_pool.setdefault(raw, raw)
+    return raw
+
 class Input:
-    txid: str = field(metadata={'description': '交易哈希，用于唯一标识一笔交易'})
-    vout: int = field(metadata={'description': '交易中输出序号，指定该交易的哪个输出被引用作为输入'})
-    signature: str = field(metadata={'description': '支付方的签名，对交易进行签名的数据，用于验证交易的合法性'})
-    pubkey: str = field(metadata={'description': '接收方的公钥,与私钥对应的公钥，用于验证签名'})
+    '''
+    交易输入
+    内部以原始字节保存 txid、signature、pubkey（公钥驻留），对外仍然是 hex 字符串，
+    使用 __slots__ 去掉每个对象的 __dict__
+    '''
+    __slots__ = ('_txid', 'vout', '_signature', '_pubkey')
+
+    def __init__(self, txid: str, vout: int, signature: str, pubkey: str):
+        self.txid = txid            # 交易哈希，用于唯一标识一笔交易
+        self.vout = vout            # 交易中输出序号，指定该交易的哪个输出被引用作为输入
+        self.signature = signature  # 支付方的签名，对交易进行签名的数据，用于验证交易的合法性
+        self.pubkey = pubkey        # 接收方的公钥,与私钥对应的公钥，用于验证签名
+
+    @property
+    def txid(self) -> str:
+        return _to_hex(self._txid)
+
+    @txid.setter
+    def txid(self, value: str) -> None:
+        self._txid = _to_bytes(value)
+
+    @property
+    def signature(self) -> str:
+        return _to_hex(self._signature)
+
+    @signature.setter
+    def signature(self, value: str) -> None:
+        self._signature = _to_bytes(value)
+
+    @property
+    def pubkey(self) -> str:
+        return _to_hex(self._pubkey)
+
+    @pubkey.setter
+    def pubkey(self, value: str) -> None:
+        self._pubkey = intern_pubkey(value)
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Input):
+            return NotImplemented
+        return (self._txid, self.vout, self._signature, self._pubkey) == \
+            (other._txid, other.vout, other._signature, other._pubkey)
+
+    def __repr__(self) -> str:
+        return f"Input(txid={self.txid!r}, vout={self.vout!r}, signature={self.signature!r}, pubkey={self.pubkey!r})"
 
     def to_dict(self) -> dict:
         return {
@@ -30,10 +126,42 @@ class Input:
             'pubkey': self.pubkey
         }
 
-@dataclass
+    def signing_message(self) -> bytes:
+        '''支付方签名的消息：被引用的输出 txid + vout'''
+        return f"{self.txid}{self.vout}".encode()
+
 class Output:
-    value: float = field(metadata={'description': '交易输出的金额数值'})
-    pubkey: str = field(metadata={'description': '接收该交易输出金额的公钥'})
+    '''交易输出，公钥以驻留的原始字节保存'''
+    __slots__ = ('value', '_pubkey')
+
+    def __init__(self, value: float, pubkey: str):
+        self.value = value          # 交易输出的金额数值
+        self.pubkey = pubkey        # 接收该交易输出金额的公钥
+
+    @property
+    def pubkey(self) -> str:
+        return _to_hex(self._pubkey)
+
+    @pubkey.setter
+    def pubkey(self, value: str) -> None:
+        self._pubkey = intern_pubkey(value)
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Output):
+            return NotImplemented
+        return (self.value, self._pubkey) == (other.value, other._pubkey)
+
+    def __repr__(self) -> str:
+        return f"Output(value={self.value!r}, pubkey={self.pubkey!r})"
+
+    @staticmethod
+    def from_raw(value: float, pubkey) -> 'Output':
+        '''pubkey 已经是 intern_pubkey 的结果时使用，跳过转换和驻留，批量加载时更快'''
+        output = Output.__new__(Output)
+        output.value = value
+        output._pubkey = pubkey
+        return output
+
     def to_dict(self) -> dict:
         return {
             'value': self.value,
@@ -41,27 +169,36 @@ class Output:
         }
 
 
-@dataclass
+@dataclass(slots=True)
 class Transaction:
     Version:int = field(init=False,default=1)  # 默认就是 v1
     Hash: str                                  # 验证成功后使用 hash 函数进行设置
     Vin: List[Input]
     Vout: List[Output]
+    _memo: Optional[Tuple[tuple, str]] = field(default=None, init=False, repr=False, compare=False)   # hash() 的缓存：(内容指纹, 哈希)
 
     def __post_init__(self):
         if len(self.Vout) <= 0 :
             raise Exception("len(Vout) <= 0")
 
-    def verify(self,bc):
+    def verify(self,bc,check_signatures:bool=True):
         """
         1.检查 vin 是否在区块中
         2.检查余额是否足够
         3.Pay-to-Public-Key P2PK 进行身份验证
-        :return:
+
+        :param check_signatures: 为 False 时跳过签名校验，用于签名已经由 VerifyEngine 批量校验过的情况
+        :return: 手续费，即输入总额 - 输出总额
         """
         # 检查vin是否在区块中（这里假设可以通过某种方式查询区块数据，暂未实现具体逻辑）
         usable_money = 0
+        seen_outpoints = set()
         for input_obj in self.Vin:
+            # 同一笔交易中不能重复花费同一个输出
+            outpoint = (input_obj.txid, input_obj.vout)
+            if outpoint in seen_outpoints:
+                raise Exception("vin 重复花费")
+            seen_outpoints.add(outpoint)
             # 假设这里有一个函数可以检查输入是否在区块中，比如 check_input_in_block(input_obj.txid, input_obj.vout)
             is_in_block,num_money = self._check_input_in_block(input_obj.txid, input_obj.vout,bc)
             if not is_in_block:
@@ -70,7 +207,7 @@ class Transaction:
 
             # 验证钱是不是你的
             # 验证输入交易的签名是否有效
-            if not self.verify_input_signature(input_obj):
+            if check_signatures and not self.verify_input_signature(input_obj):
                 raise Exception("钱不是你的")
         expend_money = 0
         for output_obj in self.Vout:
@@ -79,49 +216,67 @@ class Transaction:
             raise Exception("花的钱太多了")
         # 验证通过后，进行求hash
         self._set_hash()
+        return usable_money - expend_money
     def sign(self, priv_key):
-        signing_key = SigningKey.from_string(bytes.fromhex(priv_key), curve=SECP256k1)
+        signing_key = get_signing_key(priv_key)   # 同一个私钥只解析一次
         for input_obj in self.Vin:
-            message = f"{input_obj.txid}{input_obj.vout}".encode()
-            signature = signing_key.sign(message)
+            signature = signing_key.sign(input_obj.signing_message())
             input_obj.signature = signature.hex()   # A 对交易进行了签名，接下来就需要验证
 
     def _set_hash(self)->None:
         self.Hash = self.hash()
+    def serialize(self)->bytes:
+        '''
+        交易的规范序列化，交易哈希就是它的 sha256，不包含 Hash 字段本身
+        Version + 每个输入的 txid、vout、signature、pubkey + 每个输出的金额、公钥，变长字段带长度前缀
+        '''
+        parts = [_U32.pack(self.Version), _U32.pack(len(self.Vin))]
+        for input_obj in self.Vin:
+            parts.append(_pack_field(input_obj._txid))
+            parts.append(_U32.pack(input_obj.vout))
+            parts.append(_pack_field(input_obj._signature))
+            parts.append(_pack_field(input_obj._pubkey))
+        parts.append(_U32.pack(len(self.Vout)))
+        for output_obj in self.Vout:
+            parts.append(_pack_value(output_obj.value))
+            parts.append(_pack_field(output_obj._pubkey))
+        return b''.join(parts)
+    def _fingerprint(self)->tuple:
+        '''
+        参与哈希的全部字段，比规范序列化 + sha256 便宜；任何字段被修改（包括替换 Vin、Vout 列表）都会改变指纹
+        浮点金额取 float.hex()，与同值的整数以及 0.0 与 -0.0 都能区分开
+        '''
+        return (self.Version,
+                tuple([(i._txid, i.vout, i._signature, i._pubkey) for i in self.Vin]),
+                tuple([(o.value if type(o.value) is int else float.hex(o.value), o._pubkey) for o in self.Vout]))
     def hash(self)->str:
-        transaction_data = {
-            "Vin": [{"txid": input_obj.txid, "vout": input_obj.vout,
-                     "signature": input_obj.signature, "pubkey": input_obj.pubkey}
-                    for input_obj in self.Vin],
-            "Vout": [{"value": output_obj.value, "pubkey": output_obj.pubkey} for output_obj in self.Vout]
-        }
-        json_data = json.dumps(transaction_data)
-        self.Hash = hashlib.sha256(json_data.encode()).hexdigest()
-        return self.Hash
+        '''
+        由交易内容计算的哈希；不修改 self.Hash，需要时调用 _set_hash
+        结果按内容指纹缓存，交易被修改后自动重新计算
+        '''
+        fingerprint = self._fingerprint()
+        if self._memo is None or self._memo[0] != fingerprint:
+            self._memo = (fingerprint, hashlib.sha256(self.serialize()).hexdigest())
+        return self._memo[1]
 
     def _check_input_in_block(self, txid:str, vout:int, bc)->(bool, int):
         """
-        检查来源是否在区块中，并返回钱的数量
+        检查来源是否在区块中且尚未被花费，并返回钱的数量
+        通过 bc.utxo_set 按 (txid, vout) 查询，复杂度 O(1)
 
         :param txid: 哪一笔交易
         :param vout: 交易中那一笔输出
         :return: (bool,int) : 是否在区块中，钱是多少
         """
-
-        for block in bc.blocks:
-            for transaction in block.Transactions:
-                if transaction.Hash == txid and len(transaction.Vout)>vout:
-                    usable_money = transaction.Vout[vout].value
-                    return True, usable_money
-
-        return False,0
+        output = bc.utxo_set.get(txid, vout)
+        if output is None:
+            return False,0
+        return True, output.value
     def verify_input_signature(self,input_obj):
-        verifying_key = ecdsa.VerifyingKey.from_string(bytes.fromhex(input_obj.pubkey), curve=ecdsa.SECP256k1)
-        message = f"{input_obj.txid}{input_obj.vout}".encode()
-        try:
-            return verifying_key.verify(bytes.fromhex(input_obj.signature), message)
-        except ecdsa.BadSignatureError:
-            return False
+        return verify_signature(input_obj.pubkey, input_obj.signing_message(), input_obj.signature)
+    def signature_jobs(self)->List[SignatureJob]:
+        """每个输入对应一个 (pubkey, message, signature)，交给 VerifyEngine 批量校验"""
+        return [(i.pubkey, i.signing_message(), i.signature) for i in self.Vin]
     def to_dict(self)->Dict:
         return {
             "Hash": self.Hash,
@@ -135,7 +290,7 @@ class Transaction:
         transaction = Transaction(Hash=t['Hash'], Vin=vin, Vout=vout)
         return transaction
 
-@dataclass
+@dataclass(slots=True)
 class Block:
     Timestamp: datetime
     Transactions: List[Transaction]
@@ -144,26 +299,79 @@ class Block:
     Nonce: int
     Height: int
     Difficulty: int = field(default=4)  # 添加难度字段，默认为4，可根据需要调整
-    Merkle_Tree: List[List[str]] = field(default=None)
-    def __post_init__(self):
-        self._build_merkle_tree()
+    _tx_positions: Dict[str, int] = field(default=None, init=False, repr=False, compare=False)  # 交易哈希 -> 区块内位置，第一次查询时才建立
+    _merkle_levels: List[bytes] = field(default=None, init=False, repr=False, compare=False)   # 叶子之上的各层，每层为 32 字节摘要紧凑拼接
+    def _positions(self) -> Dict[str, int]:
+        if self._tx_positions is None:
+            self._tx_positions = {}
+            for i, tx in enumerate(self.Transactions):
+                self._tx_positions.setdefault(tx.Hash, i)
+        return self._tx_positions
+    def _levels(self) -> List[bytes]:
+        # merkle 树在第一次用到时才建立，加载区块时不必为每个区块计算
+        if self._merkle_levels is None:
+            self._build_merkle_tree()
+        return self._merkle_levels
     def _build_merkle_tree(self):
         # 参考：https://blog.csdn.net/wo541075754/article/details/54632929
-        self.Merkle_Tree = []
-        l = [h.Hash for h in self.Transactions]
-        self.Merkle_Tree.insert(0, l)
-
-        while len(self.Merkle_Tree[0]) > 1:
+        # 叶子就是交易哈希本身，不再额外保存；奇数个节点时最后一个直接提升到上一层
+        levels = []
+        if len(self.Transactions) <= 1:
+            self._merkle_levels = levels
+            return
+        level = [bytes.fromhex(tx.Hash) for tx in self.Transactions]
+        while len(level) > 1:
             new_level = []
-            for i in range(0, len(self.Merkle_Tree[0]), 2):
-                left = self.Merkle_Tree[0][i]
-                right = self.Merkle_Tree[0][i + 1] if i + 1 < len(self.Merkle_Tree[0]) else None
-                if right is None:
-                    new_hash = left
+            for i in range(0, len(level), 2):
+                if i + 1 < len(level):
+                    new_level.append(hashlib.sha256(level[i] + level[i + 1]).digest())
+                else:
+                    new_level.append(level[i])
+            levels.append(b''.join(new_level))
+            level = new_level
+        self._merkle_levels = levels
+
+    @property
+    def Merkle_Tree(self) -> List[List[str]]:
+        """以 hex 字符串表示的完整 merkle 树，第 0 层为根，最后一层为交易哈希"""
+        tree = [[tx.Hash for tx in self.Transactions]]
+        for level in self._levels():
+            tree.insert(0, [level[i:i + 32].hex() for i in range(0, len(level), 32)])
+        return tree
+
+    @property
+    def merkle_root(self) -> str:
+        levels = self._levels()
+        if levels:
+            return levels[-1].hex()
+        return self.Transactions[0].Hash if self.Transactions else ""
+
+    def merkle_proof(self, txid: str) -> Optional[List[Tuple[str, str]]]:
+        """
+        生成交易在本区块中的 merkle 证明，长度为 O(log n)
+
+        :param txid: 交易哈希
+        :return: [(兄弟节点哈希, 'L'|'R')]，从叶子到根的顺序，'L' 表示兄弟在左边；交易不在区块中返回 None
+        """
+        index = self._positions().get(txid)
+        if index is None:
+            return None
+        proof = []
+        count = len(self.Transactions)
+        leaves = self.Transactions
+        levels = self._levels()
+        for depth in range(len(levels)):
+            sibling = index ^ 1
+            if sibling < count:
+                if depth == 0:
+                    sibling_hash = leaves[sibling].Hash
                 else:
-                    new_hash = hashlib.sha256(left.encode() + right.encode()).hexdigest()
-                new_level.append(new_hash)
-            self.Merkle_Tree.insert(0, new_level)
+                    level = levels[depth - 1]
+                    sibling_hash = level[sibling * 32:sibling * 32 + 32].hex()
+                proof.append((sibling_hash, 'L' if sibling < index else 'R'))
+            index //= 2
+            count = (count + 1) // 2
+        return proof
 
     @staticmethod
     def new_block(transactions:List[Transaction], prev_hash:str, height:int,difficulty:int)->'Block':
@@ -178,23 +386,49 @@ class Block:
         '''
         timestamp = datetime.now(timezone.utc)
         return Block(timestamp, transactions, prev_hash, "",0,height,difficulty)
+    def header_prefix(self)->bytes:
+        '''
+        区块头的规范序列化中 Nonce 之前的部分：PrevBlockHash、merkle 根、Timestamp、Height、Difficulty
+        区块哈希因此覆盖全部交易；挖矿时只需要对它计算一次 sha256 的中间状态，之后每次只追加 nonce
+        '''
+        return b''.join((_pack_field(_to_bytes(self.PrevBlockHash)), _pack_field(_to_bytes(self.merkle_root)),
+                         _HEADER_FIELDS.pack(_timestamp_micros(self.Timestamp), self.Height, self.Difficulty)))
+    @staticmethod
+    def hash_header(prefix_state, nonce:int)->str:
+        '''
+        在 header_prefix 的 sha256 中间状态上追加 nonce，再取一次 sha256，得到区块哈希
+
+        :param prefix_state: hashlib.sha256(header_prefix())，不会被修改
+        :param nonce:
+        :return:
+        '''
+        inner = prefix_state.copy()
+        inner.update(_NONCE.pack(nonce))
+        return hashlib.sha256(inner.digest()).hexdigest()
+    def compute_hash(self)->str:
+        '''按区块头字段计算哈希：对 header_prefix() + Nonce 取两次sha256'''
+        return Block.hash_header(hashlib.sha256(self.header_prefix()), self.Nonce)
     def set_hash(self)->str:
         '''
         计算当前hash值
-        计算方法如下：将block的Timestamp和PrevBlockHash链接成字符串，对其使用sha256函数取哈希值
         :return:
         '''
-        header_bin = (str(self.Timestamp) + str(self.PrevBlockHash)).encode()
-        inner_hash = hashlib.sha256(header_bin).hexdigest().encode()
-        outer_hash = hashlib.sha256(inner_hash).hexdigest()
-        self.Hash = outer_hash
-        return outer_hash
+        self.Hash = self.compute_hash()
+        return self.Hash
+    def check_pow(self)->bool:
+        '''检查区块哈希是否正确且满足 Difficulty（哈希前 Difficulty 位十六进制为 0）'''
+        return self.Hash.startswith('0' * self.Difficulty) and self.Hash == self.compute_hash()
+
+    def work(self)->int:
+        '''区块的工作量：平均需要尝试 16 ** Difficulty 次才能找到满足难度的哈希'''
+        return 16 ** self.Difficulty
 
     def is_transaction_in(self, transaction_hash: str):
-        for tx in self.Transactions:
-            if tx.Hash == transaction_hash:
-                return True
-        return False
+        return transaction_hash in self._positions()
+    def header(self)->'BlockHeader':
+        '''只包含区块头的轻量对象，用于先同步区块头'''
+        return BlockHeader(self.Timestamp, self.PrevBlockHash, self.Hash, self.Nonce,
+                           self.Height, self.Difficulty, self.merkle_root)
     def to_dict(self):
         return {
             'Timestamp': self.Timestamp.isoformat(),
@@ -224,46 +458,315 @@ class Block:
             Difficulty=b['Difficulty'],
             Hash=b['Hash'],
             Nonce=b['Nonce'],
-            Merkle_Tree=b.get('Merkle_Tree', [])  # 增加 Merkle_Tree 成员变量，默认为空列表
-        )
+        )   # Merkle_Tree 由交易重新计算，不信任传入的值
         return block
 
 
+@dataclass(slots=True)
+class BlockHeader:
+    '''区块头：不含交易，只有 merkle 根'''
+    Timestamp: datetime
+    PrevBlockHash: str
+    Hash: str
+    Nonce: int
+    Height: int
+    Difficulty: int
+    MerkleRoot: str
+
+    # 区块哈希只依赖区块头字段，和 Block 使用同一套计算
+    header_prefix = Block.header_prefix
+    compute_hash = Block.compute_hash
+    check_pow = Block.check_pow
+    work = Block.work
+
+    @property
+    def merkle_root(self) -> str:
+        return self.MerkleRoot
+
+    def to_dict(self) -> Dict:
+        return {
+            'Timestamp': self.Timestamp.isoformat(),
+            'PrevBlockHash': self.PrevBlockHash,
+            'Hash': self.Hash,
+            'Nonce': self.Nonce,
+            'Height': self.Height,
+            'Difficulty': self.Difficulty,
+            'MerkleRoot': self.MerkleRoot
+        }
+
+    @staticmethod
+    def from_dict(h: Dict) -> 'BlockHeader':
+        return BlockHeader(datetime.fromisoformat(h['Timestamp']), h['PrevBlockHash'], h['Hash'],
+                           h['Nonce'], h['Height'], h['Difficulty'], h['MerkleRoot'])
+
+def verify_merkle_proof(root: str, txid: str, proof: List[Tuple[str, str]]) -> bool:
+    '''
+    校验 Block.merkle_proof 生成的证明，不需要区块中的其他交易
+
+    :param root: 区块的 merkle 根
+    :param txid: 交易哈希
+    :param proof: [(兄弟节点哈希, 'L'|'R')]
+    :return: txid 是否在以 root 为根的 merkle 树中
+    '''
+    try:
+        node = bytes.fromhex(txid)
+        for sibling_hash, side in proof:
+            sibling = bytes.fromhex(sibling_hash)
+            node = hashlib.sha256(sibling + node if side == 'L' else node + sibling).digest()
+    except ValueError:
+        return False
+    return node.hex() == root
+
+@dataclass
+class ChainUpdate:
+    """BlockChain.accept_block 对主链的改变"""
+    connected: List[Block] = field(default_factory=list)      # 接入主链的区块，按高度从低到高
+    disconnected: List[Block] = field(default_factory=list)   # 回滚出主链的区块，从原来的最新区块开始
+    orphan: bool = False                                      # 父区块未知，区块没有被保存
+    fork_height: Optional[int] = None                         # 发生重组时，新旧分支第一个不同区块的高度
+
+@dataclass
+class BranchBlock:
+    """不在主链上的区块（侧链），记录它在区块树中的高度和累计工作量"""
+    block: Block
+    height: int
+    work: int
+
 @dataclass
 class BlockChain:
-    def __init__(self,blocks:List[Block]=[],current_hash:str="",height:int=0):
-        self.blocks:List[Block] = blocks
+    MAX_REORG_DEPTH = 100   # 保留最近多少个区块的回滚记录，更深的重组需要从头重放 UTXO
+
+    def __init__(self,blocks:List[Block]=None,current_hash:str="",height:int=0):
+        self.blocks:List[Block] = blocks if blocks is not None else []
         self.current_hash:str = current_hash  # 最新区块的哈希值
         self.height:int = height         # 区块链的高度
+        self.utxo_set:UTXOSet = UTXOSet()                 # 未花费输出集合，随 add_block 增量更新
+        self.block_index:Dict[str,int] = {}               # 区块哈希 -> 高度
+        self.tx_index:Dict[str,Tuple[int,int]] = {}       # 交易哈希 -> (高度, 区块内位置)
+        self.chain_work:List[int] = []                    # 主链每个高度的累计工作量
+        self.undo:Dict[str,List] = {}                     # 区块哈希 -> 该区块花费掉的 (outpoint, Output)，回滚时恢复
+        self.side_blocks:Dict[str,BranchBlock] = {}       # 侧链区块，工作量超过主链时重组
+        # 只遍历一遍：blocks 可以是按需解码的 storage.LazyBlockList
+        for h, block in enumerate(self.blocks):
+            self._record(block, h, self.utxo_set.apply_block(block))
+
+    @staticmethod
+    def from_snapshot(blocks:List[Block],snapshot)->'BlockChain':
+        '''
+        从快照恢复区块链，只重放快照之后的区块
 
+        :param blocks: 全部区块，其中前 snapshot.height 个必须与快照一致
+        :param snapshot: snapshot.ChainSnapshot
+        '''
+        chain = BlockChain([], snapshot.block_hash, snapshot.height)
+        chain.blocks = blocks
+        chain.utxo_set = snapshot.utxo_set
+        chain.tx_index = snapshot.tx_index
+        chain.block_index = {header.Hash: h for h, header in enumerate(snapshot.headers)}
+        for header in snapshot.headers:
+            chain.chain_work.append(chain.tip_work() + header.work())
+        # 快照之前的区块没有回滚记录，重组到快照之前时从头重放
+        for h in range(snapshot.height, len(blocks)):
+            block = blocks[h]
+            chain._record(block, h, chain.utxo_set.apply_block(block))
+            chain.current_hash = block.Hash
+            chain.height += 1
+        return chain
     def __getitem__(self, index):
         return self.blocks[index]
     def __len__(self):
         return self.height
-    def add_block(self,block:Block)->bool:
+    def tip_work(self)->int:
+        '''主链的累计工作量'''
+        return self.chain_work[-1] if self.chain_work else 0
+    def _record(self,block:Block,height:int,spent:List)->None:
+        '''区块已经应用到 UTXO 集合之后，更新索引、累计工作量和回滚记录'''
+        self._index_block(block, height)
+        self.chain_work.append(self.tip_work() + block.work())
+        self.undo[block.Hash] = spent
+        # 按加入顺序只保留最近 MAX_REORG_DEPTH 个区块的回滚记录
+        while len(self.undo) > self.MAX_REORG_DEPTH:
+            del self.undo[next(iter(self.undo))]
+    def _connect(self,block:Block)->None:
+        '''把父区块为当前最新区块的 block 接到主链末尾'''
+        spent = self.utxo_set.apply_block(block)
+        self.blocks.append(block)
+        self._record(block, self.height, spent)
+        self.current_hash = block.Hash
+        self.height += 1
+    def _unindex_block(self,block:Block,height:int)->None:
+        self.block_index.pop(block.Hash, None)
+        for i, transaction in enumerate(block.Transactions):
+            if self.tx_index.get(transaction.Hash) == (height, i):
+                del self.tx_index[transaction.Hash]
+    def _disconnect(self)->BranchBlock:
         '''
-        添加区块，传入一个block对象，加入blocks数组并更新current_hash和height
-        :return:
+        用回滚记录撤销最新区块：恢复它花费掉的输出，删除它产生的输出
+        代价只与这一个区块的大小有关
+
+        :return: 被撤销的区块及其高度、累计工作量
+        '''
+        height = self.height - 1
+        block = self.blocks[height]
+        for (txid, vout), output in self.undo.pop(block.Hash):
+            self.utxo_set.add(txid, vout, output)
+        # 区块内先产生又被花费的输出在上面被恢复了，这里一起删掉
+        for transaction in block.Transactions:
+            for vout in range(len(transaction.Vout)):
+                self.utxo_set.spend(transaction.Hash, vout)
+        self._unindex_block(block, height)
+        work = self.chain_work.pop()
+        self.blocks.pop()
+        self.height = height
+        self.current_hash = block.PrevBlockHash
+        return BranchBlock(block, height, work)
+    def _rewind(self,fork_height:int)->List[BranchBlock]:
+        '''
+        把主链回滚到只剩 fork_height 个区块，返回被撤销的区块（从最新的开始）
+        有回滚记录时逐块撤销，否则（重组深度超过 MAX_REORG_DEPTH）从头重放 UTXO
+        '''
+        hashes = [self.blocks[h].Hash for h in range(fork_height, self.height)]
+        if all(block_hash in self.undo for block_hash in hashes):
+            return [self._disconnect() for _ in hashes]
+        removed = []
+        while self.height > fork_height:
+            height = self.height - 1
+            block = self.blocks.pop()
+            self._unindex_block(block, height)
+            removed.append(BranchBlock(block, height, self.chain_work.pop()))
+            self.height = height
+            self.current_hash = block.PrevBlockHash
+        self.utxo_set = UTXOSet()
+        self.undo = {}
+        for h in range(fork_height):
+            block = self.blocks[h]
+            spent = self.utxo_set.apply_block(block)
+            if h >= fork_height - self.MAX_REORG_DEPTH:
+                self.undo[block.Hash] = spent
+        return removed
+    def _locate(self,block_hash:str)->Optional[Tuple[int,int]]:
+        '''区块树中某个区块的 (高度, 累计工作量)，未知区块返回 None'''
+        height = self.block_index.get(block_hash)
+        if height is not None:
+            return height, self.chain_work[height]
+        node = self.side_blocks.get(block_hash)
+        if node is not None:
+            return node.height, node.work
+        return None
+    def _prune_side_blocks(self)->None:
+        '''丢掉太旧的侧链区块，它们已经不可能再被重组回主链'''
+        lowest = self.height - self.MAX_REORG_DEPTH
+        for block_hash in [h for h, node in self.side_blocks.items() if node.height < lowest]:
+            del self.side_blocks[block_hash]
+    def accept_block(self,block:Block,check:Callable[[Block,'BlockChain'],None]=None)->ChainUpdate:
+        '''
+        把区块加入区块树，按累计工作量选择主链
+
+        - 父区块是最新区块：直接接到主链末尾
+        - 父区块在主链中间或侧链上：保存为侧链，累计工作量超过主链时重组，
+          用回滚记录撤销分叉点之后的主链区块，再依次接入新分支
+        - 父区块未知：孤儿区块，不保存，由调用方暂存
+
+        :param check: 每个区块接入主链之前调用 check(block, self)，此时最新区块就是它的父区块；
+                      抛出异常时区块不会接入，重组到一半会恢复原来的主链，异常继续向上抛出
+        :return: ChainUpdate
         '''
         assert(block.Hash is not None)
         assert(len(block.Transactions)!=0)
-        if block.PrevBlockHash != self.current_hash: # self.blocks 中至少有一个
-            # 孤儿交易
-            return False
-        self.blocks.append(block)
-        self.current_hash = block.Hash
-        self.height += 1
-        return True
+        if block.Hash in self.block_index or block.Hash in self.side_blocks:
+            return ChainUpdate()
+        if block.PrevBlockHash == self.current_hash:
+            if check is not None:
+                check(block, self)
+            self._connect(block)
+            return ChainUpdate(connected=[block])
+        parent = self._locate(block.PrevBlockHash)
+        if parent is None:
+            return ChainUpdate(orphan=True)
+        node = BranchBlock(block, parent[0] + 1, parent[1] + block.work())
+        self.side_blocks[block.Hash] = node
+        if node.work <= self.tip_work():
+            # 工作量相同时保留先收到的链
+            self._prune_side_blocks()
+            return ChainUpdate()
+        # 从新的最新区块往回找到分叉点
+        branch = []
+        block_hash = block.Hash
+        while block_hash in self.side_blocks:
+            branch.append(self.side_blocks[block_hash])
+            block_hash = self.side_blocks[block_hash].block.PrevBlockHash
+        if block_hash not in self.block_index:
+            # 分支的祖先已经被清理，无法接回主链
+            return ChainUpdate()
+        fork_height = self.block_index[block_hash] + 1
+        removed = self._rewind(fork_height)
+        for old in removed:
+            self.side_blocks[old.block.Hash] = old
+        for new in reversed(branch):
+            try:
+                if check is not None:
+                    check(new.block, self)
+            except Exception:
+                self._abort_reorg(fork_height, removed, new.block)
+                raise
+            del self.side_blocks[new.block.Hash]
+            self._connect(new.block)
+        self._prune_side_blocks()
+        return ChainUpdate(connected=[new.block for new in reversed(branch)],
+                           disconnected=[old.block for old in removed],
+                           fork_height=fork_height)
+    def _abort_reorg(self,fork_height:int,removed:List[BranchBlock],invalid:Block)->None:
+        '''新分支中的 invalid 没有通过检查：撤销已经接入的新分支区块，接回原来的主链，丢弃 invalid 及其后代'''
+        while self.height > fork_height:
+            node = self._disconnect()
+            self.side_blocks[node.block.Hash] = node
+        for old in reversed(removed):
+            del self.side_blocks[old.block.Hash]
+            self._connect(old.block)
+        bad = {invalid.Hash}
+        for block_hash, node in sorted(self.side_blocks.items(), key=lambda item: item[1].height):
+            if node.block.PrevBlockHash in bad:
+                bad.add(block_hash)
+        for block_hash in bad:
+            self.side_blocks.pop(block_hash, None)
+    def add_block(self,block:Block)->bool:
+        '''
+        添加区块，传入一个block对象，见 accept_block
+        :return: 区块是否在主链上
+        '''
+        return bool(self.accept_block(block).connected)
     def get_block(self,block_hash:str)->Block:
         '''
         通过 block 的 hash 值来查找区块，返回一个block对象
         :param block_hash:
         :return:
         '''
-        for block in self.blocks:
-            if block.Hash == block_hash:
-                return block
-        return None
+        height = self.block_index.get(block_hash)
+        if height is None:
+            node = self.side_blocks.get(block_hash)
+            return node.block if node is not None else None
+        return self.blocks[height]
+    def get_transaction(self,txid:str)->Optional[Transaction]:
+        '''通过交易哈希查找已上链的交易'''
+        position = self.tx_index.get(txid)
+        if position is None:
+            return None
+        height, i = position
+        return self.blocks[height].Transactions[i]
+    def header(self,height:int)->'BlockHeader':
+        '''高度为 height 的区块头；blocks 常驻区块头时不需要解码区块'''
+        headers = getattr(self.blocks, 'header', None)
+        return headers(height) if headers is not None else self.blocks[height].header()
+    def block_hashes(self,start:int,end:int)->List[str]:
+        '''主链上高度 [start, end) 的区块哈希，不解码区块，也不生成区块头'''
+        headers = getattr(self.blocks, 'header', None)
+        if headers is not None:
+            return [headers(h).Hash for h in range(start, end)]
+        return [self.blocks[h].Hash for h in range(start, end)]
+    def _index_block(self,block:Block,height:int)->None:
+        self.block_index[block.Hash] = height
+        for i, transaction in enumerate(block.Transactions):
+            self.tx_index[transaction.Hash] = (height, i)
     def to_dict(self)->Dict:
         blocks_data = [block.to_dict() for block in self.blocks]
         blockchain_data = {
@@ -274,11 +777,35 @@ class BlockChain:
         with open(file_path, 'w') as f:
             json.dump(self.to_dict(), f, indent=4)
     def get_blocks_after_time(self,timestamp:datetime)->List[Block]:
-        res = []
-        for block in self.blocks[::-1]:
-            if block.Timestamp > timestamp:
-                res.insert(0, block)
-        return res
+        return [self.blocks[h] for h in range(self.height) if self.header(h).Timestamp > timestamp]
+    def get_locator(self)->List[str]:
+        '''
+        区块定位器：从最新区块往回，前 10 个逐个取，之后步长翻倍，最后是创世区块
+        对方用它找到两条链最后一个共同的区块，长度为 O(log n)
+        '''
+        locator = []
+        height = self.height - 1
+        step = 1
+        while height > 0:
+            locator.append(self.header(height).Hash)
+            if len(locator) >= 10:
+                step *= 2
+            height -= step
+        if self.height > 0:
+            locator.append(self.header(0).Hash)
+        return locator
+    def find_fork_height(self,locator:List[str])->int:
+        '''
+        根据对方的定位器找到对方缺少的第一个区块的高度
+
+        :param locator: 对方的 get_locator()
+        :return: 第一个在本链上的哈希的高度 + 1，都不在则为 0
+        '''
+        for block_hash in locator:
+            height = self.block_index.get(block_hash)
+            if height is not None:
+                return height + 1
+        return 0
     def get_last_block_hash(self):
         return self.current_hash
     @staticmethod
@@ -355,6 +882,8 @@ if __name__ == '__main__':
     )
     transfer_block.set_hash()
     print(transfer_block.Merkle_Tree)
+    print(verify_merkle_proof(transfer_block.merkle_root, transfer_transaction.Hash,
+                              transfer_block.merkle_proof(transfer_transaction.Hash)))
     # blockchain.add_block(transfer_block)
 
     # 保存区块链到文件（这里只是示例，实际应用中文件路径等可根据需求调整）
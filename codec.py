@@ -0,0 +1,419 @@
+import math
+import re
+import struct
+from datetime import datetime
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple
+
+from block import Block, BlockHeader, Input, Output, Transaction, intern_pubkey
+from utxo import OutPoint, UTXOSet
+
+# 二进制格式的 Content-Type，请求和响应按它协商使用二进制还是 JSON
+BINARY_CONTENT_TYPE = 'application/x-blockchain'
+
+# 所有整数都是小端序；变长字段为 u16 长度 + 内容，哈希、公钥、签名直接存原始字节而不是 hex
+_U8 = struct.Struct('<B')
+_U16 = struct.Struct('<H')
+_U32 = struct.Struct('<I')
+_INPUT_VOUT = _U32
+_INT_VALUE = struct.Struct('<Bq')      # 类型标记 0 + 整数金额
+_FLOAT_VALUE = struct.Struct('<Bd')    # 类型标记 1 + 浮点金额
+_BLOCK_FIELDS = struct.Struct('<QII')  # Nonce, Height, Difficulty
+_TX_POSITION = struct.Struct('<II')    # 交易所在的高度, 区块内位置
+
+
+def _pack_bytes(data: bytes) -> bytes:
+    return _U16.pack(len(data)) + data
+
+
+def _pack_hex(value: str) -> bytes:
+    return _pack_bytes(bytes.fromhex(value))
+
+
+# 能无损编码的字段格式：hex 必须是小写、偶数长度、不超过 u16 字节，解码后才与原值完全相同
+_CANONICAL_HEX = re.compile('(?:[0-9a-f]{2})*')
+_MAX_FIELD_BYTES = 0xFFFF
+
+
+def _check_hex(name: str, value) -> None:
+    if not isinstance(value, str) or len(value) > 2 * _MAX_FIELD_BYTES or not _CANONICAL_HEX.fullmatch(value):
+        raise ValueError(f"{name} must be lowercase hex of even length, got {str(value)[:80]!r}")
+
+
+def _check_uint(name: str, value, bits: int) -> None:
+    if not isinstance(value, int) or isinstance(value, bool) or not 0 <= value < 1 << bits:
+        raise ValueError(f"{name} must be an unsigned {bits}-bit integer, got {value!r}")
+
+
+def check_transaction_format(tx: Transaction) -> None:
+    """
+    检查交易的每个字段都能被本模块编码，且编解码前后不变，否则抛出 ValueError
+
+    交易进入交易池、区块进入区块链之前调用：格式不对的交易之后写区块存储、快照或 /sync 时才会失败
+    """
+    _check_uint("Version", tx.Version, 8)
+    _check_hex("transaction hash", tx.Hash)
+    for input_obj in tx.Vin:
+        _check_hex("input txid", input_obj.txid)
+        _check_uint("input vout", input_obj.vout, 32)
+        _check_hex("input signature", input_obj.signature)
+        _check_hex("input pubkey", input_obj.pubkey)
+    for output_obj in tx.Vout:
+        value = output_obj.value
+        if isinstance(value, bool) or not isinstance(value, (int, float)) \
+                or isinstance(value, int) and not value < 1 << 63:
+            raise ValueError(f"output value must be a 64-bit integer or a float, got {value!r}")
+        # 负数金额与其他输出相抵后可以凭空增发，零金额的输出没有意义
+        if not 0 < value < math.inf:
+            raise ValueError(f"output value must be positive and finite, got {value!r}")
+        _check_hex("output pubkey", output_obj.pubkey)
+
+
+def check_block_format(block: Block) -> None:
+    """检查区块头和全部交易都能被本模块编码，见 check_transaction_format"""
+    if not isinstance(block.Timestamp, datetime):
+        raise ValueError("block timestamp must be a datetime")
+    _check_hex("previous block hash", block.PrevBlockHash)
+    _check_hex("block hash", block.Hash)
+    _check_uint("Nonce", block.Nonce, 64)
+    _check_uint("Height", block.Height, 32)
+    _check_uint("Difficulty", block.Difficulty, 32)
+    for tx in block.Transactions:
+        check_transaction_format(tx)
+
+
+class _Reader:
+    """顺序读取二进制数据，越界时抛出 ValueError"""
+
+    def __init__(self, data: bytes, offset: int = 0):
+        self.data = bytes(data)
+        self.offset = offset
+
+    def unpack(self, fmt: struct.Struct) -> Tuple:
+        try:
+            values = fmt.unpack_from(self.data, self.offset)
+        except struct.error as e:
+            raise ValueError(f"truncated data: {e}")
+        self.offset += fmt.size
+        return values
+
+    def _span(self) -> Tuple[int, int]:
+        """读取 u16 长度，返回内容的 [start, end)"""
+        start = self.offset + 2
+        end = start + int.from_bytes(self.data[self.offset:start], 'little')
+        if end > len(self.data):
+            raise ValueError("truncated data")
+        self.offset = end
+        return start, end
+
+    def read_bytes(self) -> bytes:
+        start, end = self._span()
+        return self.data[start:end]
+
+    def read_hex(self) -> str:
+        start, end = self._span()
+        return self.data[start:end].hex()
+
+
+def _encode_input(input_obj: Input) -> bytes:
+    return b''.join((
+        _pack_hex(input_obj.txid),
+        _INPUT_VOUT.pack(input_obj.vout),
+        _pack_hex(input_obj.signature),
+        _pack_hex(input_obj.pubkey),
+    ))
+
+
+def _decode_input(reader: _Reader) -> Input:
+    # Input/Output 内部就是原始字节，直接传入省去 hex 转换
+    txid = reader.read_bytes()
+    (vout,) = reader.unpack(_INPUT_VOUT)
+    return Input(txid=txid, vout=vout, signature=reader.read_bytes(), pubkey=reader.read_bytes())
+
+
+def _encode_output(output_obj: Output) -> bytes:
+    # 保留整数和浮点数的区别，保证 to_dict 和交易哈希在编解码前后一致
+    if isinstance(output_obj.value, int):
+        value = _INT_VALUE.pack(0, output_obj.value)
+    else:
+        value = _FLOAT_VALUE.pack(1, output_obj.value)
+    return value + _pack_hex(output_obj.pubkey)
+
+
+def _decode_output(reader: _Reader) -> Output:
+    tag = reader.data[reader.offset] if reader.offset < len(reader.data) else None
+    if tag == 0:
+        _, value = reader.unpack(_INT_VALUE)
+    elif tag == 1:
+        _, value = reader.unpack(_FLOAT_VALUE)
+    else:
+        raise ValueError(f"unknown value tag {tag}")
+    return Output(value=value, pubkey=reader.read_bytes())
+
+
+def _write_transaction(tx: Transaction, parts: List[bytes]) -> None:
+    parts.append(_U8.pack(tx.Version))
+    parts.append(_pack_hex(tx.Hash))
+    parts.append(_U32.pack(len(tx.Vin)))
+    parts.extend(_encode_input(i) for i in tx.Vin)
+    parts.append(_U32.pack(len(tx.Vout)))
+    parts.extend(_encode_output(o) for o in tx.Vout)
+
+
+def _read_transaction(reader: _Reader) -> Transaction:
+    reader.unpack(_U8)  # Version，目前只有 v1
+    tx_hash = reader.read_hex()
+    (n_in,) = reader.unpack(_U32)
+    vin = [_decode_input(reader) for _ in range(n_in)]
+    (n_out,) = reader.unpack(_U32)
+    vout = [_decode_output(reader) for _ in range(n_out)]
+    return Transaction(Hash=tx_hash, Vin=vin, Vout=vout)
+
+
+def encode_transaction(tx: Transaction) -> bytes:
+    parts = []
+    _write_transaction(tx, parts)
+    return b''.join(parts)
+
+
+def decode_transaction(data: bytes) -> Transaction:
+    return _read_transaction(_Reader(data))
+
+
+def _write_block(block: Block, parts: List[bytes]) -> None:
+    # Timestamp 按 isoformat 保存，保证 str(Timestamp) 不变，区块哈希可以重新计算
+    parts.append(_pack_bytes(block.Timestamp.isoformat().encode()))
+    parts.append(_pack_hex(block.PrevBlockHash))
+    parts.append(_pack_hex(block.Hash))
+    parts.append(_BLOCK_FIELDS.pack(block.Nonce, block.Height, block.Difficulty))
+    parts.append(_U32.pack(len(block.Transactions)))
+    for tx in block.Transactions:
+        _write_transaction(tx, parts)
+
+
+def _read_block(reader: _Reader) -> Block:
+    timestamp = datetime.fromisoformat(reader.read_bytes().decode())
+    prev_hash = reader.read_hex()
+    block_hash = reader.read_hex()
+    nonce, height, difficulty = reader.unpack(_BLOCK_FIELDS)
+    (n_tx,) = reader.unpack(_U32)
+    transactions = [_read_transaction(reader) for _ in range(n_tx)]
+    return Block(Timestamp=timestamp, Transactions=transactions, PrevBlockHash=prev_hash,
+                 Hash=block_hash, Nonce=nonce, Height=height, Difficulty=difficulty)
+
+
+def encode_block(block: Block) -> bytes:
+    parts = []
+    _write_block(block, parts)
+    return b''.join(parts)
+
+
+def decode_block(data: bytes) -> Block:
+    return _read_block(_Reader(data))
+
+
+def encode_block_frame(block: Block) -> bytes:
+    """流式传输中的一帧：u32 长度 + 区块"""
+    data = encode_block(block)
+    return _U32.pack(len(data)) + data
+
+
+def read_block_frames(read: Callable[[int], bytes]) -> Iterator[Block]:
+    """
+    从流中逐帧读取区块，直到流结束
+
+    :param read: 读取 n 个字节的函数，例如 response.raw.read
+    """
+    while True:
+        header = read(_U32.size)
+        if not header:
+            return
+        if len(header) < _U32.size:
+            raise ValueError("truncated frame")
+        (length,) = _U32.unpack(header)
+        data = read(length)
+        if len(data) < length:
+            raise ValueError("truncated frame")
+        yield decode_block(data)
+
+
+def encode_header(header: BlockHeader) -> bytes:
+    return b''.join((
+        _pack_bytes(header.Timestamp.isoformat().encode()),
+        _pack_hex(header.PrevBlockHash),
+        _pack_hex(header.Hash),
+        _BLOCK_FIELDS.pack(header.Nonce, header.Height, header.Difficulty),
+        _pack_hex(header.MerkleRoot),
+    ))
+
+
+def _read_header(reader: _Reader) -> BlockHeader:
+    timestamp = datetime.fromisoformat(reader.read_bytes().decode())
+    prev_hash = reader.read_hex()
+    block_hash = reader.read_hex()
+    nonce, height, difficulty = reader.unpack(_BLOCK_FIELDS)
+    return BlockHeader(timestamp, prev_hash, block_hash, nonce, height, difficulty, reader.read_hex())
+
+
+def _encode_list(items: List, encode) -> bytes:
+    """多个对象：u32 个数 + 每个对象的 u32 长度和内容"""
+    parts = [_U32.pack(len(items))]
+    for item in items:
+        data = encode(item)
+        parts.append(_U32.pack(len(data)))
+        parts.append(data)
+    return b''.join(parts)
+
+
+def _decode_list(reader: _Reader, read) -> List:
+    (count,) = reader.unpack(_U32)
+    items = []
+    for _ in range(count):
+        (length,) = reader.unpack(_U32)
+        end = reader.offset + length
+        items.append(read(reader))
+        if reader.offset != end:
+            raise ValueError("length mismatch")
+    return items
+
+
+def encode_blocks(blocks: List[Block]) -> bytes:
+    return _encode_list(blocks, encode_block)
+
+
+def decode_blocks(data: bytes) -> List[Block]:
+    return _decode_list(_Reader(data), _read_block)
+
+
+def encode_headers(headers: List[BlockHeader]) -> bytes:
+    return _encode_list(headers, encode_header)
+
+
+def decode_headers(data: bytes) -> List[BlockHeader]:
+    return _decode_list(_Reader(data), _read_header)
+
+
+def encode_transactions(transactions: List[Transaction]) -> bytes:
+    return _encode_list(transactions, encode_transaction)
+
+
+def decode_transactions(data: bytes) -> List[Transaction]:
+    return _decode_list(_Reader(data), _read_transaction)
+
+
+def encode_inventory(blocks: List[Block], transactions: List[Transaction]) -> bytes:
+    """getdata 的响应：区块列表 + 交易列表"""
+    return encode_blocks(blocks) + encode_transactions(transactions)
+
+
+def decode_inventory(data: bytes) -> Tuple[List[Block], List[Transaction]]:
+    reader = _Reader(data)
+    return _decode_list(reader, _read_block), _decode_list(reader, _read_transaction)
+
+
+
+def _pack_blobs(items: List[bytes]) -> bytes:
+    """一列变长字节串：u32 个数 + 每个的 u16 长度 + 依次拼接的内容"""
+    return _U32.pack(len(items)) + struct.pack(f'<{len(items)}H', *map(len, items)) + b''.join(items)
+
+
+def _read_blobs(reader: _Reader) -> List[bytes]:
+    (count,) = reader.unpack(_U32)
+    lengths = _read_column(reader, 'H', count)
+    start = reader.offset
+    end = start + sum(lengths)
+    if end > len(reader.data):
+        raise ValueError("truncated data")
+    reader.offset = end
+    items = []
+    for length in lengths:
+        items.append(reader.data[start:start + length])
+        start += length
+    return items
+
+
+def _pack_column(code: str, values: List) -> bytes:
+    """一列定长的数，个数由上下文给出"""
+    return struct.pack(f'<{len(values)}{code}', *values)
+
+
+def _read_column(reader: _Reader, code: str, count: int) -> Tuple:
+    return reader.unpack(struct.Struct(f'<{count}{code}'))
+
+
+def encode_chain_state(height: int, block_hash: str, outputs: Iterable[Tuple[OutPoint, Output]],
+                       headers: List[BlockHeader], tx_index: Dict[str, Tuple[int, int]]) -> bytes:
+    """
+    区块链在某个高度的状态：UTXO 集合、区块头和交易索引，用于快照
+
+    按列保存，txid 和公钥各只存一份，每一列都可以一次 struct.unpack 读出，加载时不必逐条解析
+
+    :param height: 状态对应的区块数
+    :param block_hash: 第 height - 1 个区块的哈希
+    :param outputs: UTXOSet.items()
+    """
+    outputs = list(outputs)
+    # txid 表：先是交易索引中的全部 txid，再是只出现在 UTXO 中的
+    txids = list(tx_index)
+    txid_no = {txid: i for i, txid in enumerate(txids)}
+    pubkeys: List[str] = []
+    pubkey_no: Dict[str, int] = {}
+    out_txids, out_vouts, out_pubkeys, tags, values = [], [], [], [], []
+    for (txid, vout), output in outputs:
+        if txid not in txid_no:
+            txid_no[txid] = len(txids)
+            txids.append(txid)
+        if output.pubkey not in pubkey_no:
+            pubkey_no[output.pubkey] = len(pubkeys)
+            pubkeys.append(output.pubkey)
+        out_txids.append(txid_no[txid])
+        out_vouts.append(vout)
+        out_pubkeys.append(pubkey_no[output.pubkey])
+        # 与 _encode_output 相同，保留整数和浮点数的区别
+        if isinstance(output.value, int):
+            tags.append(0)
+            values.append(struct.pack('<q', output.value))
+        else:
+            tags.append(1)
+            values.append(struct.pack('<d', output.value))
+    positions = list(tx_index.values())
+    return b''.join((
+        _U32.pack(height), _pack_hex(block_hash), encode_headers(headers),
+        _pack_blobs([bytes.fromhex(txid) for txid in txids]),
+        _pack_blobs([bytes.fromhex(pubkey) for pubkey in pubkeys]),
+        _U32.pack(len(positions)),
+        _pack_column('I', [h for h, _ in positions]),
+        _pack_column('I', [i for _, i in positions]),
+        _U32.pack(len(outputs)),
+        _pack_column('I', out_txids),
+        _pack_column('I', out_vouts),
+        _pack_column('I', out_pubkeys),
+        _pack_column('B', tags),
+        b''.join(values),
+    ))
+
+
+def decode_chain_state(data: bytes) -> Tuple[int, str, UTXOSet, List[BlockHeader], Dict[str, Tuple[int, int]]]:
+    """encode_chain_state 的逆过程，返回 (height, block_hash, utxo_set, headers, tx_index)"""
+    reader = _Reader(data)
+    (height,) = reader.unpack(_U32)
+    block_hash = reader.read_hex()
+    headers = _decode_list(reader, _read_header)
+    txids = [txid.hex() for txid in _read_blobs(reader)]
+    pubkeys = [intern_pubkey(pubkey) for pubkey in _read_blobs(reader)]
+    (count,) = reader.unpack(_U32)
+    tx_index = dict(zip(txids, zip(_read_column(reader, 'I', count), _read_column(reader, 'I', count))))
+    (count,) = reader.unpack(_U32)
+    out_txids = _read_column(reader, 'I', count)
+    out_vouts = _read_column(reader, 'I', count)
+    out_pubkeys = _read_column(reader, 'I', count)
+    tags = _read_column(reader, 'B', count)
+    # 同一段 8 字节按整数和浮点数各读一遍，再按类型标记取
+    start = reader.offset
+    int_values = _read_column(reader, 'q', count)
+    reader.offset = start
+    float_values = _read_column(reader, 'd', count)
+    utxo_set = UTXOSet()
+    for i in range(count):
+        value = int_values[i] if tags[i] == 0 else float_values[i]
+        utxo_set.add(txids[out_txids[i]], out_vouts[i], Output.from_raw(value, pubkeys[out_pubkeys[i]]))
+    return height, block_hash, utxo_set, headers, tx_index
@@ -0,0 +1,119 @@
+import io
+from datetime import datetime, timezone
+from typing import Dict, List
+
+import pytest
+import requests
+from ecdsa import SigningKey, SECP256k1
+from flask import Flask
+
+from block import Block, BlockChain, Input, Output, Transaction
+from peer import PeerClient
+from wallet import Wallet, pubkey_to_address
+
+
+class ChainHelper:
+    """测试用的区块和交易：固定的密钥、创世区块、花费指定输出的交易、难度 1 的挖矿"""
+
+    def __init__(self, private_key: str = "1f" * 32):
+        signing_key = SigningKey.from_string(bytes.fromhex(private_key), curve=SECP256k1)
+        pub_key = signing_key.get_verifying_key().to_string().hex()
+        self.wallet = Wallet(pub_key=pub_key, private_key=private_key, address=pubkey_to_address(pub_key))
+
+    def genesis(self, value: int = 10 ** 9) -> Block:
+        tx = Transaction(Hash="", Vin=[], Vout=[Output(value, self.wallet.pub_key)])
+        tx._set_hash()
+        block = Block(datetime(2024, 1, 1, tzinfo=timezone.utc), [tx], "0" * 64, "", 0, 0, 1)
+        block.set_hash()
+        return block
+
+    def spend(self, tx: Transaction, vout: int = 0, amount: int = 1, fee: int = 0, pubkey: str = None) -> Transaction:
+        """
+        花费 tx 的第 vout 个输出：amount 付给 pubkey（默认自己），扣除手续费后找零给自己（输出 1）
+        """
+        value = tx.Vout[vout].value
+        transaction = Transaction(Hash="", Vin=[Input(tx.Hash, vout, "", self.wallet.pub_key)],
+                                  Vout=[Output(amount, pubkey or self.wallet.pub_key),
+                                        Output(value - amount - fee, self.wallet.pub_key)])
+        transaction.sign(self.wallet.private_key)
+        transaction._set_hash()
+        return transaction
+
+    def chain_of_spends(self, tx: Transaction, count: int, fee: int = 0) -> List[Transaction]:
+        """依次花费上一笔交易的找零"""
+        transactions = []
+        for _ in range(count):
+            tx = self.spend(tx, vout=1 if transactions else 0, fee=fee)
+            transactions.append(tx)
+        return transactions
+
+    @staticmethod
+    def mine(transactions: List[Transaction], prev_hash: str, height: int, difficulty: int = 1) -> Block:
+        block = Block.new_block(transactions, prev_hash, height, difficulty)
+        while True:
+            block.set_hash()
+            if block.check_pow():
+                return block
+            block.Nonce += 1
+
+
+class _AppSession:
+    """代替 requests.Session，把请求交给 Flask 测试客户端"""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method: str, url: str, timeout=None, stream=False, **kwargs) -> requests.Response:
+        path = '/' + url.split('/', 3)[3]
+        result = self.client.open(path, method=method, **kwargs)
+        response = requests.Response()
+        response.status_code = result.status_code
+        response._content = result.get_data()
+        response.raw = io.BytesIO(response._content)
+        response.headers.update(result.headers)
+        return response
+
+
+class AppPeerClient(PeerClient):
+    """请求直接交给节点的 Flask 应用、不经过网络的 PeerClient"""
+
+    def __init__(self, app, routes: Dict[str, Flask] = None):
+        """
+        :param app: 处理请求的应用
+        :param routes: 地址 -> 应用，给出时按地址分发，未列出的地址交给 app
+        """
+        super().__init__()
+        self.session = _AppSession(app)
+        self.sessions = {address: _AppSession(routed) for address, routed in (routes or {}).items()}
+
+    def _session(self, address: str) -> _AppSession:
+        return self.sessions.get(address, self.session)
+
+
+@pytest.fixture
+def chain() -> ChainHelper:
+    return ChainHelper()
+
+
+@pytest.fixture
+def node(request, tmp_path, monkeypatch, chain):
+    """
+    在临时目录中启动的 MinerNode，不启动打包线程，也不监听端口
+
+    默认从 chain 的创世区块开始；用 @pytest.mark.parametrize('node', [文件], indirect=True) 指定初始区块链文件
+    """
+    from net_node import MinerNode
+    blockchain_file = getattr(request, 'param', None)
+    if blockchain_file is None:
+        genesis = chain.genesis()
+        blockchain_file = str(tmp_path / 'genesis.json')
+        BlockChain([genesis], genesis.Hash, 1).save_blockchain(blockchain_file)
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(MinerNode, '_pack_block', lambda self: None)
+    return MinerNode(18333, blockchain_file)
+
+
+@pytest.fixture
+def peers(node) -> AppPeerClient:
+    """发往任何地址的请求都由 node 处理"""
+    return AppPeerClient(node.app)
@@ -1,5 +1,6 @@
 
 from wallet import Wallet
+from keystore import Keystore
 from block import Transaction,Input,Output,Block
 import requests
 import time
@@ -8,7 +9,7 @@ if __name__ == '__main__':
     wallet_a = Wallet()
     wallet_a.load_from_file("./data/wallet_a.json")
 
-    wallets = [Wallet().new_address() for i in range(5)]
+    wallets = list(Keystore.generate(5))   # 批量生成 5 个收款钱包
 
     address_list = ['127.0.0.1:8333',
                  '127.0.0.1:8334',
@@ -18,24 +19,31 @@ if __name__ == '__main__':
     k = 0
     for i in range(5):
         # 5 个地址
+        address = address_list[i]
+        # 向节点查询 A 已上链的未花费输出，花费其中金额最大的一笔
+        utxos = requests.get(f"http://{address}/utxos", params={"pubkey":wallet_a.pub_key}).json()["utxos"]
+        if not utxos:
+            print(f"{address}: A 没有可花费的输出")
+            continue
+        utxo = max(utxos, key=lambda u: u["value"])
         transfer_transaction = Transaction(
             Hash="",  # 该交易需要验证通过后，再计算 Hash 等待上链
             Vin=[Input(
-                txid="",  # 使用创世区块的那笔交易
-                vout=0,
+                txid=utxo["txid"],  # 查询到的未花费输出，第一次是创世区块的那笔交易
+                vout=utxo["vout"],
                 signature="",  # 等待 A 进行签名
                 pubkey=wallet_a.pub_key  # A 需要花钱，因此 使用 A 的公钥来证明所属
             )],
             Vout=[Output(value=5, pubkey=wallets[i].pub_key),  # 给 对方 转钱
-                  Output(value=95, pubkey=wallet_a.pub_key)]  # 给 A 自己转钱
+                  Output(value=utxo["value"] - 5, pubkey=wallet_a.pub_key)]  # 找零给 A 自己
         )
         transfer_transaction.sign(wallet_a.private_key)
-        address = address_list[i]
-        for j in range(5):
-            # 每个地址 5 笔交易
-            response = requests.post(f"http://{address}/post_transaction", json={"transaction":transfer_transaction.to_dict()})
-            print(response.text)
-            k+=1
+        # 每个地址 5 笔交易，一次请求批量提交，返回每笔交易的结果
+        batch = [transfer_transaction.to_dict() for j in range(5)]
+        response = requests.post(f"http://{address}/post_transactions", json={"transactions":batch})
+        for result in response.json()["results"]:
+            print(result)
+        k+=len(batch)
         time.sleep(10)
 
     print("finished: ", k)
\ No newline at end of file
@@ -0,0 +1,198 @@
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Dict, List, Optional, Tuple
+
+from block import Block, BlockHeader
+from codec import BINARY_CONTENT_TYPE, decode_headers, read_block_frames
+
+# 一段需要下载的区块高度 [start, end)
+HeightRange = Tuple[int, int]
+
+
+class HeadersFirstSync:
+    """
+    新节点的先同步区块头、再并行下载区块体的初始同步
+
+    1. 向所有节点请求区块头，选最长的一条，检查前后链接、高度和工作量证明
+    2. 把缺少的高度切成若干段，同时从多个节点下载区块体（/sync?height=）
+       - 滑动窗口：只下载 [已应用的高度, 已应用的高度 + window 段) 内的区块，缓存有界
+       - 一段请求超过 stall_timeout 没有返回时，交给另一个空闲节点重新下载，先返回的生效
+       - 返回的数据与区块头不一致或请求失败的节点，失败 max_failures 次后不再使用
+    3. 按高度顺序把下载好的区块交给 MinerNode._accept_block
+    """
+
+    def __init__(self, node, range_size: int = 50, window: int = 16, per_peer: int = 2,
+                 stall_timeout: float = 10.0, max_failures: int = 3):
+        """
+        :param node: MinerNode
+        :param range_size: 每次请求的区块数
+        :param window: 同时在途或已下载未应用的最多段数
+        :param per_peer: 每个节点同时在途的请求数
+        :param stall_timeout: 认为一次下载卡住的秒数
+        :param max_failures: 节点失败多少次后不再使用
+        """
+        self.node = node
+        self.range_size = range_size
+        self.window = window
+        self.per_peer = per_peer
+        self.stall_timeout = stall_timeout
+        self.max_failures = max_failures
+        self.stats: Dict[str, object] = {"headers": 0, "blocks": 0, "reassigned": 0, "seconds": 0.0, "served": {}}
+
+    def _request_headers(self, address: str, locator: List[str]) -> Tuple[Optional[List[BlockHeader]], int]:
+        result = self.node.peers.request(
+            address, 'GET', f"/headers?locator={','.join(locator)}&limit={self.node.HEADERS_PAGE_SIZE}",
+            headers={'Accept': BINARY_CONTENT_TYPE})
+        if result.status != 200:
+            return None, 0
+        return decode_headers(result.response.content), int(result.response.headers.get('X-Tip-Height', 0))
+
+    def _check_headers(self, headers: List[BlockHeader], prev_hash: str, height: int) -> bool:
+        """区块头必须首尾相连、高度连续，且满足工作量证明"""
+        for header in headers:
+            if header.PrevBlockHash != prev_hash or header.Height != height or not header.check_pow():
+                return False
+            prev_hash = header.Hash
+            height += 1
+        return True
+
+    def fetch_headers(self) -> Tuple[List[BlockHeader], List[str]]:
+        """
+        从区块头最长的节点取得本节点缺少的全部区块头
+
+        :return: (区块头列表, 拥有这些区块的节点)
+        """
+        chain = self.node.blockchain
+        locator = chain.get_locator()
+        addresses = self.node._peer_addresses()
+        first_pages: Dict[str, List[BlockHeader]] = {}
+        tips: Dict[str, int] = {}
+        for address in addresses:
+            page, tip = self._request_headers(address, locator)
+            if page and self._check_headers(page, chain.current_hash, chain.height):
+                first_pages[address] = page
+                tips[address] = tip
+        if not first_pages:
+            return [], []
+        best = max(tips, key=tips.get)
+        headers = list(first_pages[best])
+        while len(headers) + chain.height < tips[best]:
+            page, _ = self._request_headers(best, [headers[-1].Hash])
+            if not page or not self._check_headers(page, headers[-1].Hash, headers[-1].Height + 1):
+                break
+            headers.extend(page)
+        # 能提供这些区块的节点：链至少和需要的一样长
+        target = chain.height + len(headers)
+        peers = [address for address in first_pages if tips[address] >= target]
+        return headers, peers
+
+    def _download(self, address: str, block_range: HeightRange) -> List[Block]:
+        start, end = block_range
+        result = self.node.peers.request(address, 'GET', f"/sync?height={start}&limit={end - start}",
+                                         headers={'Accept': BINARY_CONTENT_TYPE}, stream=True)
+        if result.status != 200:
+            raise IOError(f"{address} /sync {result.status} {result.error}")
+        return list(read_block_frames(result.response.raw.read))
+
+    def _matches(self, blocks: List[Block], block_range: HeightRange, headers: List[BlockHeader], base: int) -> bool:
+        """
+        下载的区块必须按位置与区块头一一对应：第 i 个区块对应高度 start + i 的区块头，
+        不能只看区块自己声明的高度，否则重复或打乱顺序的区块也能通过
+        """
+        start, end = block_range
+        if len(blocks) != end - start:
+            return False
+        for block, header in zip(blocks, headers[start - base:end - base]):
+            if block.Hash != header.Hash or block.Height != header.Height \
+                    or block.merkle_root != header.MerkleRoot or not block.check_pow():
+                return False
+        return True
+
+    def run(self) -> int:
+        """
+        执行一次初始同步
+
+        :return: 加入区块链的区块数
+        """
+        begin = time.time()
+        headers, peers = self.fetch_headers()
+        self.stats["headers"] = len(headers)
+        if not headers or not peers:
+            return 0
+        base = self.node.blockchain.height
+        end = base + len(headers)
+        pending = deque((h, min(h + self.range_size, end)) for h in range(base, end, self.range_size))
+        failures = {address: 0 for address in peers}
+        served: Dict[str, int] = {address: 0 for address in peers}
+        inflight: Dict[Future, Tuple[HeightRange, str, float]] = {}
+        downloaded: Dict[int, List[Block]] = {}
+        reassigned = set()
+        next_height = base
+        applied = 0
+        executor = ThreadPoolExecutor(max_workers=max(1, len(peers) * self.per_peer))
+
+        def load(address: str) -> int:
+            return sum(1 for _, a, _ in inflight.values() if a == address)
+
+        def idle_peer(exclude: str = None) -> Optional[str]:
+            usable = [a for a in peers if failures[a] < self.max_failures and a != exclude
+                      and load(a) < self.per_peer]
+            return min(usable, key=load) if usable else None
+
+        def submit(block_range: HeightRange, address: str) -> None:
+            inflight[executor.submit(self._download, address, block_range)] = (block_range, address, time.time())
+
+        try:
+            while next_height < end:
+                # 滑动窗口内的段分配给空闲节点
+                limit = next_height + self.window * self.range_size
+                while pending and pending[0][0] < limit:
+                    address = idle_peer()
+                    if address is None:
+                        break
+                    submit(pending.popleft(), address)
+                if not inflight:
+                    if all(failures[a] >= self.max_failures for a in peers):
+                        break
+                    if not pending and next_height not in downloaded:
+                        break
+                done, _ = wait(list(inflight), timeout=0.5, return_when=FIRST_COMPLETED)
+                for future in done:
+                    block_range, address, _ = inflight.pop(future)
+                    try:
+                        blocks = future.result()
+                        ok = self._matches(blocks, block_range, headers, base)
+                    except Exception:
+                        ok = False
+                    still_needed = block_range[0] >= next_height and block_range[0] not in downloaded
+                    if ok:
+                        served[address] += 1
+                        if still_needed:
+                            downloaded[block_range[0]] = blocks
+                    else:
+                        failures[address] += 1
+                        in_other = any(r == block_range for r, _, _ in inflight.values())
+                        if still_needed and not in_other:
+                            pending.appendleft(block_range)
+                # 卡住的下载交给另一个节点
+                now = time.time()
+                for block_range, address, started in list(inflight.values()):
+                    if now - started > self.stall_timeout and block_range not in reassigned \
+                            and block_range[0] not in downloaded:
+                        other = idle_peer(exclude=address)
+                        if other is not None:
+                            reassigned.add(block_range)
+                            submit(block_range, other)
+                # 按高度顺序应用
+                while next_height in downloaded:
+                    blocks = downloaded.pop(next_height)
+                    for block in blocks:
+                        if self.node._accept_block(block)[0] != 200:
+                            return applied
+                        applied += 1
+                    next_height += len(blocks)
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+            self.stats.update(blocks=applied, reassigned=len(reassigned), seconds=time.time() - begin, served=served)
+        return applied
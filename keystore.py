@@ -0,0 +1,183 @@
+import hashlib
+import hmac
+import os
+import struct
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, Optional, Tuple
+
+from ecdsa import SigningKey, SECP256k1
+
+from verifier import MP_CONTEXT, LRUCache
+from wallet import Wallet, pubkey_to_address
+
+# 密钥库文件：魔数 + 密钥数 + 每个密钥 96 字节（私钥 32 + 公钥 64，原始字节）
+KEYSTORE_MAGIC = b'KEYSTOR1'
+KEYSTORE_HEADER = struct.Struct('<8sI')
+_KEY_RECORD = struct.Struct('<32s64s')
+# 加密的密钥库：魔数 + 密钥数 + scrypt 盐，之后是 32 字节 HMAC-SHA256 标签和加密的密钥记录
+ENCRYPTED_MAGIC = b'KEYSTEN1'
+ENCRYPTED_HEADER = struct.Struct('<8sI16s')
+_TAG_SIZE = 32
+_SCRYPT_PARAMS = {'n': 1 << 14, 'r': 8, 'p': 1}
+
+
+def _derive_keys(passphrase: str, salt: bytes) -> Tuple[bytes, bytes]:
+    """由口令派生 (加密密钥, 认证密钥)，scrypt 让暴力猜口令的代价足够高"""
+    key = hashlib.scrypt(passphrase.encode(), salt=salt, dklen=64, **_SCRYPT_PARAMS)
+    return key[:32], key[32:]
+
+
+def _xor_keystream(key: bytes, data: bytes) -> bytes:
+    """与 SHAKE-256 生成的密钥流异或；每次保存都用新的盐，同一条密钥流不会用两次"""
+    stream = hashlib.shake_256(b'keystore' + key).digest(len(data))
+    return (int.from_bytes(data, 'little') ^ int.from_bytes(stream, 'little')).to_bytes(len(data), 'little')
+
+
+def _tag(mac_key: bytes, header: bytes, ciphertext: bytes) -> bytes:
+    return hmac.new(mac_key, header + ciphertext, hashlib.sha256).digest()
+
+
+def _generate_chunk(count: int) -> bytes:
+    """在工作进程中执行，生成 count 个密钥并打包"""
+    parts = []
+    for _ in range(count):
+        signing_key = SigningKey.generate(curve=SECP256k1)
+        parts.append(_KEY_RECORD.pack(signing_key.to_string(), signing_key.get_verifying_key().to_string()))
+    return b''.join(parts)
+
+
+def generate_keys(count: int, max_workers: int = None, chunk_size: int = 256) -> bytes:
+    """
+    批量生成密钥，分块交给进程池并行生成
+
+    :param count: 密钥个数
+    :param max_workers: 进程数，默认为 CPU 核数；为 1 或数量不足一块时在当前进程生成
+    :param chunk_size: 每个任务生成的密钥数
+    :return: 打包好的密钥记录
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    if max_workers <= 1 or count <= chunk_size:
+        return _generate_chunk(count)
+    chunks = [min(chunk_size, count - start) for start in range(0, count, chunk_size)]
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=MP_CONTEXT) as executor:
+        return b''.join(executor.map(_generate_chunk, chunks))
+
+
+class Keystore:
+    """
+    批量生成、紧凑保存的密钥库，用于需要成千上万个钱包的压力测试
+
+    全部密钥保存在一个二进制文件中，每个 96 字节；Wallet 对象和地址在取出时才生成。
+    给出口令时文件中的私钥加密保存，读取时口令错误或文件被改动都会被发现
+    """
+
+    def __init__(self, records: bytes = b''):
+        if len(records) % _KEY_RECORD.size:
+            raise ValueError("keystore records length mismatch")
+        self._records = bytearray(records)
+
+    def __len__(self) -> int:
+        return len(self._records) // _KEY_RECORD.size
+
+    def __getitem__(self, index: int) -> Wallet:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("keystore index out of range")
+        private_key, pub_key = _KEY_RECORD.unpack_from(self._records, index * _KEY_RECORD.size)
+        return Wallet(pub_key=pub_key.hex(), private_key=private_key.hex(), address=pubkey_to_address(pub_key.hex()))
+
+    def __iter__(self) -> Iterator[Wallet]:
+        return (self[i] for i in range(len(self)))
+
+    @staticmethod
+    def generate(count: int, max_workers: int = None) -> 'Keystore':
+        return Keystore(generate_keys(count, max_workers))
+
+    def extend(self, count: int, max_workers: int = None) -> None:
+        """再生成 count 个密钥追加到密钥库"""
+        self._records.extend(generate_keys(count, max_workers))
+
+    def save(self, file_path: str, passphrase: Optional[str] = None) -> None:
+        """
+        先写临时文件再替换，写到一半崩溃不会损坏原来的密钥库
+
+        :param passphrase: 给出时用口令加密保存
+        """
+        if passphrase is None:
+            data = KEYSTORE_HEADER.pack(KEYSTORE_MAGIC, len(self)) + self._records
+        else:
+            salt = os.urandom(16)
+            enc_key, mac_key = _derive_keys(passphrase, salt)
+            ciphertext = _xor_keystream(enc_key, bytes(self._records))
+            header = ENCRYPTED_HEADER.pack(ENCRYPTED_MAGIC, len(self), salt)
+            data = header + _tag(mac_key, header, ciphertext) + ciphertext
+        tmp_path = file_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, file_path)
+
+    @staticmethod
+    def load(file_path: str, passphrase: Optional[str] = None) -> 'Keystore':
+        """
+        :param passphrase: 加密的密钥库必须给出保存时的口令，未加密的忽略
+        :raises ValueError: 文件损坏、缺少口令或口令错误
+        """
+        with open(file_path, 'rb') as f:
+            data = f.read()
+        if data[:len(ENCRYPTED_MAGIC)] == ENCRYPTED_MAGIC:
+            if passphrase is None:
+                raise ValueError(f"keystore {file_path} is encrypted, a passphrase is required")
+            body = ENCRYPTED_HEADER.size + _TAG_SIZE
+            if len(data) < body:
+                raise ValueError(f"corrupted keystore {file_path}")
+            _, count, salt = ENCRYPTED_HEADER.unpack_from(data)
+            enc_key, mac_key = _derive_keys(passphrase, salt)
+            tag, ciphertext = data[ENCRYPTED_HEADER.size:body], data[body:]
+            if not hmac.compare_digest(tag, _tag(mac_key, data[:ENCRYPTED_HEADER.size], ciphertext)):
+                raise ValueError(f"wrong passphrase or corrupted keystore {file_path}")
+            records = _xor_keystream(enc_key, ciphertext)
+        else:
+            if len(data) < KEYSTORE_HEADER.size:
+                raise ValueError(f"corrupted keystore {file_path}")
+            magic, count = KEYSTORE_HEADER.unpack_from(data)
+            records = data[KEYSTORE_HEADER.size:]
+            if magic != KEYSTORE_MAGIC:
+                raise ValueError(f"corrupted keystore {file_path}")
+        if len(records) != count * _KEY_RECORD.size:
+            raise ValueError(f"corrupted keystore {file_path}")
+        return Keystore(records)
+
+
+_signing_keys = LRUCache(4096)
+
+
+def get_signing_key(private_key: str) -> SigningKey:
+    """
+    私钥 hex -> 解析好的 SigningKey，进程内缓存
+
+    SigningKey.from_string 要由私钥算出公钥（一次标量乘法），与一次签名的开销相当；
+    缓存后同一个密钥签名多笔交易只需付一次。签名用到的基点倍数表由 ecdsa 在所有密钥之间共享
+    """
+    signing_key = _signing_keys.get(private_key)
+    if signing_key is None:
+        signing_key = SigningKey.from_string(bytes.fromhex(private_key), curve=SECP256k1)
+        _signing_keys.put(private_key, signing_key)
+    return signing_key
+
+
+if __name__ == '__main__':
+    # 生成密钥库：python keystore.py ./data/keys.bin 10000 [--encrypt]
+    import getpass
+    import sys
+    import time
+    if len(sys.argv) not in (3, 4) or len(sys.argv) == 4 and sys.argv[3] != '--encrypt':
+        print("usage: python keystore.py <file> <count> [--encrypt]")
+        sys.exit(1)
+    passphrase = getpass.getpass("passphrase: ") if len(sys.argv) == 4 else None
+    begin = time.time()
+    keystore = Keystore.generate(int(sys.argv[2]))
+    keystore.save(sys.argv[1], passphrase)
+    print(f"generated {len(keystore)} keys in {time.time() - begin:.2f}s -> {sys.argv[1]}")
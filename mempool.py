@@ -0,0 +1,262 @@
+import heapq
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Set, Tuple
+
+from block import Block, Output, Transaction
+from codec import encode_transaction
+from utxo import OutPoint, UTXOSet, UTXOView
+
+
+class MempoolError(Exception):
+    """交易无法进入交易池：重复、双花或交易池已满"""
+
+
+@dataclass
+class MempoolEntry:
+    tx: Transaction
+    fee: float      # 输入总额 - 输出总额
+    size: int       # 序列化后的字节数
+    seq: int        # 进入交易池的顺序，手续费相同时先到先打包
+
+
+def transaction_size(tx: Transaction) -> int:
+    return len(encode_transaction(tx))
+
+
+class Mempool:
+    """
+    有索引、有容量上限的交易池
+
+    - txid -> 交易，O(1) 去重
+    - outpoint -> 花费它的 txid，拒绝交易池内部的双花
+    - txid -> 花费它的输出的池内交易，交易可以花费池中尚未上链的交易的输出
+    - 按手续费排序的堆：打包时取手续费最高的，超过容量时淘汰手续费最低的
+
+    本身不加锁，由调用方（MinerNode.transaction_list_lock）保证互斥
+    """
+
+    def __init__(self, max_count: int = 50000, max_bytes: int = 64 * 1024 * 1024):
+        """
+        :param max_count: 最多容纳的交易数
+        :param max_bytes: 所有交易序列化后的总字节数上限
+        """
+        self.max_count = max_count
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._entries: Dict[str, MempoolEntry] = {}
+        self._spends: Dict[OutPoint, str] = {}
+        self._children: Dict[str, Set[str]] = {}
+        self._seq = 0
+        # 堆中的条目在交易被删除后不会立即移除，弹出时再按 seq 判断是否失效
+        self._min_heap: List[Tuple[float, int, str]] = []   # 淘汰用：手续费最低的在堆顶
+        self._max_heap: List[Tuple[float, int, str]] = []   # 打包用：手续费最高的在堆顶
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, txid: str) -> bool:
+        return txid in self._entries
+
+    def __iter__(self):
+        return (entry.tx for entry in self._entries.values())
+
+    def get(self, txid: str) -> Optional[Transaction]:
+        entry = self._entries.get(txid)
+        return entry.tx if entry else None
+
+    def output(self, txid: str, vout: int) -> Optional[Output]:
+        """池中交易 txid 的第 vout 个输出，交易不在池中时返回 None"""
+        entry = self._entries.get(txid)
+        if entry is None or not 0 <= vout < len(entry.tx.Vout):
+            return None
+        return entry.tx.Vout[vout]
+
+    def view(self, utxo_set: UTXOSet) -> UTXOView:
+        """
+        链上 UTXO 集合加上池中交易的输出，可以代替 BlockChain 传给 Transaction.verify，
+        验证花费未上链交易输出的交易。池内的双花由 add 检查
+        """
+        return UTXOView(_PoolOutputs(utxo_set, self))
+
+    def conflict(self, tx: Transaction) -> Optional[str]:
+        """返回交易池中与 tx 花费同一个输出的交易 txid，没有则返回 None"""
+        for input_obj in tx.Vin:
+            spender = self._spends.get((input_obj.txid, input_obj.vout))
+            if spender is not None and spender != tx.Hash:
+                return spender
+        return None
+
+    def add(self, tx: Transaction, fee: float) -> None:
+        """
+        加入一笔已经验证过的交易
+
+        :param tx: 交易，tx.Hash 必须已经计算
+        :param fee: 手续费
+        :raises MempoolError: 重复、与池中交易双花、或交易池已满且手续费不够高
+        """
+        if tx.Hash in self._entries:
+            raise MempoolError("Duplicate transaction")
+        if self.conflict(tx) is not None:
+            raise MempoolError("Double spend in mempool")
+        self._seq += 1
+        entry = MempoolEntry(tx, fee, transaction_size(tx), self._seq)
+        self._entries[tx.Hash] = entry
+        for input_obj in tx.Vin:
+            self._spends[(input_obj.txid, input_obj.vout)] = tx.Hash
+            if input_obj.txid in self._entries:
+                self._children.setdefault(input_obj.txid, set()).add(tx.Hash)
+        # 重组时放回交易池的交易，花费它的输出的交易可能已经在池中
+        for vout in range(len(tx.Vout)):
+            spender = self._spends.get((tx.Hash, vout))
+            if spender is not None:
+                self._children.setdefault(tx.Hash, set()).add(spender)
+        self.total_bytes += entry.size
+        heapq.heappush(self._min_heap, (fee, entry.seq, tx.Hash))
+        heapq.heappush(self._max_heap, (-fee, entry.seq, tx.Hash))
+        self._evict()
+        if tx.Hash not in self._entries:
+            raise MempoolError("Mempool full")
+
+    def _is_live(self, item: Tuple[float, int, str]) -> bool:
+        entry = self._entries.get(item[2])
+        return entry is not None and entry.seq == item[1]
+
+    def _evict(self) -> None:
+        """超过容量时淘汰手续费最低的交易，花费它的输出的池内交易一起淘汰"""
+        while len(self._entries) > self.max_count or self.total_bytes > self.max_bytes:
+            item = heapq.heappop(self._min_heap)
+            if self._is_live(item):
+                self.remove_with_descendants(item[2])
+
+    def remove(self, txid: str) -> Optional[Transaction]:
+        """删除一笔交易；花费它的输出的池内交易保留（交易上链后这些输出仍然有效）"""
+        entry = self._entries.pop(txid, None)
+        if entry is None:
+            return None
+        for input_obj in entry.tx.Vin:
+            outpoint = (input_obj.txid, input_obj.vout)
+            if self._spends.get(outpoint) == txid:
+                del self._spends[outpoint]
+            children = self._children.get(input_obj.txid)
+            if children is not None:
+                children.discard(txid)
+                if not children:
+                    del self._children[input_obj.txid]
+        self._children.pop(txid, None)
+        self.total_bytes -= entry.size
+        # 失效条目太多时重建堆
+        if len(self._min_heap) > 2 * len(self._entries) + 64:
+            self._min_heap = [i for i in self._min_heap if self._is_live(i)]
+            heapq.heapify(self._min_heap)
+            self._max_heap = [i for i in self._max_heap if self._is_live(i)]
+            heapq.heapify(self._max_heap)
+        return entry.tx
+
+    def remove_with_descendants(self, txid: str) -> int:
+        """
+        删除一笔交易以及所有直接、间接花费它的输出的池内交易（它们的输入已经不存在）
+
+        :return: 删除的交易数
+        """
+        removed = 0
+        stack = [txid]
+        while stack:
+            current = stack.pop()
+            stack.extend(self._children.get(current, ()))
+            if self.remove(current) is not None:
+                removed += 1
+        return removed
+
+    def remove_spenders(self, tx: Transaction) -> int:
+        """
+        删除花费 tx 的输出的池内交易及其后代，tx 本身不在交易池中，
+        例如重组时回滚出主链、又无法放回交易池的交易
+
+        :return: 删除的交易数
+        """
+        removed = 0
+        for vout in range(len(tx.Vout)):
+            spender = self._spends.get((tx.Hash, vout))
+            if spender is not None:
+                removed += self.remove_with_descendants(spender)
+        return removed
+
+    def revalidate(self, utxo_set: UTXOSet) -> int:
+        """
+        链重组后按进入交易池的顺序重新检查每笔交易的输入和金额，
+        输入既不在 utxo_set 中、也不是池中交易的输出的交易，连同后代一起删除
+
+        :return: 删除的交易数
+        """
+        view = self.view(utxo_set)
+        removed = 0
+        for entry in sorted(self._entries.values(), key=lambda e: e.seq):
+            if entry.tx.Hash not in self._entries:
+                continue   # 已经作为前面交易的后代删除
+            try:
+                entry.tx.verify(view, check_signatures=False)
+            except Exception:
+                removed += self.remove_with_descendants(entry.tx.Hash)
+        return removed
+
+    def remove_for_block(self, block: Block) -> int:
+        """
+        区块上链后，删除区块中已经打包的交易，以及和区块中交易花费同一输出的交易
+
+        :return: 删除的交易数
+        """
+        removed = 0
+        for tx in block.Transactions:
+            if self.remove(tx.Hash) is not None:
+                removed += 1
+            for input_obj in tx.Vin:
+                spender = self._spends.get((input_obj.txid, input_obj.vout))
+                if spender is not None:
+                    removed += self.remove_with_descendants(spender)
+        return removed
+
+    def select(self, max_count: int = None, max_bytes: int = None) -> Tuple[Transaction, ...]:
+        """
+        按手续费从高到低选出交易用于打包，不会从交易池中删除
+
+        返回不可变的元组，交易对象与交易池共享、不复制：进入交易池的交易不会再被修改，
+        打包方可以在锁外使用它组装区块。花费池内交易输出的交易排在被花费的交易之后，
+        被花费的交易没有选中时它也不会被选中
+
+        :param max_count: 最多选出多少笔，默认不限
+        :param max_bytes: 选出交易序列化后的总字节数上限，放不下的交易跳过，默认不限
+        """
+        heap = list(self._max_heap)
+        selected = []
+        chosen = set()
+        waiting: Dict[str, List[Tuple[float, int, str]]] = {}   # 池内父交易 -> 等它选中后才能选的交易
+        size = 0
+        while heap and (max_count is None or len(selected) < max_count):
+            item = heapq.heappop(heap)
+            if not self._is_live(item):
+                continue
+            entry = self._entries[item[2]]
+            parent = next((i.txid for i in entry.tx.Vin if i.txid in self._entries and i.txid not in chosen), None)
+            if parent is not None:
+                waiting.setdefault(parent, []).append(item)
+                continue
+            if max_bytes is not None and size + entry.size > max_bytes:
+                continue
+            selected.append(entry.tx)
+            chosen.add(item[2])
+            size += entry.size
+            for child in waiting.pop(item[2], ()):
+                heapq.heappush(heap, child)
+        return tuple(selected)
+
+
+class _PoolOutputs:
+    """先查链上的 UTXO 集合，再查交易池中交易的输出，作为 UTXOView 的底层"""
+
+    def __init__(self, utxo_set: UTXOSet, mempool: Mempool):
+        self.utxo_set = utxo_set
+        self.mempool = mempool
+
+    def get(self, txid: str, vout: int) -> Optional[Output]:
+        output = self.utxo_set.get(txid, vout)
+        return output if output is not None else self.mempool.output(txid, vout)
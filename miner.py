@@ -0,0 +1,223 @@
+import hashlib
+import os
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from block import Block
+from verifier import MP_CONTEXT
+
+_MAX_MINERS = 64    # 共享同一个进程池的 Miner 数上限，每个 Miner 占用取消标志数组中的一位
+_cancel_flags = None   # 工作进程中的取消标志数组，由 _init_worker 设置
+
+
+def _init_worker(cancel_flags) -> None:
+    global _cancel_flags
+    _cancel_flags = cancel_flags
+
+
+def _search_range(prefix: bytes, difficulty: int, start: int, count: int, slot: int = 0,
+                  flags=None, check_every: int = 4096) -> Tuple[Optional[int], int]:
+    """
+    在 [start, start+count) 中寻找满足难度的 nonce
+
+    prefix 的 sha256 中间状态只计算一次，之后每个 nonce 只需要 copy + update。
+    每 check_every 次检查一次取消标志 flags[slot]，工作进程中 flags 为进程池共享的标志数组
+
+    :return: (找到的 nonce 或 None, 实际计算的哈希次数)
+    """
+    flags = _cancel_flags if flags is None else flags
+    prefix_state = hashlib.sha256(prefix)
+    target = '0' * difficulty
+    hash_header = Block.hash_header
+    done = 0
+    for nonce in range(start, start + count):
+        if hash_header(prefix_state, nonce).startswith(target):
+            return nonce, done + 1
+        done += 1
+        if done % check_every == 0 and flags is not None and flags[slot]:
+            break
+    return None, done
+
+
+class MinerPool:
+    """
+    多个 Miner 共享的挖矿进程池，创建时就建立，工作进程用 spawn 启动
+
+    取消标志是一块共享内存，工作进程启动时继承；每个 Miner 占用其中一位，
+    一个 Miner 被取消不影响同时在挖矿的其他 Miner
+    """
+
+    def __init__(self, max_workers: int = None):
+        """
+        :param max_workers: 进程数，默认为 CPU 核数
+        """
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.cancel_flags = MP_CONTEXT.Array('b', _MAX_MINERS, lock=False)
+        self.executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=MP_CONTEXT,
+                                            initializer=_init_worker, initargs=(self.cancel_flags,))
+        self._free_slots: List[int] = list(range(_MAX_MINERS - 1, -1, -1))
+        self._lock = threading.Lock()
+
+    def acquire_slot(self) -> int:
+        with self._lock:
+            if not self._free_slots:
+                raise RuntimeError(f"at most {_MAX_MINERS} miners can share a pool")
+            return self._free_slots.pop()
+
+    def release_slot(self, slot: int) -> None:
+        with self._lock:
+            self.cancel_flags[slot] = 0
+            self._free_slots.append(slot)
+
+    def shutdown(self) -> None:
+        for slot in range(_MAX_MINERS):
+            self.cancel_flags[slot] = 1
+        self.executor.shutdown()
+
+
+_default_pool: MinerPool = None
+_default_pool_lock = threading.Lock()
+
+
+def get_miner_pool() -> MinerPool:
+    """进程内共享的挖矿进程池，同一进程中的多个节点共用"""
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is None:
+            _default_pool = MinerPool()
+        return _default_pool
+
+
+class Miner:
+    """
+    工作量证明挖矿
+
+    把 nonce 空间切成长度为 range_size 的区间，分发到进程池的各个核上并行搜索，
+    任一进程找到结果或调用 cancel()（例如 /addBlock 收到了竞争区块）时其他进程尽快停止。
+    记录累计的哈希次数和耗时，用于计算算力
+    """
+
+    def __init__(self, max_workers: int = None, range_size: int = 1 << 16, pool: MinerPool = None):
+        """
+        :param max_workers: 并行搜索的进程数，默认为进程池的大小（CPU 核数）；为 1 时在当前线程中挖矿
+        :param range_size: 每个任务搜索的 nonce 个数
+        :param pool: 共享的进程池，默认为 get_miner_pool()
+        """
+        self.max_workers = max_workers or (pool.max_workers if pool is not None else os.cpu_count() or 1)
+        self.range_size = range_size
+        if self.max_workers > 1:
+            # 创建 Miner（节点启动）时就取得进程池
+            self.pool: Optional[MinerPool] = pool or get_miner_pool()
+            self._flags = self.pool.cancel_flags
+            self._slot = self.pool.acquire_slot()
+        else:
+            self.pool = None
+            self._flags = bytearray(1)
+            self._slot = 0
+        self._lock = threading.Lock()
+        self.total_hashes = 0
+        self.total_seconds = 0.0
+        self.last_hashrate = 0.0
+
+    def cancel(self) -> None:
+        """取消当前的挖矿任务"""
+        self._flags[self._slot] = 1
+
+    def mine(self, block: Block, start_nonce: int = 0) -> bool:
+        """
+        为 block 寻找满足 block.Difficulty 的 Nonce，成功时设置 block.Nonce 和 block.Hash
+
+        :return: 是否找到，被 cancel() 取消时返回 False
+        """
+        with self._lock:
+            self._flags[self._slot] = 0
+            prefix = block.header_prefix()
+            begin = time.time()
+            if self.pool is None:
+                nonce, hashes = self._mine_serial(prefix, block.Difficulty, start_nonce)
+            else:
+                nonce, hashes = self._mine_parallel(prefix, block.Difficulty, start_nonce)
+            elapsed = time.time() - begin
+            self.total_hashes += hashes
+            self.total_seconds += elapsed
+            self.last_hashrate = hashes / elapsed if elapsed > 0 else 0.0
+            if nonce is None:
+                return False
+            block.Nonce = nonce
+            block.set_hash()
+            return True
+
+    def _mine_serial(self, prefix: bytes, difficulty: int, nonce: int) -> Tuple[Optional[int], int]:
+        hashes = 0
+        while not self._flags[self._slot]:
+            found, done = _search_range(prefix, difficulty, nonce, self.range_size, self._slot, self._flags)
+            hashes += done
+            if found is not None:
+                return found, hashes
+            nonce += self.range_size
+        return None, hashes
+
+    def _mine_parallel(self, prefix: bytes, difficulty: int, nonce: int) -> Tuple[Optional[int], int]:
+        executor = self.pool.executor
+        pending = set()
+        hashes = 0
+        found = None
+        # 每个核保持两个在途区间，避免等待新任务时核空闲
+        while found is None and not self._flags[self._slot]:
+            while len(pending) < self.max_workers * 2:
+                pending.add(executor.submit(_search_range, prefix, difficulty, nonce, self.range_size, self._slot))
+                nonce += self.range_size
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                result, count = future.result()
+                hashes += count
+                if result is not None and (found is None or result < found):
+                    found = result
+        # 通知其他进程停止，并回收在途任务的统计
+        self._flags[self._slot] = 1
+        for future in pending:
+            _, count = future.result()
+            hashes += count
+        return found, hashes
+
+    def stats(self) -> Dict[str, float]:
+        hashrate = self.total_hashes / self.total_seconds if self.total_seconds > 0 else 0.0
+        return {
+            "workers": self.max_workers,
+            "total_hashes": self.total_hashes,
+            "hashrate": hashrate,
+            "hashrate_per_core": hashrate / self.max_workers,
+            "last_hashrate": self.last_hashrate,
+        }
+
+    def shutdown(self) -> None:
+        """取消挖矿并归还取消标志，共享的进程池不关闭"""
+        self.cancel()
+        with self._lock:
+            if self.pool is not None:
+                self.pool.release_slot(self._slot)
+                self.pool = None
+
+
+if __name__ == '__main__':
+    # 算力测试：python miner.py [难度] [最大核数]
+    difficulty = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    max_cores = int(sys.argv[2]) if len(sys.argv) > 2 else (os.cpu_count() or 1)
+    base = None
+    for workers in range(1, max_cores + 1):
+        pool = MinerPool(workers) if workers > 1 else None
+        miner = Miner(max_workers=workers, pool=pool)
+        block = Block(datetime.now(timezone.utc), [], "0" * 64, "", 0, 1, difficulty)
+        miner.mine(block)
+        stats = miner.stats()
+        base = base or stats["hashrate"]
+        print(f"workers={workers} hashes={stats['total_hashes']} "
+              f"hashrate={stats['hashrate']:.0f} H/s per_core={stats['hashrate_per_core']:.0f} H/s "
+              f"speedup={stats['hashrate'] / base:.2f}x")
+        miner.shutdown()
+        if pool is not None:
+            pool.shutdown()
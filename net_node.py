@@ -1,20 +1,31 @@
 import threading
-from copy import deepcopy
 from datetime import timezone,datetime
-import random
 
 
-from flask import Flask, request,jsonify
+from flask import Flask, Response, request,jsonify
 import datetime
 import re
 from wallet import Wallet
 import socket
-from block import Block,BlockChain,Input,Output,Transaction
+from block import Block,BlockChain,ChainUpdate,Input,Output,Transaction
+from codec import BINARY_CONTENT_TYPE, decode_inventory, decode_transaction, \
+    encode_block_frame, encode_blocks, encode_headers, encode_inventory
+from mempool import Mempool
+from orphan import OrphanPool
+from peer import PeerClient, RecentFilter
+from ibd import HeadersFirstSync
+from miner import Miner
+from snapshot import ChainSnapshot, read_snapshot, snapshot_path, write_snapshot
+from spv import BloomFilter, filter_matches
+from storage import BlockStore, LazyBlockList
+from utxo import addresses_for
+from validation import BlockValidationError, ValidationPipeline, check_transaction_rules
+from verifier import LRUCache, VerifyEngine, get_verify_engine, get_signature_cache
 import json
+import os
 
 import time
-import requests
-from typing import Dict, List, Callable
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
 
 # 路由节点
 class Router:
@@ -22,6 +33,7 @@ class Router:
         self.own_port = own_port
         self.address_pool: Dict[str, float] = {"127.0.0.1:8333":time.time()}  # 地址池，键为地址（ip:port形式），值为对应的时间戳
         self.app = Flask(__name__)
+        self.peers = PeerClient()   # 每个节点一个连接池，并发广播
 
         # 获取自身IP地址 , 这里初始化为 127.0.0.1
         self.own_ip = "127.0.0.1"
@@ -54,6 +66,11 @@ class Router:
         # 返回 200
         return jsonify({"code":200,"message": f"{self.own_ip}:{self.own_port} alive"}),200
 
+    def _peer_addresses(self) -> List[str]:
+        """地址池中除自己以外的地址"""
+        own_address = f"{self.own_ip}:{self.own_port}"
+        return [address for address in list(self.address_pool.keys()) if address != own_address]
+
     def addr(self) -> None:
         """
         广播自己的地址（包括IP和端口号）给其他节点
@@ -61,14 +78,10 @@ class Router:
         :param own_ip: 自身的IP地址
         """
         own_address = f"{self.own_ip}:{self.own_port}"
-        for address, _ in self.address_pool.items():
-            try:
-                if address == own_address:
-                    continue
-                requests.post(f"http://{address}/addr", json={'address': own_address})
-            except requests.exceptions.RequestException:
-                print("error:addr")
-                pass
+        for address, result in self.peers.broadcast(self._peer_addresses(), 'POST', '/addr',
+                                                    json={'address': own_address}).items():
+            if not result.ok:
+                print("error:addr", address, result.error)
 
     def getaddr(self) -> Dict[str, float]:
         """
@@ -76,21 +89,16 @@ class Router:
 
         :return: 合并后的所有有效地址信息字典，键为地址（ip:port形式），值为对应的时间戳
         """
-        own_address = f"{self.own_ip}:{self.own_port}"
         all_addresses = {}
-        for address, _ in self.address_pool.items():
-            if own_address == address:
+        for address, result in self.peers.broadcast(self._peer_addresses(), 'GET', '/getaddr').items():
+            if not result.ok:
+                print("error:getaddr", address, result.error)
                 continue
-            try:
-                response = requests.get(f"http://{address}/getaddr")
-                if response.status_code == 200:
-                    addresses_data = response.json()
-                    for addr, timestamp in addresses_data.items():
-                        if re.match(r'^\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}:\d+$', addr):
-                            all_addresses[addr] = timestamp
-            except requests.exceptions.RequestException:
-                print("error:getaddr")
-                pass
+            if result.status == 200:
+                addresses_data = result.response.json()
+                for addr, timestamp in addresses_data.items():
+                    if re.match(r'^\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}:\d+$', addr):
+                        all_addresses[addr] = timestamp
         self.address_pool.update(all_addresses)
         print(self.own_port,":",all_addresses)
         return all_addresses
@@ -99,20 +107,13 @@ class Router:
         """
         每过1秒向地址池中的每个地址发送心跳检测包，并根据响应更新地址池
         """
-        current_time = time.time()
-        addresses_to_remove = []
-
-        for address, last_heartbeat_time in self.address_pool.items():
-            try:
-                # 假设其他节点有一个接收心跳检测包的接口，例如 /heartbeat
-                response = requests.get(f"http://{address}/heartbeat")
-                if response.status_code == 200:
-                    self.refresh_address_time(address)
-            except requests.exceptions.RequestException:
-                addresses_to_remove.append(address)
-
-        for address in addresses_to_remove:
-            del self.address_pool[address]
+        for address, result in self.peers.broadcast(self._peer_addresses(), 'GET', '/heartbeat').items():
+            if result.status == 200:
+                self.refresh_address_time(address)
+            elif result.status is None:
+                # 连接失败，移出地址池
+                self.address_pool.pop(address, None)
+                self.peers.forget(address)
 
     def refresh_address_time(self, address: str) -> None:
         """
@@ -138,53 +139,540 @@ class Router:
 
 # 矿工节点类
 class MinerNode(Router):
-    def __init__(self, own_port:int,blockchain_file: str):
+    SYNC_PAGE_SIZE = 500    # /sync 每页最多返回的区块数
+    HEADERS_PAGE_SIZE = 2000  # /headers 每页最多返回的区块头数
+    BLOCK_CACHE_SIZE = 256    # 按需加载时缓存的已解码区块数
+    SNAPSHOT_INTERVAL = 100   # 每新增多少个区块写一次区块链状态快照
+    MAX_BLOCK_TXS = 2000      # 一个区块最多打包的交易数
+    MAX_BLOCK_BYTES = 1024 * 1024   # 一个区块中交易序列化后的总字节数上限
+    MAX_TX_BATCH = 100000     # /post_transactions 一次最多提交的交易数
+    NDJSON_CONTENT_TYPE = 'application/x-ndjson'
+    UTXO_PAGE_SIZE = 1000     # /utxos 每页最多返回的输出数
+    MAX_FILTERS = 1000        # 同时保存的轻钱包布隆过滤器数，超过时淘汰最久未使用的
+
+    def __init__(self, own_port:int,blockchain_file: str,verify_engine:VerifyEngine=None):
         super().__init__(own_port)
-        self.transaction_list:List[Transaction] = []            # 临时的保存的交易池
+        self.verify_engine:VerifyEngine = verify_engine or get_verify_engine()  # 批量签名校验
+        self.difficulty:int = 4                                  # 挖矿难度，哈希前 difficulty 位十六进制为 0
+        self.miner:Miner = Miner()                               # 多进程挖矿
+        self.validation:ValidationPipeline = ValidationPipeline(self.verify_engine)  # 收到的区块分阶段验证
+        self.mempool:Mempool = Mempool()                        # 交易池，按手续费排序，有容量上限
         self.transaction_list_lock = threading.Lock()           # 锁
-        self.orphan_blocks:List[Block] = []                     # 孤儿交易池
-        self.blockchain:BlockChain = BlockChain.read_blockchain(blockchain_file) # 本矿工节点的区块链
+        self.orphan_pool:OrphanPool = OrphanPool()              # 孤儿区块池，按父区块哈希索引，有容量和时间上限
+        self.filters:LRUCache = LRUCache(self.MAX_FILTERS)      # 轻钱包注册的布隆过滤器，编号 -> BloomFilter
+        self.seen:RecentFilter = RecentFilter()                 # 最近见过的区块/交易哈希，避免重复请求和重复公告
+        self.block_store:BlockStore = BlockStore(f"./data/{self.own_ip}_{self.own_port}")  # 追加写的区块存储
+        self.snapshot_height:int = 0                              # 最近一次快照包含的区块数
+        self._snapshot_lock = threading.Lock()                    # 同一时间只写一个快照，旧的不会覆盖新的
+        if len(self.block_store) == 0:
+            # 第一次启动，从初始文件加载并写入区块存储
+            self.blockchain:BlockChain = BlockChain.read_blockchain(blockchain_file) # 本矿工节点的区块链
+            self._save()
+        else:
+            # 区块体留在存储中按需解码，只常驻区块头和索引；有快照时只重放快照之后的区块
+            snapshot = read_snapshot(snapshot_path(self.block_store.path))
+            self.blockchain:BlockChain = self.block_store.load_blockchain(
+                lazy=True,cache_size=self.BLOCK_CACHE_SIZE,snapshot=snapshot)
+            if snapshot is not None and snapshot.height <= self.blockchain.height:
+                self.snapshot_height = snapshot.height
         self.add_routes('/addBlock',methods=['POST'], view_func=self.addBlock_handler)
         self.add_routes('/getBlockChain',methods=['GET'],view_func=self.getBlockChain_handler)
         self.add_routes('/post_transaction',methods=['POST'],view_func=self.post_transaction_handle)
-        threading.Thread(target = self._pack_block).start() # 负责观察 transaction_list 并打包
+        self.add_routes('/post_transactions',methods=['POST'],view_func=self.post_transactions_handle)
+        self.add_routes('/sync',methods=['GET'],view_func=self.sync_handler)
+        self.add_routes('/headers',methods=['GET'],view_func=self.headers_handler)
+        self.add_routes('/inv',methods=['POST'],view_func=self.inv_handler)
+        self.add_routes('/getdata',methods=['POST'],view_func=self.getdata_handler)
+        self.add_routes('/merkle_proof',methods=['GET'],view_func=self.merkle_proof_handler)
+        self.add_routes('/balance',methods=['GET'],view_func=self.balance_handler)
+        self.add_routes('/utxos',methods=['GET'],view_func=self.utxos_handler)
+        self.add_routes('/filterload',methods=['POST'],view_func=self.filterload_handler)
+        self.add_routes('/filtered_blocks',methods=['GET'],view_func=self.filtered_blocks_handler)
+        self.add_routes('/stats',methods=['GET'],view_func=self.stats_handler)
+        self.ibd:HeadersFirstSync = HeadersFirstSync(self)       # 先同步区块头，再从多个节点并行下载区块
+        self.hook_before_run.append(self.initial_block_download)
+        threading.Thread(target = self._pack_block).start() # 负责观察交易池并打包
 
     def post_transaction_handle(self):
-        response = request.get_json() # 接收一个交易的序列化
-        transaction_data = response['transaction']
-        assert (isinstance(transaction_data, dict))
-        transact = Transaction.from_dict(transaction_data)
-        # 检查 transact 是否已经在 self.transaction_list 中，防止重复
+        if request.content_type == BINARY_CONTENT_TYPE:
+            transact = decode_transaction(request.get_data())
+        else:
+            response = request.get_json() # 接收一个交易的序列化
+            transaction_data = response['transaction']
+            assert (isinstance(transaction_data, dict))
+            transact = Transaction.from_dict(transaction_data)
+        code, message = self._accept_transaction(transact)
+        if code == 200:
+            self.announce([{"type":"tx","hash":transact.Hash}])
+        return jsonify({"code":code,"message":message}),code
+
+    def _accept_transaction(self, transact:Transaction):
+        """
+        验证交易并加入交易池
+
+        :return: (code, message)
+        """
+        transact._set_hash()
+        try:
+            # 与区块验证相同的规则，否则打包出的区块会被其他节点拒绝
+            check_transaction_rules(transact)
+        except ValueError as e:
+            return 400,str(e)
+        # 签名校验最耗时，放在锁外批量完成
+        if not all(self.verify_engine.verify_batch(transact.signature_jobs())):
+            return 400,"Invalid signature"
         with self.transaction_list_lock:
-            for tx in self.transaction_list:
-                if tx.Hash == transact.Hash:
-                    return jsonify({"code":400,"message":"Duplicate transaction"}),400
-            transact.verify(self.blockchain)               # 进行验证
-            self.transaction_list.append(transact)
-        return {"code":200,"message":"Transaction received successfully"}
+            return self._admit_transaction(transact)
 
-    def addBlock_handler(self):
-        response = request.get_json() # 接收一个区块的序列化
-        block_data = response['block']
-        assert(isinstance(block_data,dict))
-        block = Block.from_dict(block_data)
+    def _admit_transaction(self, transact:Transaction):
+        """
+        检查输入和金额后加入交易池，调用方持有 transaction_list_lock，签名已经校验过
+        输入可以是链上的未花费输出，也可以是交易池中交易的输出
+
+        :return: (code, message)
+        """
+        # 检查 transact 是否已经在交易池或链上，防止重复
+        if transact.Hash in self.mempool or transact.Hash in self.blockchain.tx_index:
+            return 400,"Duplicate transaction"
+        try:
+            fee = transact.verify(self.mempool.view(self.blockchain.utxo_set),check_signatures=False)  # 进行验证
+            self.mempool.add(transact, fee)
+        except Exception as e:
+            return 400,str(e)
+        return 200,"Transaction received successfully"
+
+    def post_transactions_handle(self):
+        """
+        批量提交交易：{"transactions": [...]}、JSON 数组，或者每行一个交易的 NDJSON
+
+        :return: 接受的交易数，以及按提交顺序每笔交易的 hash、code、message
+        """
+        try:
+            if request.content_type == self.NDJSON_CONTENT_TYPE:
+                items = [json.loads(line) for line in request.get_data().splitlines() if line.strip()]
+            else:
+                items = request.get_json()
+                if isinstance(items, dict):
+                    items = items['transactions']
+            assert isinstance(items, list)
+        except Exception:
+            return jsonify({"code":400,"message":"Expect a JSON array or NDJSON of transactions."}),400
+        if len(items) > self.MAX_TX_BATCH:
+            return jsonify({"code":413,"message":f"At most {self.MAX_TX_BATCH} transactions per batch."}),413
+        results = self._accept_transactions(items)
+        accepted = [r["hash"] for r in results if r["code"] == 200]
+        if accepted:
+            self.announce([{"type":"tx","hash":h} for h in accepted])
+        return jsonify({"code":200,"accepted":len(accepted),"results":results}),200
+
+    def _accept_transactions(self, items:List[Dict])->List[Dict]:
+        """
+        批量验证交易并加入交易池
+
+        1. 解析、计算哈希、检查与区块验证相同的交易规则、批内去重
+        2. 全部签名一次交给 VerifyEngine 校验（锁外）
+        3. 按依赖顺序排列：花费批内其它交易输出的交易排在后面
+        4. 只获取一次锁，逐笔检查输入并加入交易池
+
+        :param items: 交易的字典表示
+        :return: 与 items 一一对应的 {"hash","code","message"}
+        """
+        results: List[Dict] = [None] * len(items)
+        batch: Dict[str, int] = {}          # txid -> 在 items 中的位置
+        transactions: Dict[int, Transaction] = {}
+        for i, item in enumerate(items):
+            try:
+                transact = Transaction.from_dict(item.get('transaction', item))
+                transact._set_hash()
+                check_transaction_rules(transact)
+            except Exception as e:
+                results[i] = {"hash":"","code":400,"message":f"Invalid transaction: {e}"}
+                continue
+            if transact.Hash in batch:
+                results[i] = {"hash":transact.Hash,"code":400,"message":"Duplicate transaction"}
+                continue
+            batch[transact.Hash] = i
+            transactions[i] = transact
+
+        # 签名校验最耗时，整批一起交给进程池
+        jobs = []
+        for transact in transactions.values():
+            jobs.extend(transact.signature_jobs())
+        verified = iter(self.verify_engine.verify_batch(jobs))
+        valid: List[int] = []
+        for i, transact in transactions.items():
+            if all([next(verified) for _ in transact.Vin]):
+                valid.append(i)
+            else:
+                results[i] = {"hash":transact.Hash,"code":400,"message":"Invalid signature"}
+
+        # 拓扑排序：父交易在批内时先处理父交易，其余保持提交顺序
+        order: List[int] = []
+        done = set()
+        visiting = set()
+        for i in valid:
+            stack = [(i, False)]
+            while stack:
+                j, expanded = stack.pop()
+                if j in done:
+                    continue
+                if expanded:
+                    done.add(j)
+                    order.append(j)
+                    continue
+                if j in visiting:
+                    continue
+                visiting.add(j)
+                stack.append((j, True))
+                for input_obj in transactions[j].Vin:
+                    parent = batch.get(input_obj.txid)
+                    if parent is not None and parent in transactions and parent not in done:
+                        stack.append((parent, False))
+
+        with self.transaction_list_lock:
+            for i in order:
+                if results[i] is None:
+                    code, message = self._admit_transaction(transactions[i])
+                    results[i] = {"hash":transactions[i].Hash,"code":code,"message":message}
+        return results
+
+    def merkle_proof_handler(self):
+        '''
+        轻节点查询交易的 merkle 证明，配合 block.verify_merkle_proof 使用
+
+        :return: 交易所在区块的哈希、高度、merkle 根以及证明
+        '''
+        txid = request.args.get('txid', '')
+        # 交易位置和区块在锁内一起取得；区块不可变，证明在锁外计算
+        with self.transaction_list_lock:
+            position = self.blockchain.tx_index.get(txid)
+            if position is None:
+                return jsonify({"code":404,"message":"Transaction not found."}),404
+            block = self.blockchain[position[0]]
+        return jsonify({"code":200,
+                        "block_hash":block.Hash,
+                        "height":position[0],
+                        "merkle_root":block.merkle_root,
+                        "proof":block.merkle_proof(txid)}),200
+
+    def _map_addresses(self):
+        '''按地址查询前为新出现的公钥计算地址：锁内只取出公钥，base58 编码在锁外'''
+        with self.transaction_list_lock:
+            keys = self.blockchain.utxo_set.index.unmapped()
+        if keys:
+            addresses = addresses_for(keys)
+            with self.transaction_list_lock:
+                self.blockchain.utxo_set.index.map_addresses(addresses)
+
+    def _wallet_key(self):
+        '''/balance、/utxos 的查询对象：?pubkey=（hex）或 ?address=（钱包地址），调用方持有锁'''
+        pubkey = request.args.get('pubkey')
+        address = request.args.get('address')
+        return self.blockchain.utxo_set.index.resolve(pubkey=pubkey, address=address), pubkey, address
+
+    def balance_handler(self):
+        '''
+        钱包余额：GET /balance?pubkey=... 或 GET /balance?address=...
+        由 UTXO 集合的地址索引直接得到，只统计已上链的输出
+        '''
+        if not request.args.get('pubkey') and not request.args.get('address'):
+            return jsonify({"code":400,"message":"Expect pubkey or address."}),400
+        if not request.args.get('pubkey'):
+            self._map_addresses()
+        with self.transaction_list_lock:
+            key, pubkey, address = self._wallet_key()
+            index = self.blockchain.utxo_set.index
+            return jsonify({"code":200,
+                            "pubkey":pubkey,
+                            "address":address,
+                            "balance":index.balance(key),
+                            "count":index.count(key),
+                            "height":self.blockchain.height}),200
+
+    def utxos_handler(self):
+        '''
+        钱包的未花费输出，按确认顺序分页：GET /utxos?pubkey=...&offset=0&limit=N（或 address=...）
+        next_offset 为下一页的起始位置，没有下一页时为 null
+        '''
+        if not request.args.get('pubkey') and not request.args.get('address'):
+            return jsonify({"code":400,"message":"Expect pubkey or address."}),400
+        try:
+            offset = max(self._query_int('offset', 0), 0)
+            limit = max(min(self._query_int('limit', self.UTXO_PAGE_SIZE), self.UTXO_PAGE_SIZE), 0)
+        except ValueError:
+            return jsonify({"code":400,"message":"offset and limit must be integers."}),400
+        if not request.args.get('pubkey'):
+            self._map_addresses()
+        with self.transaction_list_lock:
+            key, pubkey, address = self._wallet_key()
+            index = self.blockchain.utxo_set.index
+            total = index.count(key)
+            page = index.outputs(key, offset, limit)
+            height = self.blockchain.height
+        next_offset = offset + len(page)
+        return jsonify({"code":200,
+                        "utxos":[{"txid":txid,"vout":vout,"value":output.value} for (txid, vout), output in page],
+                        "total":total,
+                        "next_offset":next_offset if next_offset < total else None,
+                        "height":height}),200
+
+    def filterload_handler(self):
+        '''
+        轻钱包注册布隆过滤器：POST /filterload {"filter": BloomFilter.to_dict(), "filter_id": 可选，替换已有的}
 
-        # 清理一下已经被别人打包的交易
+        :return: filter_id，之后用于 /filtered_blocks
+        '''
+        data = request.get_json(silent=True) or {}
+        try:
+            bloom = BloomFilter.from_dict(data['filter'])
+        except (KeyError, TypeError, ValueError) as e:
+            return jsonify({"code":400,"message":f"Invalid filter: {e}"}),400
+        filter_id = data.get('filter_id') or os.urandom(16).hex()
+        self.filters.put(filter_id, bloom)
+        return jsonify({"code":200,"filter_id":filter_id}),200
+
+    def filtered_blocks_handler(self):
+        '''
+        按过滤器返回区块中匹配的交易和 merkle 证明：GET /filtered_blocks?filter=ID&height=H&limit=N
+        只返回有匹配交易的区块；next_height 为下一页的起始高度，轻钱包用自己同步的区块头校验证明
+        '''
+        bloom = self.filters.get(request.args.get('filter', ''))
+        if bloom is None:
+            return jsonify({"code":404,"message":"Unknown filter, send /filterload first."}),404
+        try:
+            start = max(self._query_int('height', 0), 0)
+            limit = min(self._query_int('limit', self.SYNC_PAGE_SIZE), self.SYNC_PAGE_SIZE)
+        except ValueError:
+            return jsonify({"code":400,"message":"height and limit must be integers."}),400
         with self.transaction_list_lock:
-            filtered_transactions = [tx for tx in self.transaction_list if not block.is_transaction_in(tx.Hash)]
-            self.transaction_list = filtered_transactions
+            tip = self.blockchain.height
+            hashes = self.blockchain.block_hashes(start, min(start + max(limit, 0), tip))
+        blocks = []
+        end = start
+        # 过滤在锁外进行；区块已经被清理时这一页提前结束
+        for height, block in enumerate(self._blocks_by_hash(hashes), start):
+            end = height + 1
+            matched = [tx for tx in block.Transactions if filter_matches(bloom, tx)]
+            if matched:
+                blocks.append({"height":height,
+                               "hash":block.Hash,
+                               "transactions":[{"transaction":tx.to_dict(),"proof":block.merkle_proof(tx.Hash)}
+                                               for tx in matched]})
+        return jsonify({"code":200,"blocks":blocks,"next_height":end,"tip_height":tip}),200
+
+    def stats_handler(self):
+        '''节点运行时的统计信息'''
+        return jsonify({"signature_cache":get_signature_cache().stats(),
+                        "mempool":{"count":len(self.mempool),"bytes":self.mempool.total_bytes},
+                        "orphans":self.orphan_pool.stats(),
+                        "filters":len(self.filters),
+                        "validation":self.validation.stats(),
+                        "miner":self.miner.stats(),
+                        "peers":self.peers.latency_stats(),
+                        "ibd":self.ibd.stats,
+                        "block_cache":self._block_cache_stats()}),200
+
+    def _block_cache_stats(self)->Dict:
+        cache = getattr(self.blockchain.blocks, 'cache', None)
+        return cache.stats() if cache is not None else {}
 
+    def addBlock_handler(self):
+        try:
+            # 接收一个区块的序列化，二进制或 {"block": {...}}
+            block = self.validation.decode(request.get_data(), request.content_type == BINARY_CONTENT_TYPE)
+        except BlockValidationError as e:
+            return jsonify({"code":400,"message":str(e)}),400
+        code, message = self._accept_block(block)
+        if code == 200:
+            self.announce([{"type":"block","hash":block.Hash}])
+        return jsonify({"code":code,"message":message}),code
+
+    def _accept_block(self, block:Block):
+        """
+        验证区块并加入区块链
 
-        if not self.blockchain.add_block(block):
-            # 如果是孤儿节点，则加入到孤儿池中，等待父节点被添加后，再尝试添加
-            self.orphan_blocks.append(block)
+        :return: (code, message)
+        """
+        if self.blockchain.get_block(block.Hash) is not None or block.Hash in self.orphan_pool:
+            return 400,"Duplicate block."
+        # 与链状态无关的检查在锁外进行：区块头 -> merkle -> 多进程并行校验签名
+        try:
+            self.validation.check_block(block)
+        except BlockValidationError as e:
+            return 400,str(e)
+
+        # 修改区块链和交易池都在同一把锁下，写快照时看到的是一致的状态
+        with self.transaction_list_lock:
+            if self.blockchain.get_block(block.Hash) is not None or block.Hash in self.orphan_pool:
+                return 400,"Duplicate block."
+            try:
+                # 接入主链前（包括重组时）检查难度和每笔交易的输入
+                update = self.blockchain.accept_block(block, check=self.validation.check_connect)
+            except BlockValidationError as e:
+                return 400,str(e)
+            changed = bool(update.connected)
+            if update.orphan:
+                # 如果是孤儿节点，则加入到孤儿池中，等待父节点被添加后，再尝试添加
+                self.orphan_pool.add(block)
+            else:
+                self._apply_chain_update(update)
+                # 孤儿池中以它为祖先的区块一次全部接上
+                changed = self._resolve_orphans(block.Hash) or changed
+        if update.orphan:
             print("orphan block")
             print("current_hash: ",self.blockchain.current_hash," block_hash: ",block.Hash)
-            return jsonify({"code":400,"message":"Orphan block."}),400
-        # 查看孤儿池中是否有子节点可以添加
-        self._orphan_block_to_blockchain(block.Hash)
+            return 400,"Orphan block."
+        if not changed:
+            return 200,"Block stored on side branch."
+        # 别人先挖出了区块，当前正在挖的区块已经过时
+        self.miner.cancel()
         self._save()
-        return jsonify({"code":200,"message":"Block added."}),200
+        if update.disconnected:
+            print(f"{self.own_port}: reorg at height {update.fork_height}, "
+                  f"-{len(update.disconnected)} +{len(update.connected)} blocks")
+        return 200,"Block added."
+
+    def _apply_chain_update(self, update:ChainUpdate):
+        '''
+        主链改变后同步交易池和区块存储，调用方持有 transaction_list_lock
+
+        - 接入主链的区块：删除其中的交易以及与之双花的交易
+        - 回滚出主链的区块：其中不在新主链上的交易重新放回交易池；
+          放不回去的（与新主链双花、交易池已满），花费它的输出的池内交易一起删除
+        - 发生重组后重新检查池中剩下的交易，不会打包出输入不存在的区块
+        '''
+        for block in update.connected:
+            self.mempool.remove_for_block(block)
+        dropped = 0
+        for block in reversed(update.disconnected):
+            for tx in block.Transactions:
+                if tx.Hash in self.blockchain.tx_index or tx.Hash in self.mempool:
+                    continue
+                try:
+                    self.mempool.add(tx, tx.verify(self.mempool.view(self.blockchain.utxo_set), check_signatures=False))
+                except Exception as e:
+                    dropped += 1 + self.mempool.remove_spenders(tx)
+                    print(f"{self.own_port}: transaction {tx.Hash} left the chain and was dropped: {e}")
+        if update.disconnected:
+            dropped += self.mempool.revalidate(self.blockchain.utxo_set)
+            if dropped:
+                print(f"{self.own_port}: reorg dropped {dropped} transactions from the mempool")
+        if update.fork_height is not None:
+            # LazyBlockList 回滚时已经截断了存储，普通列表需要在这里截断，之后由 _save 追加新分支
+            if not isinstance(self.blockchain.blocks, LazyBlockList):
+                self.block_store.truncate(update.fork_height)
+            self.snapshot_height = min(self.snapshot_height, update.fork_height)
+
+    @staticmethod
+    def _inventory(data)->List[Dict]:
+        """
+        /inv、/getdata 请求体中的 inv 列表，每一项的 type 为 block 或 tx，hash 为 64 位小写 hex
+        格式不对时抛出 ValueError，由调用方返回 400
+        """
+        items = data.get('inv', []) if isinstance(data, dict) else None
+        if not isinstance(items, list):
+            raise ValueError('Expect {"inv": [{"type": "block"|"tx", "hash": ...}]}.')
+        for item in items:
+            if not isinstance(item, dict) or item.get("type") not in ("block", "tx") \
+                    or not isinstance(item.get("hash"), str) or not re.fullmatch(r'[0-9a-f]{64}', item["hash"]):
+                raise ValueError(f"Invalid inventory item {str(item)[:100]}")
+        return items
+
+    def _want(self, item:Dict)->bool:
+        """inv 中的对象本节点是否还没有"""
+        h = item["hash"]
+        if h in self.seen:
+            return False
+        if item["type"] == "block":
+            return h not in self.blockchain.block_index
+        return h not in self.mempool and h not in self.blockchain.tx_index
+
+    def inv_handler(self):
+        """
+        收到其他节点的库存公告：{"from": "ip:port", "inv": [{"type": "block"|"tx", "hash": ...}]}
+        只向公告方请求本节点缺少的对象
+        """
+        data = request.get_json(silent=True)
+        try:
+            items = self._inventory(data)
+        except ValueError as e:
+            return jsonify({"code":400,"message":str(e)}),400
+        sender = data.get('from', '')
+        if not isinstance(sender, str) or not re.match(r'^\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}:\d+$', sender):
+            return jsonify({"code":400,"message":"Invalid address format"}),400
+        missing = [item for item in items if self._want(item) and self.seen.add(item["hash"])]
+        if missing:
+            threading.Thread(target=self._fetch_inventory, args=(sender, missing), daemon=True).start()
+        return jsonify({"code":200,"requested":len(missing)}),200
+
+    def getdata_handler(self):
+        """按哈希返回请求的区块和交易，二进制格式"""
+        try:
+            items = self._inventory(request.get_json(silent=True))
+        except ValueError as e:
+            return jsonify({"code":400,"message":str(e)}),400
+        blocks, transactions = [], []
+        with self.transaction_list_lock:
+            for item in items:
+                if item["type"] == "block":
+                    block = self.blockchain.get_block(item["hash"])
+                    if block is not None:
+                        blocks.append(block)
+                else:
+                    tx = self.mempool.get(item["hash"])
+                    if tx is not None:
+                        transactions.append(tx)
+        return Response(encode_inventory(blocks, transactions), mimetype=BINARY_CONTENT_TYPE),200
+
+    def _fetch_inventory(self, sender:str, items:List[Dict]):
+        """
+        向公告方请求缺少的对象，处理后继续向其他节点公告
+        取到的区块是孤儿时，接着向公告方请求它的父区块，直到接上区块树或对方也没有
+        """
+        relay = []
+        orphans = []
+        transactions = []
+        while items:
+            result = self.peers.request(sender, 'POST', '/getdata', json={'inv': items},
+                                        headers={'Accept': BINARY_CONTENT_TYPE})
+            try:
+                if result.status != 200:
+                    raise ValueError(f"/getdata {result.status} {result.error}")
+                blocks, received = decode_inventory(result.response.content)
+            except ValueError as e:
+                print(f"{self.own_port}: getdata from {sender} failed: {e}")
+                blocks, received = [], []
+            transactions.extend(received)
+            # 对方没有返回的对象以后还可以向别的节点请求
+            returned = {block.Hash for block in blocks} | {tx.Hash for tx in received}
+            for item in items:
+                if item["hash"] not in returned:
+                    self.seen.discard(item["hash"])
+            parents = []
+            for block in blocks:
+                if self._accept_block(block)[0] == 200:
+                    relay.append({"type":"block","hash":block.Hash})
+                elif block.Hash in self.orphan_pool:
+                    orphans.append(block.Hash)
+                    if self.seen.add(block.PrevBlockHash):
+                        parents.append({"type":"block","hash":block.PrevBlockHash})
+            items = parents
+        # 区块都处理完之后再处理交易，交易可能花费刚接上的区块中的输出
+        for tx in transactions:
+            if self._accept_transaction(tx)[0] == 200:
+                relay.append({"type":"tx","hash":tx.Hash})
+        # 父区块到达后接上的孤儿区块也一起公告
+        relay.extend({"type":"block","hash":h} for h in orphans if h in self.blockchain.block_index)
+        if relay:
+            self.announce(relay, exclude=sender)
+
+    def announce(self, items:List[Dict], exclude:str=None):
+        """向其他节点公告新的区块/交易哈希，对方缺少时会通过 /getdata 来取"""
+        for item in items:
+            self.seen.add(item["hash"])
+        own_address = f"{self.own_ip}:{self.own_port}"
+        addresses = [address for address in self._peer_addresses() if address != exclude]
+        return self.peers.broadcast(addresses, 'POST', '/inv', json={'from': own_address, 'inv': items})
 
     def getBlockChain_handler(self):
         '''
@@ -192,68 +680,201 @@ class MinerNode(Router):
         :return: 返回对方没有的 Block
         '''
         # 从GET请求的参数中获取datetime参数
-        datetime_str = request.args.get('datetime')
-        timestamp = datetime.datetime.fromisoformat(datetime_str)
-        return json.dumps([block.to_dict()
-                           for block in self.blockchain.get_blocks_after_time(timestamp)]),200
+        datetime_str = request.args.get('datetime', '')
+        try:
+            timestamp = datetime.datetime.fromisoformat(datetime_str)
+        except ValueError:
+            return jsonify({"code":400,"message":"datetime must be in ISO format."}),400
+        with self.transaction_list_lock:
+            blocks = self.blockchain.get_blocks_after_time(timestamp)
+        # 请求方在 Accept 中声明了二进制格式时返回二进制
+        if request.accept_mimetypes.best == BINARY_CONTENT_TYPE:
+            return Response(encode_blocks(blocks), mimetype=BINARY_CONTENT_TYPE),200
+        return json.dumps([block.to_dict() for block in blocks]),200
 
-    def addBlock(self):
-        '''把最新的 block 传播出去'''
-        own_address = f"{self.own_ip}:{self.own_port}"
-        for address in self.address_pool.keys():
-            if own_address == address:
-                continue
-            block = self.blockchain[-1]
-            response = requests.post(f"http://{address}/addBlock", json={'block': block.to_dict()})
-            print(address," ",response.status_code)
-            # print(address)
+    def sync_handler(self):
+        '''
+        分页同步区块：GET /sync?locator=h1,h2,...&limit=N 或 GET /sync?height=H&limit=N
+        从对方缺少的第一个区块开始，逐个区块流式返回一页，服务端内存与页大小无关。
+        Accept 为二进制格式时每个区块一帧（u32 长度 + 区块），否则每行一个区块的 JSON
+
+        响应头 X-Next-Height 为下一页的起始高度，X-Tip-Height 为本节点的区块数。
+        这一页的范围和区块哈希在锁内确定，输出期间发生重组也仍然输出这些区块
+        '''
+        try:
+            height = max(self._query_int('height', 0), 0)
+            limit = min(self._query_int('limit', self.SYNC_PAGE_SIZE), self.SYNC_PAGE_SIZE)
+        except ValueError:
+            return jsonify({"code":400,"message":"height and limit must be integers."}),400
+        locator = request.args.get('locator')
+        with self.transaction_list_lock:
+            start = self.blockchain.find_fork_height(locator.split(',')) if locator else height
+            tip = self.blockchain.height
+            end = min(start + max(limit, 0), tip)
+            hashes = self.blockchain.block_hashes(start, end)
+        headers = {'X-Start-Height': str(start), 'X-Next-Height': str(max(end, start)), 'X-Tip-Height': str(tip)}
+        blocks = self._blocks_by_hash(hashes)
+        if request.accept_mimetypes.best == BINARY_CONTENT_TYPE:
+            frames = (encode_block_frame(block) for block in blocks)
+            return Response(frames, mimetype=BINARY_CONTENT_TYPE, headers=headers)
+        lines = (json.dumps(block.to_dict()) + '\n' for block in blocks)
+        return Response(lines, mimetype='application/x-ndjson', headers=headers)
+
+    def _query_int(self, name:str, default:int)->int:
+        '''查询参数中的整数，不是整数时抛出 ValueError，由调用方返回 400'''
+        return int(request.args.get(name, default))
+
+    def _blocks_by_hash(self, hashes:List[str])->Iterator[Block]:
+        '''
+        按哈希逐个取出区块，每取一个只短暂持有锁，调用方在锁外使用区块
+        重组回滚出主链的区块仍在侧链中可以取到；已经被清理的区块及之后的停止输出
+        '''
+        for block_hash in hashes:
+            with self.transaction_list_lock:
+                block = self.blockchain.get_block(block_hash)
+            if block is None:
+                return
+            yield block
+
+    def headers_handler(self):
+        '''
+        分页返回区块头：GET /headers?locator=h1,h2,...&limit=N，用于先同步区块头
+        Accept 为二进制格式时返回二进制列表，否则返回 JSON 列表；X-Tip-Height 为本节点的区块数
+        '''
+        try:
+            limit = min(self._query_int('limit', self.HEADERS_PAGE_SIZE), self.HEADERS_PAGE_SIZE)
+        except ValueError:
+            return jsonify({"code":400,"message":"limit must be an integer."}),400
+        locator = request.args.get('locator', '')
+        with self.transaction_list_lock:
+            start = self.blockchain.find_fork_height(locator.split(',')) if locator else 0
+            tip = self.blockchain.height
+            headers = [self.blockchain.header(h) for h in range(start, min(start + max(limit, 0), tip))]
+        response_headers = {'X-Tip-Height': str(tip)}
+        if request.accept_mimetypes.best == BINARY_CONTENT_TYPE:
+            return Response(encode_headers(headers), mimetype=BINARY_CONTENT_TYPE, headers=response_headers)
+        return Response(json.dumps([h.to_dict() for h in headers]), mimetype='application/json', headers=response_headers)
+
+    def initial_block_download(self)->int:
+        '''
+        启动时从地址池中的节点追上最长链：先同步区块头，再并行下载区块体
+
+        :return: 新加入的区块数
+        '''
+        added = self.ibd.run()
+        if added:
+            print(f"{self.own_port}: synced {added} blocks in {self.ibd.stats['seconds']:.2f}s from {self.ibd.stats['served']}")
+        return added
 
     def _pack_block(self):
         while True:
-            '''TODO 挖矿逻辑可以在这里补充'''
-            time.sleep(random.randint(1,10))
-            with self.transaction_list_lock:
-                if len(self.transaction_list) == 0:
-                    continue
-                block = Block(
-                    Timestamp=datetime.datetime.now(timezone.utc),
-                    Transactions=deepcopy(self.transaction_list),
-                    PrevBlockHash=deepcopy(self.blockchain.current_hash),
-                    Hash="",
-                    Nonce=0,                               # 和挖矿相关的字段
-                    Height=self.blockchain.height,         # 和当前节点相关
-                    Difficulty=4                           # 当前无用
-                )
-                block.set_hash()
-                assert(len(block.Transactions)!=0)
-                self.blockchain.add_block(block)
-                self.addBlock()             # 广播出去
-                self.transaction_list.clear()
-            self._save()
+            time.sleep(1)
+            self.mine_block()
+
+    def mine_block(self)->Optional[Block]:
+        '''
+        从交易池选出交易打包并挖矿一次
+
+        :return: 接入主链的区块；交易池为空、挖矿被取消、挖矿期间链已更新或区块没有通过验证时返回 None
+        '''
+        # 锁内只取交易池的快照（共享交易对象，不复制）和当前链尾，区块在锁外组装
+        with self.transaction_list_lock:
+            transactions = self.mempool.select(self.MAX_BLOCK_TXS, self.MAX_BLOCK_BYTES)   # 手续费高的优先
+            prev_hash = self.blockchain.current_hash
+            height = self.blockchain.height
+        if not transactions:
+            return None
+        block = Block(
+            Timestamp=datetime.datetime.now(timezone.utc),
+            Transactions=list(transactions),
+            PrevBlockHash=prev_hash,
+            Hash="",
+            Nonce=0,                               # 和挖矿相关的字段
+            Height=height,                         # 和当前节点相关
+            Difficulty=self.difficulty
+        )
+        # 挖矿在锁外进行，收到竞争区块时会被 addBlock_handler 取消
+        if not self.miner.mine(block):
+            return None
+        with self.transaction_list_lock:
+            if block.PrevBlockHash != self.blockchain.current_hash:
+                return None   # 挖矿期间链已经更新，区块作废
+            try:
+                # 自己挖出的区块与收到的区块走同样的检查，不会把其他节点拒绝的区块接入主链
+                update = self.blockchain.accept_block(block, check=self.validation.check_connect)
+            except BlockValidationError as e:
+                print(f"{self.own_port}: mined block rejected {e}")
+                self._drop_invalid_transactions(transactions)
+                return None
+            # 只删除区块中打包的交易，挖矿期间新到的和没放进区块的交易留在交易池中
+            self._apply_chain_update(update)
+        print(f"{self.own_port}: mined block {block.Height} {block.Hash} {self.miner.last_hashrate:.0f} H/s")
+        self.announce([{"type":"block","hash":block.Hash}])  # 公告出去，需要的节点会来取
+        self._save()
+        return block
+
+    def _drop_invalid_transactions(self, transactions:Iterable[Transaction]):
+        '''打包出的区块没有通过验证：删除其中不符合交易规则的交易，再重新检查交易池，调用方持有 transaction_list_lock'''
+        for tx in transactions:
+            try:
+                check_transaction_rules(tx)
+            except ValueError:
+                self.mempool.remove_with_descendants(tx.Hash)
+        self.mempool.revalidate(self.blockchain.utxo_set)
 
     def _save(self):
         '''
-        模拟保存区块链
+        保存区块链：只把区块存储中还没有的新区块追加写入
+        完整的 JSON 导出见 storage.py
+
+        打包线程和 Flask 线程都会调用，重组时 _apply_chain_update 还会截断存储；
+        比较长度和追加必须与它们在同一把锁下，否则同一个区块会被写入两次
         :return:
         '''
-        addr = f"./data/{self.own_ip}_{self.own_port}.json"
-        self.blockchain.save_blockchain(addr)
-
-    def _orphan_block_to_blockchain(self, father_block_hash:str):
-        """将孤儿池中的父节点为 father_block_hash 的区块添加到区块链中"""
-        if father_block_hash == "":
-            return
-        orphan_block_hash = ""
-        for orphan_block in self.orphan_blocks:
-            if orphan_block.PrevBlockHash == father_block_hash:
-                self.blockchain.add_block(orphan_block)
-                print("orphan block added")
-                orphan_block_hash = orphan_block.Hash
-                self.orphan_blocks.remove(orphan_block)
-                break
-        # 孤儿池中可能还有其他孤儿，需要继续遍历
-        return self._orphan_block_to_blockchain(orphan_block_hash)
+        with self.transaction_list_lock:
+            for height in range(len(self.block_store), self.blockchain.height):
+                self.block_store.append(self.blockchain[height])
+        if self.blockchain.height - self.snapshot_height >= self.SNAPSHOT_INTERVAL:
+            self.save_snapshot()
 
+    def save_snapshot(self)->int:
+        '''
+        写区块链状态快照，重启时只需重放快照之后的区块
+        锁内只复制 UTXO 集合、区块头和交易索引的引用，保证它们与高度一致；编码和写文件都在锁外
+
+        :return: 快照包含的区块数
+        '''
+        with self._snapshot_lock:
+            with self.transaction_list_lock:
+                height = self.blockchain.height
+                if height <= self.snapshot_height:
+                    return self.snapshot_height
+                state = ChainSnapshot.capture(self.blockchain)
+            data = state.encode()
+            # 快照中的区块必须已经在区块存储中
+            self.block_store.flush()
+            write_snapshot(snapshot_path(self.block_store.path), data)
+            self.snapshot_height = height
+            return height
+
+    def _resolve_orphans(self, parent_hash:str)->bool:
+        """
+        父区块加入区块树后，按广度优先顺序把孤儿池中它的全部后代加入区块树，调用方持有 transaction_list_lock
+
+        :return: 主链是否因此改变
+        """
+        changed = False
+        for orphan_block in self.orphan_pool.descendants(parent_hash):
+            try:
+                update = self.blockchain.accept_block(orphan_block, check=self.validation.check_connect)
+            except BlockValidationError as e:
+                print(f"{self.own_port}: invalid orphan block {orphan_block.Hash} {e}")
+                continue
+            self._apply_chain_update(update)
+            changed = changed or bool(update.connected)
+        if changed:
+            print(f"{self.own_port}: orphan blocks added, height {self.blockchain.height}")
+        return changed
 
 
 if __name__ == '__main__':
@@ -0,0 +1,114 @@
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Set
+
+from block import Block
+from codec import encode_block
+
+
+@dataclass
+class OrphanEntry:
+    block: Block
+    size: int       # 序列化后的字节数
+    added: float    # 进入孤儿池的时间
+
+
+class OrphanPool:
+    """
+    有索引、有容量上限的孤儿区块池
+
+    - 区块哈希 -> 孤儿区块，O(1) 去重
+    - PrevBlockHash -> 子区块哈希，父区块到达时直接找到它的子区块
+    - 数量、字节数超过上限时淘汰最早进入的，超过 max_age 秒的孤儿也会被丢弃
+
+    本身不加锁，由调用方（MinerNode.transaction_list_lock）保证互斥
+    """
+
+    def __init__(self, max_count: int = 750, max_bytes: int = 32 * 1024 * 1024, max_age: float = 20 * 60):
+        """
+        :param max_count: 最多容纳的孤儿区块数
+        :param max_bytes: 所有孤儿区块序列化后的总字节数上限
+        :param max_age: 孤儿区块最多保留的秒数
+        """
+        self.max_count = max_count
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.total_bytes = 0
+        self.evicted = 0
+        self._entries: Dict[str, OrphanEntry] = {}      # 按进入顺序排列，最早的在前
+        self._by_prev: Dict[str, Set[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, block_hash: str) -> bool:
+        return block_hash in self._entries
+
+    def get(self, block_hash: str) -> Optional[Block]:
+        entry = self._entries.get(block_hash)
+        return entry.block if entry else None
+
+    def add(self, block: Block, now: float = None) -> bool:
+        """
+        加入一个父区块未知的区块
+
+        :return: 是否加入（已经在池中或立即被淘汰时返回 False）
+        """
+        now = time.time() if now is None else now
+        self.expire(now)
+        if block.Hash in self._entries:
+            return False
+        entry = OrphanEntry(block, len(encode_block(block)), now)
+        self._entries[block.Hash] = entry
+        self._by_prev.setdefault(block.PrevBlockHash, set()).add(block.Hash)
+        self.total_bytes += entry.size
+        while len(self._entries) > self.max_count or self.total_bytes > self.max_bytes:
+            self.remove(next(iter(self._entries)))
+            self.evicted += 1
+        return block.Hash in self._entries
+
+    def remove(self, block_hash: str) -> Optional[Block]:
+        entry = self._entries.pop(block_hash, None)
+        if entry is None:
+            return None
+        siblings = self._by_prev.get(entry.block.PrevBlockHash)
+        if siblings is not None:
+            siblings.discard(block_hash)
+            if not siblings:
+                del self._by_prev[entry.block.PrevBlockHash]
+        self.total_bytes -= entry.size
+        return entry.block
+
+    def expire(self, now: float = None) -> int:
+        """丢弃超过 max_age 的孤儿区块，返回丢弃的个数"""
+        now = time.time() if now is None else now
+        expired = 0
+        while self._entries:
+            block_hash, entry = next(iter(self._entries.items()))
+            if now - entry.added <= self.max_age:
+                break
+            self.remove(block_hash)
+            expired += 1
+        self.evicted += expired
+        return expired
+
+    def take_children(self, parent_hash: str) -> List[Block]:
+        """取出（并从池中删除）父区块为 parent_hash 的全部孤儿区块"""
+        return [self.remove(block_hash) for block_hash in list(self._by_prev.get(parent_hash, ()))]
+
+    def descendants(self, parent_hash: str) -> List[Block]:
+        """
+        按广度优先顺序取出 parent_hash 的全部后代，父区块总是在子区块之前
+        迭代实现，孤儿链再长也不会超过递归深度
+        """
+        blocks = []
+        queue = deque([parent_hash])
+        while queue:
+            for block in self.take_children(queue.popleft()):
+                blocks.append(block)
+                queue.append(block.Hash)
+        return blocks
+
+    def stats(self) -> Dict[str, int]:
+        return {"count": len(self._entries), "bytes": self.total_bytes, "evicted": self.evicted}
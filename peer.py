@@ -0,0 +1,132 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, Iterable, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class RecentFilter:
+    """有界的“最近见过”集合，超过容量时忘掉最早加入的哈希"""
+
+    def __init__(self, capacity: int = 50000):
+        self.capacity = capacity
+        self._items: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._items
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def add(self, key: str) -> bool:
+        """加入一个哈希，原来不在集合中时返回 True"""
+        with self._lock:
+            if key in self._items:
+                return False
+            self._items[key] = None
+            while len(self._items) > self.capacity:
+                self._items.popitem(last=False)
+            return True
+
+    def discard(self, key: str) -> None:
+        with self._lock:
+            self._items.pop(key, None)
+
+
+@dataclass
+class PeerResult:
+    address: str
+    ok: bool                                   # 请求成功且状态码 < 500
+    status: Optional[int]                      # HTTP 状态码，请求失败时为 None
+    latency: float                             # 耗时（秒）
+    response: Optional[requests.Response] = None
+    error: Optional[str] = None
+
+
+class PeerClient:
+    """
+    对等节点的 HTTP 客户端
+
+    - 每个节点一个 requests.Session，复用 TCP 连接，不再每次请求都握手
+    - 广播时并发发送，并行度有上限，每个请求都有超时，
+      一个慢节点不会拖慢其他节点，广播总耗时约等于最慢节点的耗时
+    - 记录每个节点最近一次和平均的请求耗时
+    """
+
+    def __init__(self, timeout: Tuple[float, float] = (1.0, 5.0), max_parallel: int = 16, pool_size: int = 4):
+        """
+        :param timeout: (连接超时, 读超时)，单位秒
+        :param max_parallel: 广播时同时进行的请求数上限
+        :param pool_size: 每个节点保持的连接数
+        """
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self._sessions: Dict[str, requests.Session] = {}
+        self._latency: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_parallel, thread_name_prefix='peer')
+
+    def _session(self, address: str) -> requests.Session:
+        with self._lock:
+            session = self._sessions.get(address)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=0)
+                session.mount('http://', adapter)
+                self._sessions[address] = session
+            return session
+
+    def _record(self, address: str, latency: float, ok: bool) -> None:
+        with self._lock:
+            stats = self._latency.setdefault(address, {'last': 0.0, 'avg': 0.0, 'count': 0, 'failures': 0})
+            stats['last'] = latency
+            stats['count'] += 1
+            # 指数移动平均
+            stats['avg'] = latency if stats['count'] == 1 else 0.8 * stats['avg'] + 0.2 * latency
+            if not ok:
+                stats['failures'] += 1
+
+    def request(self, address: str, method: str, path: str, **kwargs) -> PeerResult:
+        """
+        向单个节点发送请求，不抛出网络异常
+
+        :param address: ip:port
+        :param method: 'GET' / 'POST'
+        :param path: 以 / 开头的路径
+        :param kwargs: 传给 requests 的参数，可以覆盖 timeout
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        begin = time.time()
+        try:
+            response = self._session(address).request(method, f"http://{address}{path}", **kwargs)
+            latency = time.time() - begin
+            ok = response.status_code < 500
+            self._record(address, latency, ok)
+            return PeerResult(address, ok, response.status_code, latency, response)
+        except requests.exceptions.RequestException as e:
+            latency = time.time() - begin
+            self._record(address, latency, False)
+            return PeerResult(address, False, None, latency, error=str(e))
+
+    def broadcast(self, addresses: Iterable[str], method: str, path: str, **kwargs) -> Dict[str, PeerResult]:
+        """并发地向多个节点发送同一个请求，返回每个节点的结果"""
+        futures = {address: self._executor.submit(self.request, address, method, path, **kwargs)
+                   for address in list(addresses)}
+        return {address: future.result() for address, future in futures.items()}
+
+    def forget(self, address: str) -> None:
+        """节点下线后关闭它的连接池"""
+        with self._lock:
+            session = self._sessions.pop(address, None)
+            self._latency.pop(address, None)
+        if session is not None:
+            session.close()
+
+    def latency_stats(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {address: dict(stats) for address, stats in self._latency.items()}
@@ -0,0 +1,162 @@
+import os
+import struct
+import sys
+import zlib
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple, Union
+
+from block import Block, BlockChain, BlockHeader, Output
+from codec import decode_chain_state, encode_chain_state
+from utxo import OutPoint, UTXOSet
+
+# 快照文件：魔数 + payload 的 crc32 + 区块链状态的二进制编码
+SNAPSHOT_MAGIC = b'CHAINST1'
+SNAPSHOT_HEADER = struct.Struct('<8sI')
+SNAPSHOT_FILE = 'chainstate.snapshot'
+
+
+@dataclass
+class ChainSnapshot:
+    """
+    区块链在高度 height 处的状态，重启时加载它，只需重放之后的区块
+
+    - utxo_set: 前 height 个区块应用后的未花费输出
+    - headers / tx_index: 这些区块的区块头和交易索引，不必为了建索引解码区块
+    """
+    height: int                                 # 快照包含的区块数
+    block_hash: str                             # 第 height - 1 个区块的哈希，加载时用来确认区块存储和快照对应
+    utxo_set: UTXOSet
+    headers: List[BlockHeader]
+    tx_index: Dict[str, Tuple[int, int]]
+
+    @staticmethod
+    def capture(chain: BlockChain) -> 'ChainState':
+        """
+        在锁内调用：只浅拷贝区块链状态（UTXO 字典、区块头或区块列表、交易索引），
+        不编码，之后在锁外调用 ChainState.encode
+        """
+        height = chain.height
+        headers = getattr(chain.blocks, 'headers', None)   # LazyBlockList 常驻的区块头
+        if headers is None:
+            sources = chain.blocks[:height]
+        elif len(headers) >= height:
+            sources = headers[:height]
+        else:
+            sources = [chain.header(h) for h in range(height)]
+        return ChainState(height, chain.current_hash or "", chain.utxo_set.copy_outputs(), sources,
+                          dict(chain.tx_index))
+
+    @staticmethod
+    def encode_chain(chain: BlockChain) -> bytes:
+        """
+        把区块链当前的状态编码成快照文件内容
+
+        调用方需要保证编码期间区块链不被修改；持有锁时改用 capture，在锁外编码
+        """
+        return ChainSnapshot.capture(chain).encode()
+
+    @staticmethod
+    def decode(data: bytes) -> 'ChainSnapshot':
+        magic, crc = SNAPSHOT_HEADER.unpack_from(data)
+        payload = data[SNAPSHOT_HEADER.size:]
+        if magic != SNAPSHOT_MAGIC or zlib.crc32(payload) != crc:
+            raise ValueError("corrupted snapshot")
+        return ChainSnapshot(*decode_chain_state(payload))
+
+
+@dataclass
+class ChainState:
+    """ChainSnapshot.capture 取得的区块链状态，与区块链之后的修改无关，可以在锁外编码"""
+    height: int
+    block_hash: str
+    outputs: Dict[OutPoint, Output]
+    sources: List[Union[Block, BlockHeader]]     # 每个高度的区块头，或者还没有生成区块头的区块
+    tx_index: Dict[str, Tuple[int, int]]
+
+    def encode(self) -> bytes:
+        headers = [s if isinstance(s, BlockHeader) else s.header() for s in self.sources]
+        payload = encode_chain_state(self.height, self.block_hash, self.outputs.items(), headers, self.tx_index)
+        return SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, zlib.crc32(payload)) + payload
+
+
+def snapshot_path(directory: str) -> str:
+    return os.path.join(directory, SNAPSHOT_FILE)
+
+
+def write_snapshot(path: str, data: bytes) -> None:
+    """
+    原子地写入快照：先写临时文件并 fsync，再 os.replace 覆盖旧快照
+    任何时刻崩溃，磁盘上要么是完整的旧快照，要么是完整的新快照
+    """
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    # rename 本身也要落盘
+    dir_fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
+def read_snapshot(path: str) -> Optional[ChainSnapshot]:
+    """读取快照，不存在或已损坏时返回 None"""
+    try:
+        with open(path, 'rb') as f:
+            return ChainSnapshot.decode(f.read())
+    except (OSError, ValueError, struct.error) as e:
+        if os.path.exists(path):
+            print(f"ignore snapshot {path}: {e}")
+        return None
+
+
+def verify_snapshot(snapshot: ChainSnapshot, blocks) -> Dict[str, object]:
+    """
+    从头重放前 snapshot.height 个区块，与快照逐项比较
+
+    :param blocks: 可按高度顺序遍历的区块，例如 BlockStore 或 BlockChain.blocks
+    :return: 比较结果，ok 为 True 表示快照与完整重放一致
+    """
+    utxo_set = UTXOSet()
+    tx_index = {}
+    hashes = []
+    for h, block in zip(range(snapshot.height), blocks):
+        utxo_set.apply_block(block)
+        for i, tx in enumerate(block.Transactions):
+            tx_index[tx.Hash] = (h, i)
+        hashes.append(block.Hash)
+    expected = dict(utxo_set.items())
+    actual = dict(snapshot.utxo_set.items())
+    mismatched = sum(1 for k, v in actual.items() if k in expected and expected[k] != v)
+    result = {
+        'height': snapshot.height,
+        'block_hash': len(hashes) == snapshot.height and snapshot.block_hash == (hashes[-1] if hashes else ""),
+        'utxo_missing': len(expected.keys() - actual.keys()),
+        'utxo_extra': len(actual.keys() - expected.keys()),
+        'utxo_mismatched': mismatched,
+        'headers': [h.Hash for h in snapshot.headers] == hashes,
+        'tx_index': snapshot.tx_index == tx_index,
+    }
+    result['ok'] = (result['block_hash'] and result['headers'] and result['tx_index']
+                    and not (result['utxo_missing'] or result['utxo_extra'] or mismatched))
+    return result
+
+
+if __name__ == '__main__':
+    # 校验工具：python snapshot.py ./data/127.0.0.1_8333
+    from storage import BlockStore
+    if len(sys.argv) != 2:
+        print("usage: python snapshot.py <store_dir>")
+        sys.exit(1)
+    snapshot = read_snapshot(snapshot_path(sys.argv[1]))
+    if snapshot is None:
+        print("no snapshot")
+        sys.exit(1)
+    store = BlockStore(sys.argv[1])
+    result = verify_snapshot(snapshot, store)
+    store.close()
+    print(result)
+    sys.exit(0 if result['ok'] else 1)
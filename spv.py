@@ -0,0 +1,269 @@
+import hashlib
+import math
+import os
+import struct
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from block import BlockHeader, Output, Transaction, verify_merkle_proof
+from codec import BINARY_CONTENT_TYPE, decode_headers
+from peer import PeerClient
+from utxo import OutPoint
+from wallet import Wallet
+
+# 与比特币 BIP37 相同的上限，防止节点为一个过大的过滤器付出过多的计算
+MAX_FILTER_BYTES = 36000
+MAX_HASH_FUNCS = 50
+_HASH_PAIR = struct.Struct('<QQ')
+
+
+class BloomFilter:
+    """
+    布隆过滤器：轻钱包把自己的公钥放进去交给全节点，全节点只返回可能与之相关的交易
+
+    不会漏掉加入过的元素，但有 fp_rate 的概率误报；误报的交易正好让节点无法确切知道钱包有哪些公钥。
+    k 个位置由 sha256(tweak + 元素) 的两个 64 位整数做双重哈希得到
+    """
+
+    def __init__(self, n_bits: int, n_hashes: int, tweak: int = 0, bits: bytes = None):
+        """
+        :param n_bits: 位数组的长度
+        :param n_hashes: 每个元素设置的位数
+        :param tweak: 哈希的随机盐，不同钱包的过滤器互不相关
+        :param bits: 已有的位数组（反序列化时使用）
+        """
+        if n_bits <= 0 or n_bits > MAX_FILTER_BYTES * 8 or not 0 < n_hashes <= MAX_HASH_FUNCS:
+            raise ValueError("invalid bloom filter size")
+        self.n_bits = n_bits
+        self.n_hashes = n_hashes
+        self.tweak = tweak
+        self._tweak = struct.pack('<Q', tweak)
+        self.bits = bytearray(bits) if bits is not None else bytearray((n_bits + 7) // 8)
+        if len(self.bits) != (n_bits + 7) // 8:
+            raise ValueError("bloom filter bits length mismatch")
+
+    @staticmethod
+    def for_elements(count: int, fp_rate: float = 0.0001, tweak: int = None) -> 'BloomFilter':
+        """按元素个数和误报率选择最优的位数和哈希次数"""
+        count = max(count, 1)
+        n_bits = int(-count * math.log(fp_rate) / math.log(2) ** 2)
+        n_bits = min(max(n_bits, 8), MAX_FILTER_BYTES * 8)
+        n_hashes = min(max(int(n_bits / count * math.log(2)), 1), MAX_HASH_FUNCS)
+        if tweak is None:
+            tweak = int.from_bytes(os.urandom(8), 'little')
+        return BloomFilter(n_bits, n_hashes, tweak)
+
+    def _positions(self, item: bytes) -> Iterator[int]:
+        h1, h2 = _HASH_PAIR.unpack_from(hashlib.sha256(self._tweak + item).digest())
+        for i in range(self.n_hashes):
+            yield (h1 + i * h2) % self.n_bits
+
+    def add(self, item: bytes) -> None:
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item: bytes) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+    def to_dict(self) -> Dict:
+        return {"n_bits": self.n_bits, "n_hashes": self.n_hashes, "tweak": self.tweak, "bits": self.bits.hex()}
+
+    @staticmethod
+    def from_dict(f: Dict) -> 'BloomFilter':
+        return BloomFilter(int(f['n_bits']), int(f['n_hashes']), int(f['tweak']), bytes.fromhex(f['bits']))
+
+
+def _raw(value) -> bytes:
+    # Input/Output 内部保存的公钥是原始字节，不是规范 hex 时为原字符串
+    return value if isinstance(value, bytes) else value.encode()
+
+
+def filter_matches(bloom: BloomFilter, tx: Transaction) -> bool:
+    """交易的某个输出付给了过滤器中的公钥，或某个输入由过滤器中的公钥花费"""
+    for output_obj in tx.Vout:
+        if _raw(output_obj._pubkey) in bloom:
+            return True
+    for input_obj in tx.Vin:
+        if _raw(input_obj._pubkey) in bloom:
+            return True
+    return False
+
+
+class SPVWallet:
+    """
+    只同步区块头的轻钱包（简单支付验证）
+
+    1. 从全节点同步区块头，检查前后链接、高度和工作量证明，不下载区块体
+    2. 把自己全部公钥做成布隆过滤器注册到节点（/filterload）
+    3. 从节点取得与过滤器匹配的交易和它们的 merkle 证明（/filtered_blocks），
+       用区块头中的 merkle 根校验，再在本地维护自己的未花费输出和余额
+
+    除区块头外，带宽和内存只与钱包自己的交易数有关，与区块链的大小无关
+    """
+
+    def __init__(self, wallets: List[Wallet], node_address: str, genesis_hash: str = None,
+                 fp_rate: float = 0.0001, peers: PeerClient = None):
+        """
+        :param wallets: 钱包拥有的密钥
+        :param node_address: 全节点 ip:port
+        :param genesis_hash: 创世区块哈希，给出时节点返回的第一个区块头必须与之一致
+        :param fp_rate: 布隆过滤器的误报率，越高隐私越好，带宽越大
+        :param peers: 发送请求用的 PeerClient
+        """
+        self.wallets = wallets
+        self.node_address = node_address
+        self.genesis_hash = genesis_hash
+        self.peers = peers or PeerClient()
+        self._pubkeys = {bytes.fromhex(w.pub_key) for w in wallets}
+        self.bloom = BloomFilter.for_elements(len(self._pubkeys), fp_rate)
+        for pubkey in self._pubkeys:
+            self.bloom.add(pubkey)
+        self.filter_id: Optional[str] = None
+        self.headers: List[BlockHeader] = []
+        self.synced_height = 0                                        # 已经取过过滤交易的区块数
+        self.transactions: Dict[str, Tuple[int, Transaction]] = {}    # 与钱包相关的交易 -> (高度, 交易)
+        self.utxos: Dict[OutPoint, Output] = {}
+        self.stats: Dict[str, int] = {"header_bytes": 0, "tx_bytes": 0, "matched": 0, "false_positives": 0}
+
+    def _get(self, path: str, **kwargs):
+        result = self.peers.request(self.node_address, 'GET', path, **kwargs)
+        if result.status is None:
+            raise IOError(f"{self.node_address} {path}: {result.error}")
+        return result
+
+    def get_locator(self) -> List[str]:
+        """与 BlockChain.get_locator 相同：最近 10 个逐个取，之后步长翻倍，最后是创世区块"""
+        locator = []
+        height = len(self.headers) - 1
+        step = 1
+        while height > 0:
+            locator.append(self.headers[height].Hash)
+            if len(locator) >= 10:
+                step *= 2
+            height -= step
+        if self.headers:
+            locator.append(self.headers[0].Hash)
+        return locator
+
+    def _rollback(self, height: int) -> None:
+        """节点的链在 height 处分叉：丢弃之后的区块头和其中的交易，重新计算未花费输出"""
+        del self.headers[height:]
+        self.synced_height = min(self.synced_height, height)
+        self.transactions = {txid: item for txid, item in self.transactions.items() if item[0] < height}
+        self.utxos = {}
+        for _, tx in sorted(self.transactions.values(), key=lambda item: item[0]):
+            self._apply(tx)
+
+    def sync_headers(self) -> int:
+        """
+        从节点同步区块头，节点的链发生重组时回滚到分叉点
+
+        :return: 新加入的区块头数
+        """
+        added = 0
+        while True:
+            result = self._get(f"/headers?locator={','.join(self.get_locator())}",
+                               headers={'Accept': BINARY_CONTENT_TYPE})
+            if result.status != 200:
+                raise IOError(f"{self.node_address} /headers {result.status}")
+            self.stats["header_bytes"] += len(result.response.content)
+            page = decode_headers(result.response.content)
+            if not page:
+                return added
+            start = page[0].Height
+            if start > len(self.headers):
+                raise ValueError("headers do not connect")
+            if start < len(self.headers):
+                self._rollback(start)
+            prev_hash = self.headers[-1].Hash if self.headers else None
+            for header in page:
+                if header.Height != len(self.headers):
+                    raise ValueError(f"unexpected header height {header.Height}")
+                if prev_hash is None:
+                    # 创世区块是检查点，不检查工作量证明
+                    if self.genesis_hash is not None and header.Hash != self.genesis_hash:
+                        raise ValueError("genesis block mismatch")
+                elif header.PrevBlockHash != prev_hash or not header.check_pow():
+                    raise ValueError(f"invalid header at height {header.Height}")
+                self.headers.append(header)
+                prev_hash = header.Hash
+                added += 1
+            if len(self.headers) >= int(result.response.headers.get('X-Tip-Height', 0)):
+                return added
+
+    def load_filter(self) -> str:
+        """把布隆过滤器注册到节点，返回过滤器编号"""
+        result = self.peers.request(self.node_address, 'POST', '/filterload', json={"filter": self.bloom.to_dict()})
+        if result.status != 200:
+            raise IOError(f"{self.node_address} /filterload {result.status} {result.error}")
+        self.filter_id = result.response.json()["filter_id"]
+        return self.filter_id
+
+    def _apply(self, tx: Transaction) -> None:
+        for input_obj in tx.Vin:
+            self.utxos.pop((input_obj.txid, input_obj.vout), None)
+        for vout, output_obj in enumerate(tx.Vout):
+            if _raw(output_obj._pubkey) in self._pubkeys:
+                self.utxos[(tx.Hash, vout)] = output_obj
+
+    def _is_mine(self, tx: Transaction) -> bool:
+        return any(_raw(o._pubkey) in self._pubkeys for o in tx.Vout) \
+            or any(_raw(i._pubkey) in self._pubkeys for i in tx.Vin)
+
+    def sync_transactions(self) -> int:
+        """
+        取得已同步区块头范围内与过滤器匹配的交易，逐笔校验 merkle 证明
+
+        :return: 新发现的属于本钱包的交易数
+        """
+        if self.filter_id is None:
+            self.load_filter()
+        found = 0
+        reloaded = False
+        while self.synced_height < len(self.headers):
+            result = self._get(f"/filtered_blocks?filter={self.filter_id}&height={self.synced_height}")
+            if result.status == 404 and not reloaded:
+                # 节点重启或淘汰了过滤器，重新注册一次
+                self.load_filter()
+                reloaded = True
+                continue
+            if result.status != 200:
+                raise IOError(f"{self.node_address} /filtered_blocks {result.status}")
+            self.stats["tx_bytes"] += len(result.response.content)
+            data = result.response.json()
+            for item in data["blocks"]:
+                height = item["height"]
+                header = self.headers[height] if height < len(self.headers) else None
+                if header is None or header.Hash != item["hash"]:
+                    # 节点的链在区块头同步之后变了，下次 sync 时先同步区块头
+                    return found
+                for entry in item["transactions"]:
+                    tx = Transaction.from_dict(entry["transaction"])
+                    # 创世区块是检查点，其中交易的 Hash 可以不是内容的哈希（data/bb.json 中为空），只校验 merkle 证明
+                    if height > 0 and tx.hash() != tx.Hash \
+                            or not verify_merkle_proof(header.MerkleRoot, tx.Hash, entry["proof"]):
+                        raise ValueError(f"invalid merkle proof for {tx.Hash} at height {height}")
+                    if not self._is_mine(tx):
+                        self.stats["false_positives"] += 1
+                        continue
+                    self.stats["matched"] += 1
+                    if tx.Hash not in self.transactions:
+                        self.transactions[tx.Hash] = (height, tx)
+                        self._apply(tx)
+                        found += 1
+            next_height = min(int(data["next_height"]), len(self.headers))
+            if next_height <= self.synced_height:
+                break
+            self.synced_height = next_height
+        return found
+
+    def sync(self) -> int:
+        """先同步区块头，再取过滤后的交易，返回新发现的交易数"""
+        self.sync_headers()
+        return self.sync_transactions()
+
+    def balance(self) -> float:
+        return sum(output.value for output in self.utxos.values())
+
+    @property
+    def height(self) -> int:
+        return len(self.headers)
@@ -0,0 +1,318 @@
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+import zlib
+from typing import Dict, Iterator, List, Tuple
+
+from block import Block, BlockChain, BlockHeader
+from codec import decode_block, encode_block
+from verifier import LRUCache
+
+# 段文件中每条记录的头部：payload 长度 + crc32
+RECORD_HEADER = struct.Struct('<II')
+# 索引文件中每个高度一条定长记录：段号 + 段内偏移 + 记录长度
+INDEX_ENTRY = struct.Struct('<IQI')
+
+
+class BlockStore:
+    """
+    追加写的区块存储
+
+    目录结构：
+        blk00000.dat, blk00001.dat ...  分段的区块日志，每条记录为 [长度][crc32][区块的二进制编码]
+        index.dat                       高度 -> (段号, 偏移, 长度) 的定长索引
+
+    每添加一个区块只追加写这一个区块，fsync 按 sync_every 个区块或 sync_interval 秒批量进行。
+    先写区块记录再写索引，打开时会校验索引末尾指向的记录，丢弃崩溃时写了一半的数据，
+    并把已经完整写入但还没来得及写索引的记录补进索引
+    """
+
+    def __init__(self, path: str, segment_size: int = 16 * 1024 * 1024,
+                 sync_every: int = 16, sync_interval: float = 1.0):
+        """
+        :param path: 存储目录
+        :param segment_size: 单个段文件的大小上限（字节），超过后新开一个段
+        :param sync_every: 每追加多少个区块 fsync 一次
+        :param sync_interval: 距离上次 fsync 超过多少秒时也会 fsync
+        """
+        self.path = path
+        self.segment_size = segment_size
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self._lock = threading.Lock()
+        self._index: List[Tuple[int, int, int]] = []
+        self._maps: Dict[int, mmap.mmap] = {}    # 段号 -> 只读内存映射，读区块时不再打开文件
+        self._unsynced = 0
+        self._last_sync = time.time()
+        os.makedirs(path, exist_ok=True)
+        self._recover()
+        self._index_file = open(self._index_path(), 'ab')
+        self._segment_no = self._index[-1][0] if self._index else 0
+        self._segment_file = open(self._segment_path(self._segment_no), 'ab')
+
+    def _index_path(self) -> str:
+        return os.path.join(self.path, 'index.dat')
+
+    def _segment_path(self, segment_no: int) -> str:
+        return os.path.join(self.path, f'blk{segment_no:05d}.dat')
+
+    @staticmethod
+    def _encode(block: Block) -> bytes:
+        return encode_block(block)
+
+    @staticmethod
+    def _decode(payload: bytes) -> Block:
+        return decode_block(payload)
+
+    def _read_record(self, f, offset: int) -> bytes:
+        """读取并校验一条记录，不完整或校验失败时返回 None"""
+        f.seek(offset)
+        header = f.read(RECORD_HEADER.size)
+        if len(header) < RECORD_HEADER.size:
+            return None
+        length, crc = RECORD_HEADER.unpack(header)
+        payload = f.read(length)
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            return None
+        return payload
+
+    def _recover(self) -> None:
+        """加载索引并修复崩溃留下的不完整尾部"""
+        entries = []
+        if os.path.exists(self._index_path()):
+            with open(self._index_path(), 'rb') as f:
+                data = f.read()
+            usable = len(data) - len(data) % INDEX_ENTRY.size
+            entries = [INDEX_ENTRY.unpack_from(data, i) for i in range(0, usable, INDEX_ENTRY.size)]
+        # 从后往前丢弃指向无效记录的索引
+        while entries:
+            segment_no, offset, length = entries[-1]
+            path = self._segment_path(segment_no)
+            if os.path.exists(path):
+                with open(path, 'rb') as f:
+                    payload = self._read_record(f, offset)
+                if payload is not None and RECORD_HEADER.size + len(payload) == length:
+                    break
+            entries.pop()
+        segment_no, end = 0, 0
+        if entries:
+            segment_no, offset, length = entries[-1]
+            end = offset + length
+        # 同一段中索引之后完整的记录补进索引，剩下不完整的部分截断
+        path = self._segment_path(segment_no)
+        if os.path.exists(path):
+            with open(path, 'r+b') as f:
+                while True:
+                    payload = self._read_record(f, end)
+                    if payload is None:
+                        break
+                    length = RECORD_HEADER.size + len(payload)
+                    entries.append((segment_no, end, length))
+                    end += length
+                f.truncate(end)
+        # 之后的段都没有被索引，直接删除
+        later = segment_no + 1
+        while os.path.exists(self._segment_path(later)):
+            os.remove(self._segment_path(later))
+            later += 1
+        with open(self._index_path(), 'wb') as f:
+            for entry in entries:
+                f.write(INDEX_ENTRY.pack(*entry))
+            f.flush()
+            os.fsync(f.fileno())
+        self._index = entries
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def append(self, block: Block) -> None:
+        """追加一个区块，其高度就是当前的 len(self)"""
+        payload = self._encode(block)
+        record = RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+        with self._lock:
+            offset = self._segment_file.tell()
+            if offset > 0 and offset + len(record) > self.segment_size:
+                self._sync()
+                self._segment_file.close()
+                self._segment_no += 1
+                self._segment_file = open(self._segment_path(self._segment_no), 'ab')
+                offset = 0
+            self._segment_file.write(record)
+            entry = (self._segment_no, offset, len(record))
+            self._index_file.write(INDEX_ENTRY.pack(*entry))
+            self._index.append(entry)
+            # 每次都写到操作系统，进程崩溃不会丢数据；fsync 则批量进行
+            self._segment_file.flush()
+            self._index_file.flush()
+            self._unsynced += 1
+            if self._unsynced >= self.sync_every or time.time() - self._last_sync >= self.sync_interval:
+                self._sync()
+
+    def _sync(self) -> None:
+        # 先落盘区块，再落盘索引
+        self._segment_file.flush()
+        os.fsync(self._segment_file.fileno())
+        self._index_file.flush()
+        os.fsync(self._index_file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.time()
+
+    def flush(self) -> None:
+        with self._lock:
+            self._sync()
+
+    def truncate(self, height: int) -> None:
+        """删除高度 >= height 的区块（链重组回滚时使用），之后从 height 继续追加"""
+        with self._lock:
+            if height >= len(self._index):
+                return
+            self._sync()
+            segment_no, offset, _ = self._index[height]
+            del self._index[height:]
+            # 被截断的段不能再通过旧的映射读取
+            for mapped_no in [n for n in self._maps if n >= segment_no]:
+                self._maps.pop(mapped_no).close()
+            self._segment_file.close()
+            later = segment_no + 1
+            while os.path.exists(self._segment_path(later)):
+                os.remove(self._segment_path(later))
+                later += 1
+            # 先截断再以追加方式打开，tell() 才是新的文件末尾
+            os.truncate(self._segment_path(segment_no), offset)
+            self._segment_file = open(self._segment_path(segment_no), 'ab')
+            self._segment_no = segment_no
+            self._index_file.truncate(height * INDEX_ENTRY.size)
+            self._sync()
+
+    def read_payload(self, height: int) -> bytes:
+        """通过内存映射读取一条记录的区块编码，段文件变长后重新映射"""
+        with self._lock:
+            segment_no, offset, length = self._index[height]
+            end = offset + length
+            mapped = self._maps.get(segment_no)
+            if mapped is None or len(mapped) < end:
+                if mapped is not None:
+                    mapped.close()
+                with open(self._segment_path(segment_no), 'rb') as f:
+                    mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self._maps[segment_no] = mapped
+            return mapped[offset + RECORD_HEADER.size:end]
+
+    def read(self, height: int) -> Block:
+        return self._decode(self.read_payload(height))
+
+    def __iter__(self) -> Iterator[Block]:
+        for height in range(len(self)):
+            yield self.read(height)
+
+    def load_blockchain(self, lazy: bool = False, cache_size: int = 256, snapshot=None) -> BlockChain:
+        """
+        :param lazy: 为 True 时区块体按需从存储解码，内存中只常驻区块头和索引
+        :param cache_size: lazy 时缓存的已解码区块数
+        :param snapshot: snapshot.ChainSnapshot，与存储中的区块一致时只重放快照之后的区块
+        """
+        blocks = LazyBlockList(self, cache_size) if lazy else list(self)
+        if snapshot is not None and self._matches(snapshot):
+            if lazy:
+                blocks.headers = list(snapshot.headers)
+            return BlockChain.from_snapshot(blocks, snapshot)
+        current_hash = blocks[-1].Hash if len(blocks) else None
+        return BlockChain(blocks, current_hash, len(blocks))
+
+    def _matches(self, snapshot) -> bool:
+        """快照中的区块都在存储中，且最后一个区块的哈希相同"""
+        if snapshot.height == 0 or snapshot.height > len(self) or len(snapshot.headers) != snapshot.height:
+            return False
+        return self.read(snapshot.height - 1).Hash == snapshot.block_hash
+
+    def export_json(self, file_path: str) -> None:
+        """导出为与 BlockChain.save_blockchain 相同的完整 JSON 文件"""
+        self.load_blockchain().save_blockchain(file_path)
+
+    def close(self) -> None:
+        with self._lock:
+            self._sync()
+            self._segment_file.close()
+            self._index_file.close()
+            for mapped in self._maps.values():
+                mapped.close()
+            self._maps.clear()
+
+
+class LazyBlockList:
+    """
+    BlockChain.blocks 的按需加载版本
+
+    区块体留在存储的内存映射中，访问时才解码，最近访问的区块放在有界的 LRU 缓存里；
+    常驻内存的只有区块头。append/pop 直接写入/截断存储，MinerNode._save 就不会再重复写
+    """
+
+    def __init__(self, store: BlockStore, cache_size: int = 256):
+        """
+        :param store: 区块存储
+        :param cache_size: 缓存的已解码区块数
+        """
+        self.store = store
+        self.headers: List[BlockHeader] = []
+        self.cache = LRUCache(cache_size)
+
+    def __len__(self) -> int:
+        return len(self.store)
+
+    def _get(self, height: int) -> Block:
+        block = self.cache.get(height)
+        if block is None:
+            block = self.store.read(height)
+            self.cache.put(height, block)
+        return block
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._get(h) for h in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return self._get(index)
+
+    def __iter__(self) -> Iterator[Block]:
+        """顺序解码全部区块，不进入缓存，第一次遍历时顺便补齐常驻的区块头"""
+        for height in range(len(self)):
+            block = self.store.read(height)
+            if height == len(self.headers):
+                self.headers.append(block.header())
+            yield block
+
+    def header(self, height: int) -> BlockHeader:
+        while len(self.headers) <= height:
+            self.headers.append(self[len(self.headers)].header())
+        return self.headers[height]
+
+    def pop(self) -> Block:
+        """删除并返回最后一个区块，存储同时截断"""
+        height = len(self) - 1
+        block = self[height]
+        self.store.truncate(height)
+        self.cache.pop(height)
+        del self.headers[height:]
+        return block
+
+    def append(self, block: Block) -> None:
+        self.store.append(block)
+        if len(self.headers) == len(self) - 1:
+            self.headers.append(block.header())
+        self.cache.put(len(self) - 1, block)
+
+
+if __name__ == '__main__':
+    # 导出工具：python storage.py ./data/127.0.0.1_8333 ./data/export.json
+    if len(sys.argv) != 3:
+        print("usage: python storage.py <store_dir> <output.json>")
+        sys.exit(1)
+    store = BlockStore(sys.argv[1])
+    store.export_json(sys.argv[2])
+    store.close()
+    print(f"exported {len(store)} blocks to {sys.argv[2]}")
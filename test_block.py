@@ -0,0 +1,119 @@
+import pytest
+
+from block import Block, BlockChain, ChainUpdate, Output, Transaction, verify_merkle_proof
+from utxo import UTXOSet
+
+
+def _branch(chain, parent, tx, count, amount):
+    """从 parent 之后挖 count 个区块，第一个区块花费 tx 的输出 0，之后依次花费找零"""
+    blocks = [parent]
+    for _ in range(count):
+        tx = chain.spend(tx, vout=1 if len(blocks) > 1 else 0, amount=amount)
+        blocks.append(chain.mine([tx], blocks[-1].Hash, blocks[-1].Height + 1))
+    return blocks[1:]
+
+
+@pytest.fixture
+def forked(chain):
+    """创世区块之后的两条分支：主链 a 有 2 个区块，b 有 3 个区块"""
+    genesis = chain.genesis()
+    coinbase = genesis.Transactions[0]
+    return genesis, _branch(chain, genesis, coinbase, 2, 1), _branch(chain, genesis, coinbase, 3, 2)
+
+
+def _assert_utxo_matches(blockchain):
+    expected = UTXOSet.from_blocks(list(blockchain.blocks))
+    assert dict(blockchain.utxo_set.items()) == dict(expected.items())
+
+
+def test_heavier_branch_reorgs_with_undo(forked):
+    genesis, a, b = forked
+    blockchain = BlockChain([genesis], genesis.Hash, 1)
+    for block in a:
+        assert blockchain.accept_block(block).connected == [block]
+    # 工作量相同时保留先收到的链
+    for block in b[:2]:
+        assert blockchain.accept_block(block).connected == []
+    assert blockchain.current_hash == a[-1].Hash
+
+    update = blockchain.accept_block(b[2])
+    assert update.connected == b and update.disconnected == a[::-1] and update.fork_height == 1
+    assert (blockchain.height, blockchain.current_hash) == (4, b[-1].Hash)
+    _assert_utxo_matches(blockchain)
+    assert blockchain.get_transaction(a[0].Transactions[0].Hash) is None
+    # 回滚出主链的区块留在侧链，仍然可以按哈希查到
+    assert set(blockchain.side_blocks) == {block.Hash for block in a}
+    assert blockchain.get_block(a[0].Hash) is a[0]
+
+
+@pytest.mark.parametrize("drop_undo", [False, True])
+def test_reorg_back_restores_spent_outputs(chain, forked, drop_undo):
+    genesis, a, b = forked
+    blockchain = BlockChain([genesis], genesis.Hash, 1)
+    for block in a + b:
+        blockchain.accept_block(block)
+    tx = a[-1].Transactions[0]
+    for _ in range(2):
+        tx = chain.spend(tx, vout=1, amount=1)
+        a.append(chain.mine([tx], a[-1].Hash, a[-1].Height + 1))
+    assert blockchain.accept_block(a[2]).connected == []
+    if drop_undo:
+        # 相当于重组深度超过 MAX_REORG_DEPTH：没有回滚记录，从头重放 UTXO
+        blockchain.undo.clear()
+    update = blockchain.accept_block(a[3])
+    assert update.connected == a and update.disconnected == b[::-1]
+    assert blockchain.current_hash == a[-1].Hash
+    _assert_utxo_matches(blockchain)
+
+
+def test_invalid_block_aborts_reorg(forked):
+    genesis, a, b = forked
+    blockchain = BlockChain([genesis], genesis.Hash, 1)
+    for block in a + b[:2]:
+        blockchain.accept_block(block)
+    before = dict(blockchain.utxo_set.items())
+
+    def check(block, _):
+        if block is b[1]:
+            raise ValueError("bad block")
+
+    with pytest.raises(ValueError):
+        blockchain.accept_block(b[2], check)
+    assert (blockchain.height, blockchain.current_hash) == (3, a[-1].Hash)
+    assert dict(blockchain.utxo_set.items()) == before
+    assert blockchain.block_index[a[0].Hash] == 1
+    # 无效区块及其后代被丢弃，有效的分支区块保留在侧链
+    assert set(blockchain.side_blocks) == {b[0].Hash}
+
+
+def test_orphan_and_duplicate_blocks(chain, forked):
+    genesis, a, _ = forked
+    blockchain = BlockChain([genesis], genesis.Hash, 1)
+    update = blockchain.accept_block(a[1])
+    assert update.orphan and not blockchain.side_blocks
+    assert blockchain.accept_block(a[0]).connected == [a[0]]
+    for block in (genesis, a[0]):
+        assert blockchain.accept_block(block) == ChainUpdate()
+    assert blockchain.height == 2
+
+
+@pytest.mark.parametrize("count", [1, 2, 5, 8])
+def test_merkle_proof_verifies_every_transaction(chain, count):
+    funding = Transaction(Hash="", Vin=[], Vout=[Output(100, chain.wallet.pub_key) for _ in range(count)])
+    funding._set_hash()
+    block = Block.new_block([chain.spend(funding, vout=i) for i in range(count)], "00" * 32, 1, 1)
+    for tx in block.Transactions:
+        proof = block.merkle_proof(tx.Hash)
+        assert len(proof) <= count.bit_length()
+        assert verify_merkle_proof(block.merkle_root, tx.Hash, proof)
+    assert block.merkle_proof("ab" * 32) is None
+
+
+def test_tampered_merkle_proof_fails(chain):
+    genesis = chain.genesis()
+    txs = chain.chain_of_spends(genesis.Transactions[0], 3)
+    block = Block.new_block(txs, genesis.Hash, 1, 1)
+    proof = block.merkle_proof(txs[2].Hash)
+    assert not verify_merkle_proof(block.merkle_root, txs[1].Hash, proof)
+    assert not verify_merkle_proof(block.merkle_root, txs[2].Hash, [(h, 'R' if side == 'L' else 'L') for h, side in proof])
+    assert not verify_merkle_proof(block.merkle_root, txs[2].Hash, [("zz", proof[0][1])] + proof[1:])
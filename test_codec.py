@@ -0,0 +1,99 @@
+import io
+
+import pytest
+
+from block import Input, Output, Transaction
+from codec import decode_block, decode_chain_state, decode_headers, decode_inventory, decode_transaction, \
+    encode_block, encode_block_frame, encode_chain_state, encode_headers, encode_inventory, encode_transaction, \
+    read_block_frames
+from utxo import UTXOSet
+
+
+def _mixed_case_transaction() -> Transaction:
+    tx = Transaction(Hash="", Vin=[Input("AB" * 32, 0, "Cd" * 64, "eF" * 64)], Vout=[Output(10, "0A" * 64)])
+    tx.Hash = tx.hash()
+    return tx
+
+
+def test_txid_ignores_hex_case():
+    tx = _mixed_case_transaction()
+    lower = Transaction(Hash="", Vin=[Input("ab" * 32, 0, "cd" * 64, "ef" * 64)], Vout=[Output(10, "0a" * 64)])
+    assert lower.hash() == tx.hash()
+
+
+def test_txid_follows_any_change_to_the_transaction(chain):
+    tx = _mixed_case_transaction()
+    seen = {tx.hash()}
+    changes = [
+        lambda: setattr(tx.Vout[0], 'value', 10.0),     # 同值的浮点数序列化不同
+        lambda: setattr(tx.Vout[0], 'value', 11),
+        lambda: setattr(tx.Vin[0], 'signature', "00" * 64),
+        lambda: setattr(tx.Vin[0], 'vout', 1),
+        lambda: tx.Vout.append(Output(1, chain.wallet.pub_key)),
+        lambda: setattr(tx, 'Vin', []),
+    ]
+    for change in changes:
+        change()
+        assert tx.hash() == Transaction(Hash="", Vin=list(tx.Vin), Vout=list(tx.Vout)).hash()
+        assert tx.hash() not in seen
+        seen.add(tx.hash())
+
+
+def test_mixed_case_transaction_codec_round_trip_keeps_txid():
+    tx = _mixed_case_transaction()
+    decoded = decode_transaction(encode_transaction(tx))
+    assert decoded.Vin[0].signature == "cd" * 64
+    assert decoded.hash() == tx.hash() == decoded.Hash
+
+
+def _blocks(chain):
+    genesis = chain.genesis()
+    tx = chain.spend(genesis.Transactions[0], amount=3)
+    tx.Vout[0].value = 2.5   # 浮点金额编解码后仍是浮点数
+    tx._set_hash()
+    return [genesis, chain.mine([tx], genesis.Hash, 1)]
+
+
+def test_block_round_trip_keeps_hashes_and_dict(chain):
+    for block in _blocks(chain):
+        decoded = decode_block(encode_block(block))
+        assert decoded.to_dict() == block.to_dict()
+        assert decoded.compute_hash() == block.Hash
+        assert decoded.merkle_root == block.merkle_root
+        assert [tx.hash() for tx in decoded.Transactions] == [tx.Hash for tx in block.Transactions]
+    assert isinstance(decoded.Transactions[0].Vout[0].value, float)
+    assert isinstance(decoded.Transactions[0].Vout[1].value, int)
+
+
+def test_frames_headers_and_inventory_round_trip(chain):
+    blocks = _blocks(chain)
+    stream = io.BytesIO(b''.join(encode_block_frame(block) for block in blocks))
+    assert [block.Hash for block in read_block_frames(stream.read)] == [block.Hash for block in blocks]
+
+    headers = decode_headers(encode_headers([block.header() for block in blocks]))
+    assert [h.Hash for h in headers] == [block.Hash for block in blocks]
+    assert all(h.check_pow() for h in headers[1:])
+
+    decoded_blocks, transactions = decode_inventory(encode_inventory(blocks[1:], blocks[1].Transactions))
+    assert decoded_blocks[0].Hash == blocks[1].Hash
+    assert transactions[0].hash() == blocks[1].Transactions[0].Hash
+
+
+def test_chain_state_round_trip(chain):
+    blocks = _blocks(chain)
+    utxo_set = UTXOSet.from_blocks(blocks)
+    tx_index = {tx.Hash: (h, i) for h, block in enumerate(blocks) for i, tx in enumerate(block.Transactions)}
+    height, block_hash, decoded, headers, decoded_index = decode_chain_state(encode_chain_state(
+        2, blocks[1].Hash, utxo_set.items(), [block.header() for block in blocks], tx_index))
+    assert (height, block_hash, decoded_index) == (2, blocks[1].Hash, tx_index)
+    assert dict(decoded.items()) == dict(utxo_set.items())
+    assert decoded.index.balance(decoded.index.resolve(pubkey=chain.wallet.pub_key)) == 10 ** 9 - 0.5
+    assert [h.Hash for h in headers] == [block.Hash for block in blocks]
+
+
+def test_truncated_data_raises_value_error(chain):
+    data = encode_block(_blocks(chain)[1])
+    with pytest.raises(ValueError):
+        decode_block(data[:-5])
+    with pytest.raises(ValueError):
+        list(read_block_frames(io.BytesIO(encode_block_frame(_blocks(chain)[1])[:-1]).read))
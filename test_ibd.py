@@ -0,0 +1,56 @@
+import time
+
+import pytest
+
+from conftest import AppPeerClient
+from ibd import HeadersFirstSync
+
+HONEST = "127.0.0.1:18333"
+LIAR = "127.0.0.1:18335"
+
+
+def _extend(chain, node, count):
+    tx = node.blockchain.blocks[0].Transactions[0]
+    blocks = []
+    for _ in range(count):
+        tx = chain.spend(tx, vout=1 if tx.Vin else 0)
+        blocks.append(chain.mine([tx], node.blockchain.current_hash, node.blockchain.height))
+        assert node._accept_block(blocks[-1])[0] == 200
+    return blocks
+
+
+@pytest.fixture
+def network(chain, node, tmp_path):
+    """node 是诚实节点；liar 拥有同样的链，返回的区块由各个测试篡改；fetcher 只有创世区块"""
+    blocks = _extend(chain, node, 6)
+    genesis_file = str(tmp_path / 'genesis.json')
+    liar = type(node)(18335, genesis_file)
+    for block in blocks:
+        assert liar._accept_block(block)[0] == 200
+    fetcher = type(node)(18334, genesis_file)
+    fetcher.peers = AppPeerClient(node.app, {LIAR: liar.app})
+    fetcher.address_pool = {HONEST: time.time(), LIAR: time.time()}
+    fetcher.ibd = HeadersFirstSync(fetcher, range_size=2, max_failures=1)
+    return node, liar, fetcher, blocks
+
+
+def test_download_from_honest_peers(network):
+    node, liar, fetcher, blocks = network
+    assert fetcher.initial_block_download() == len(blocks)
+    assert fetcher.blockchain.current_hash == blocks[-1].Hash
+    assert sum(fetcher.ibd.stats["served"].values()) == 3
+
+
+@pytest.mark.parametrize("tamper", [
+    lambda hashes: hashes[::-1],                    # 顺序打乱
+    lambda hashes: hashes[:1] * len(hashes),        # 重复同一个区块
+])
+def test_blocks_out_of_place_are_rejected(network, monkeypatch, tamper):
+    node, liar, fetcher, blocks = network
+    block_hashes = liar.blockchain.block_hashes
+    monkeypatch.setattr(liar.blockchain, 'block_hashes', lambda start, end: tamper(block_hashes(start, end)))
+
+    # 每个区块单独看都与同高度的区块头一致，只有按位置比较才能发现
+    assert fetcher.initial_block_download() == len(blocks)
+    assert fetcher.blockchain.current_hash == blocks[-1].Hash
+    assert fetcher.ibd.stats["served"][LIAR] == 0
@@ -0,0 +1,71 @@
+import pytest
+from ecdsa import VerifyingKey, SECP256k1
+
+from keystore import ENCRYPTED_MAGIC, Keystore, get_signing_key
+
+
+@pytest.fixture(scope="module")
+def keystore():
+    return Keystore.generate(3, max_workers=1)
+
+
+def _private_keys(keystore):
+    return [wallet.private_key for wallet in keystore]
+
+
+def test_plain_keystore_round_trip(keystore, tmp_path):
+    path = str(tmp_path / "keys.bin")
+    keystore.save(path)
+    loaded = Keystore.load(path)
+    assert _private_keys(loaded) == _private_keys(keystore)
+    assert loaded[1].address == keystore[1].address
+
+
+def test_encrypted_keystore_round_trip(keystore, tmp_path):
+    path = str(tmp_path / "keys.bin")
+    keystore.save(path, "correct horse")
+    with open(path, 'rb') as f:
+        data = f.read()
+    assert data.startswith(ENCRYPTED_MAGIC)
+    assert not any(bytes.fromhex(key) in data for key in _private_keys(keystore))
+    assert _private_keys(Keystore.load(path, "correct horse")) == _private_keys(keystore)
+
+
+def test_encrypted_keystore_rejects_wrong_or_missing_passphrase(keystore, tmp_path):
+    path = str(tmp_path / "keys.bin")
+    keystore.save(path, "correct horse")
+    with pytest.raises(ValueError, match="wrong passphrase"):
+        Keystore.load(path, "battery staple")
+    with pytest.raises(ValueError, match="passphrase is required"):
+        Keystore.load(path)
+
+
+def test_encrypted_keystore_detects_tampering(keystore, tmp_path):
+    path = str(tmp_path / "keys.bin")
+    keystore.save(path, "correct horse")
+    with open(path, 'rb') as f:
+        data = bytearray(f.read())
+    data[-1] ^= 1
+    with open(path, 'wb') as f:
+        f.write(data)
+    with pytest.raises(ValueError):
+        Keystore.load(path, "correct horse")
+
+
+def test_truncated_keystore_is_rejected(keystore, tmp_path):
+    path = str(tmp_path / "keys.bin")
+    keystore.save(path)
+    with open(path, 'rb') as f:
+        data = f.read()
+    with open(path, 'wb') as f:
+        f.write(data[:-1])
+    with pytest.raises(ValueError, match="corrupted"):
+        Keystore.load(path)
+
+
+def test_signing_keys_are_cached(keystore):
+    wallet = keystore[0]
+    signing_key = get_signing_key(wallet.private_key)
+    assert get_signing_key(wallet.private_key) is signing_key
+    verifying_key = VerifyingKey.from_string(bytes.fromhex(wallet.pub_key), curve=SECP256k1)
+    assert verifying_key.verify(signing_key.sign(b"message"), b"message")
@@ -0,0 +1,98 @@
+import pytest
+
+from block import Block, Output, Transaction
+from mempool import Mempool, MempoolError, transaction_size
+from utxo import UTXOSet
+
+
+@pytest.fixture
+def funding(chain) -> Transaction:
+    """有 5 个输出的资金交易，每个输出可以被一笔互相独立的交易花费"""
+    tx = Transaction(Hash="", Vin=[], Vout=[Output(100, chain.wallet.pub_key) for _ in range(5)])
+    tx._set_hash()
+    return tx
+
+
+def test_select_orders_by_fee(chain, funding):
+    mempool = Mempool()
+    txs = {fee: chain.spend(funding, vout=i, fee=fee) for i, fee in enumerate((1, 5, 3))}
+    for fee, tx in txs.items():
+        mempool.add(tx, fee)
+    assert mempool.select() == (txs[5], txs[3], txs[1])
+    assert mempool.select(max_count=2) == (txs[5], txs[3])
+    assert len(mempool) == 3
+
+
+def test_child_is_selected_after_its_parent(chain, funding):
+    mempool = Mempool()
+    parent = chain.spend(funding, vout=0, fee=1)
+    child = chain.spend(parent, vout=1, fee=10)
+    other = chain.spend(funding, vout=1, fee=5)
+    mempool.add(parent, 1)
+    mempool.add(child, 10)
+    mempool.add(other, 5)
+    assert mempool.select() == (other, parent, child)
+    assert mempool.select(max_count=1) == (other,)
+    # 放不下子交易时只选到父交易
+    assert mempool.select(max_bytes=transaction_size(other) + transaction_size(parent)) == (other, parent)
+
+
+def test_duplicate_and_double_spend_are_rejected(chain, funding):
+    mempool = Mempool()
+    tx = chain.spend(funding, vout=0, fee=1)
+    mempool.add(tx, 1)
+    with pytest.raises(MempoolError):
+        mempool.add(tx, 1)
+    with pytest.raises(MempoolError):
+        mempool.add(chain.spend(funding, vout=0, fee=2), 2)
+
+
+def test_full_pool_evicts_lowest_fee_with_descendants(chain, funding):
+    mempool = Mempool(max_count=2)
+    parent = chain.spend(funding, vout=0, fee=1)
+    child = chain.spend(parent, vout=1, fee=5)
+    mempool.add(parent, 1)
+    mempool.add(child, 5)
+    other = chain.spend(funding, vout=1, fee=3)
+    mempool.add(other, 3)
+    assert list(mempool) == [other]
+    with pytest.raises(MempoolError):
+        Mempool(max_count=1, max_bytes=1).add(chain.spend(funding, vout=2), 0)
+
+
+def test_remove_for_block_drops_conflicts_and_their_children(chain, funding):
+    mempool = Mempool()
+    pooled = chain.spend(funding, vout=0, fee=1)
+    child = chain.spend(pooled, vout=1, fee=1)
+    kept = chain.spend(funding, vout=1, fee=1)
+    for tx in (pooled, child, kept):
+        mempool.add(tx, 1)
+    mined = chain.spend(funding, vout=0, fee=2)
+    block = Block.new_block([mined], "00" * 32, 1, 1)
+    assert mempool.remove_for_block(block) == 2
+    assert list(mempool) == [kept]
+    assert mempool.total_bytes == transaction_size(kept)
+
+
+def test_parent_added_after_child_still_takes_it_along(chain, funding):
+    mempool = Mempool()
+    parent = chain.spend(funding, vout=0)
+    child = chain.spend(parent, vout=1)
+    mempool.add(child, 0)
+    mempool.add(parent, 0)
+    assert mempool.select() == (parent, child)
+    assert mempool.remove_with_descendants(parent.Hash) == 2
+
+
+def test_revalidate_drops_transactions_whose_inputs_are_gone(chain, funding):
+    utxo_set = UTXOSet()
+    for vout, output in enumerate(funding.Vout):
+        utxo_set.add(funding.Hash, vout, output)
+    mempool = Mempool()
+    orphaned = chain.spend(chain.spend(funding, vout=0), vout=1)
+    kept = chain.spend(funding, vout=1)
+    grandchild = chain.spend(orphaned, vout=1)
+    for tx in (orphaned, kept, grandchild):
+        mempool.add(tx, 0)
+    assert mempool.revalidate(utxo_set) == 2
+    assert list(mempool) == [kept]
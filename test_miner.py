@@ -0,0 +1,50 @@
+import threading
+from datetime import datetime, timezone
+
+import pytest
+
+from block import Block
+from miner import Miner, MinerPool, get_miner_pool
+
+
+@pytest.fixture(scope='module')
+def pool():
+    pool = MinerPool(2)
+    yield pool
+    pool.shutdown()
+
+
+def _block(difficulty: int) -> Block:
+    return Block(datetime(2024, 1, 1, tzinfo=timezone.utc), [], "0" * 64, "", 0, 1, difficulty)
+
+
+@pytest.mark.parametrize("parallel", [False, True])
+def test_mined_block_meets_difficulty(pool, parallel):
+    miner = Miner(max_workers=2, range_size=256, pool=pool) if parallel else Miner(max_workers=1, range_size=256)
+    block = _block(3)
+    assert miner.mine(block)
+    assert block.check_pow() and block.Hash == block.compute_hash()
+    assert miner.stats()["total_hashes"] >= block.Nonce // 256
+    miner.shutdown()
+
+
+@pytest.mark.parametrize("parallel", [False, True])
+def test_cancel_stops_only_its_own_miner(pool, parallel):
+    make = (lambda: Miner(max_workers=2, range_size=256, pool=pool)) if parallel else (lambda: Miner(max_workers=1, range_size=256))
+    cancelled, other = make(), make()
+    timer = threading.Timer(0.3, cancelled.cancel)
+    timer.start()
+    # 难度 64 不可能找到，只能被取消
+    assert not cancelled.mine(_block(64))
+    assert other.mine(_block(2))
+    cancelled.shutdown()
+    other.shutdown()
+
+
+def test_miners_share_the_default_pool():
+    first, second = Miner(max_workers=2), Miner(max_workers=2)
+    assert first.pool is second.pool is get_miner_pool()
+    assert first.pool.executor._mp_context.get_start_method() == 'spawn'
+    assert first._slot != second._slot
+    first.shutdown()
+    second.shutdown()
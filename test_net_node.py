@@ -0,0 +1,211 @@
+import io
+import time
+
+import pytest
+
+from block import Output, Transaction, verify_merkle_proof
+from codec import BINARY_CONTENT_TYPE, read_block_frames
+from conftest import AppPeerClient
+
+
+def _extend(chain, node, count, amount=1):
+    """在节点的主链末尾依次接上 count 个区块，每个区块花费上一个区块的找零"""
+    tip = node.blockchain.blocks[node.blockchain.height - 1]
+    tx = tip.Transactions[0]
+    blocks = []
+    for _ in range(count):
+        tx = chain.spend(tx, vout=1 if tx.Vin else 0, amount=amount)
+        blocks.append(chain.mine([tx], node.blockchain.current_hash, node.blockchain.height))
+        assert node._accept_block(blocks[-1])[0] == 200
+    return blocks
+
+
+@pytest.mark.parametrize("path", [
+    "/sync?limit=abc", "/sync?height=1.5", "/headers?limit=x", "/utxos?pubkey=00&offset=x",
+    "/getBlockChain?datetime=yesterday",
+])
+def test_bad_integer_query_returns_400(node, path):
+    assert node.app.test_client().get(path).status_code == 400
+
+
+def test_bad_filtered_blocks_height_returns_400(node):
+    client = node.app.test_client()
+    filter_id = client.post('/filterload', json={"filter": {"n_bits": 8, "n_hashes": 1, "tweak": 0, "bits": "00"}})
+    response = client.get(f"/filtered_blocks?filter={filter_id.get_json()['filter_id']}&height=abc")
+    assert response.status_code == 400
+
+
+def test_sync_page_is_fixed_when_streaming_starts(chain, node):
+    genesis = node.blockchain.blocks[0]
+    old = _extend(chain, node, 2)
+    response = node.app.test_client().get('/sync?height=0', headers={'Accept': BINARY_CONTENT_TYPE})
+    assert response.headers['X-Tip-Height'] == '3'
+
+    # 输出区块之前发生重组：从创世区块分叉出更长的链
+    fork = chain.spend(genesis.Transactions[0], amount=2)
+    new = [chain.mine([fork], genesis.Hash, 1)]
+    for height in (2, 3):
+        fork = chain.spend(fork, vout=1, amount=2)
+        new.append(chain.mine([fork], new[-1].Hash, height))
+    for block in new:
+        node._accept_block(block)
+    assert node.blockchain.current_hash == new[-1].Hash
+
+    streamed = list(read_block_frames(io.BytesIO(response.get_data()).read))
+    assert [block.Hash for block in streamed] == [genesis.Hash] + [block.Hash for block in old]
+
+
+def test_merkle_proof_endpoint(chain, node):
+    block = _extend(chain, node, 1)[0]
+    txid = block.Transactions[0].Hash
+    client = node.app.test_client()
+    data = client.get(f'/merkle_proof?txid={txid}').get_json()
+    assert (data["block_hash"], data["height"], data["merkle_root"]) == (block.Hash, 1, block.merkle_root)
+    assert verify_merkle_proof(data["merkle_root"], txid, data["proof"])
+    assert client.get('/merkle_proof?txid=' + "00" * 32).status_code == 404
+
+
+def test_post_transactions_orders_parents_and_reports_each_item(chain, node):
+    genesis = node.blockchain.blocks[0]
+    parent, child = chain.chain_of_spends(genesis.Transactions[0], 2)
+    forged = chain.spend(genesis.Transactions[0], amount=2)
+    forged.Vin[0].signature = child.Vin[0].signature
+    forged._set_hash()
+    items = [child.to_dict(), parent.to_dict(), parent.to_dict(), forged.to_dict(), {"Version": 1}]
+    data = node.app.test_client().post('/post_transactions', json={"transactions": items}).get_json()
+
+    # 子交易先提交，父交易在批内时仍然先加入交易池
+    assert data["accepted"] == 2
+    assert [r["code"] for r in data["results"]] == [200, 200, 400, 400, 400]
+    assert [r["hash"] for r in data["results"][:4]] == [child.Hash, parent.Hash, parent.Hash, forged.Hash]
+    assert data["results"][2]["message"] == "Duplicate transaction"
+    assert data["results"][3]["message"] == "Invalid signature"
+    assert len(node.mempool) == 2
+    assert node.mempool.select() == (parent, child)
+
+    # 再次提交已在交易池中的交易
+    data = node.app.test_client().post('/post_transactions', json=[parent.to_dict()]).get_json()
+    assert data["accepted"] == 0 and data["results"][0]["message"] == "Duplicate transaction"
+
+
+def test_reorg_drops_children_of_transactions_that_cannot_return(chain, node):
+    genesis = node.blockchain.blocks[0]
+    parent = chain.spend(genesis.Transactions[0], amount=2)
+    assert node._accept_block(chain.mine([parent], genesis.Hash, 1))[0] == 200
+    child = chain.spend(parent, vout=1)
+    assert node._accept_transaction(child)[0] == 200
+
+    # 新分支双花了 parent 的输入，parent 放不回交易池，child 的输入就不存在了
+    double_spend = chain.spend(genesis.Transactions[0], amount=3)
+    b1 = chain.mine([double_spend], genesis.Hash, 1)
+    b2 = chain.mine([chain.spend(double_spend, vout=1)], b1.Hash, 2)
+    for block in (b1, b2):
+        assert node._accept_block(block)[0] == 200
+    assert node.blockchain.current_hash == b2.Hash
+    assert len(node.mempool) == 0 and node.mempool.select() == ()
+
+
+@pytest.fixture
+def miner_node(node):
+    """难度与测试用创世区块相同、不向其他节点公告的节点"""
+    node.difficulty = 1
+    node.address_pool.clear()
+    return node
+
+
+def test_mine_block_keeps_transactions_that_arrive_while_mining(chain, miner_node, monkeypatch):
+    genesis = miner_node.blockchain.blocks[0]
+    packed = chain.spend(genesis.Transactions[0], amount=2)
+    late = chain.spend(packed, vout=1)
+    assert miner_node._accept_transaction(packed)[0] == 200
+    mine = miner_node.miner.mine
+
+    def mine_while_receiving(block):
+        # 挖矿在锁外进行，期间可以继续接收交易
+        assert not miner_node.transaction_list_lock.locked()
+        assert miner_node._accept_transaction(late)[0] == 200
+        return mine(block)
+
+    monkeypatch.setattr(miner_node.miner, 'mine', mine_while_receiving)
+    block = miner_node.mine_block()
+    assert block.Transactions == [packed] and miner_node.blockchain.current_hash == block.Hash
+    assert list(miner_node.mempool) == [late]
+    assert len(miner_node.block_store) == 2
+
+
+def test_mine_block_discards_block_when_chain_moved(chain, miner_node, monkeypatch):
+    genesis = miner_node.blockchain.blocks[0]
+    assert miner_node._accept_transaction(chain.spend(genesis.Transactions[0], amount=2))[0] == 200
+    mine = miner_node.miner.mine
+
+    def mine_after_competitor(block):
+        competitor = chain.mine([chain.spend(genesis.Transactions[0], amount=3)], genesis.Hash, 1)
+        assert miner_node._accept_block(competitor)[0] == 200
+        return mine(block)
+
+    monkeypatch.setattr(miner_node.miner, 'mine', mine_after_competitor)
+    assert miner_node.mine_block() is None
+    assert miner_node.blockchain.height == 2 and len(miner_node.mempool) == 0
+
+
+def test_mine_block_does_not_connect_an_invalid_block(chain, miner_node):
+    genesis = miner_node.blockchain.blocks[0]
+    valid = chain.spend(genesis.Transactions[0], amount=2)
+    unfunded = Transaction(Hash="", Vin=[], Vout=[Output(5, chain.wallet.pub_key)])
+    unfunded._set_hash()
+    # 绕过接收交易时的检查，直接放进交易池
+    miner_node.mempool.add(valid, 0)
+    miner_node.mempool.add(unfunded, 10)
+    assert miner_node.mine_block() is None
+    assert miner_node.blockchain.height == 1
+    assert list(miner_node.mempool) == [valid]
+    assert miner_node.mine_block().Transactions == [valid]
+
+
+@pytest.mark.parametrize("body", [
+    [{"type": "block", "hash": "00" * 32}],
+    {"from": "127.0.0.1:1", "inv": [{"type": "block"}]},
+    {"from": "127.0.0.1:1", "inv": [{"type": "filter", "hash": "00" * 32}]},
+    {"from": "127.0.0.1:1", "inv": [{"type": "tx", "hash": "XY" * 32}]},
+    {"from": "127.0.0.1:1", "inv": ["00" * 32]},
+    {"from": "127.0.0.1:1", "inv": {"type": "tx"}},
+])
+def test_malformed_inventory_returns_400(node, body):
+    client = node.app.test_client()
+    assert client.post('/inv', json=body).status_code == 400
+    if isinstance(body, dict):
+        body = {"inv": body["inv"]}
+    assert client.post('/getdata', json=body).status_code == 400
+
+
+def test_inv_requests_only_unseen_objects(chain, node, monkeypatch):
+    fetched = []
+    monkeypatch.setattr(node, '_fetch_inventory', lambda sender, items: fetched.append((sender, items)))
+    genesis = node.blockchain.blocks[0]
+    unknown = {"type": "block", "hash": "ab" * 32}
+    body = {"from": "127.0.0.1:1", "inv": [unknown, {"type": "block", "hash": genesis.Hash}]}
+    client = node.app.test_client()
+    assert client.post('/inv', json=body).get_json()["requested"] == 1
+    assert client.post('/inv', json=body).get_json()["requested"] == 0
+    for _ in range(50):
+        if fetched:
+            break
+        time.sleep(0.01)
+    assert fetched == [("127.0.0.1:1", [unknown])]
+
+
+def test_fetched_orphan_pulls_in_its_parents(chain, node, tmp_path):
+    blocks = _extend(chain, node, 3)
+    tx = chain.spend(blocks[-1].Transactions[0], vout=1)
+    assert node._accept_transaction(tx)[0] == 200
+    fetcher = type(node)(18334, str(tmp_path / 'genesis.json'))
+    fetcher.peers = AppPeerClient(node.app)
+    fetcher.address_pool.clear()
+
+    # 只公告了最新区块和交易，缺少的祖先区块逐个向公告方请求
+    fetcher._fetch_inventory("127.0.0.1:18333", [{"type": "block", "hash": blocks[-1].Hash},
+                                                 {"type": "tx", "hash": tx.Hash}])
+    assert fetcher.blockchain.current_hash == blocks[-1].Hash
+    assert len(fetcher.orphan_pool) == 0
+    assert fetcher.mempool.get(tx.Hash) == tx
+    assert all(block.Hash in fetcher.seen for block in blocks)
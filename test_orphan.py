@@ -0,0 +1,74 @@
+import pytest
+
+from orphan import OrphanPool
+
+
+@pytest.fixture
+def tree(chain):
+    """创世区块之后的区块树：a 有两个子区块 b、c，b 有子区块 d"""
+    genesis = chain.genesis()
+    coinbase = genesis.Transactions[0]
+    a = chain.mine([chain.spend(coinbase)], genesis.Hash, 1)
+    b = chain.mine([chain.spend(coinbase, amount=2)], a.Hash, 2)
+    c = chain.mine([chain.spend(coinbase, amount=3)], a.Hash, 2)
+    d = chain.mine([chain.spend(coinbase, amount=4)], b.Hash, 3)
+    return genesis, a, b, c, d
+
+
+def test_descendants_come_out_parents_first(tree):
+    genesis, a, b, c, d = tree
+    pool = OrphanPool()
+    for block in (d, c, b, a):
+        assert pool.add(block)
+    assert not pool.add(a)
+    order = [block.Hash for block in pool.descendants(genesis.Hash)]
+    assert order[0] == a.Hash and set(order[1:3]) == {b.Hash, c.Hash} and order[3] == d.Hash
+    assert len(pool) == 0 and pool.total_bytes == 0
+
+
+def test_only_the_resolved_subtree_is_taken(tree):
+    genesis, a, b, c, d = tree
+    pool = OrphanPool()
+    for block in (b, c, d):
+        pool.add(block)
+    assert [block.Hash for block in pool.descendants(b.Hash)] == [d.Hash]
+    assert pool.descendants(genesis.Hash) == []
+    assert b.Hash in pool and c.Hash in pool
+
+
+def test_old_orphans_expire(tree):
+    _, a, b, c, _ = tree
+    pool = OrphanPool(max_age=60)
+    pool.add(a, now=0)
+    pool.add(b, now=30)
+    assert pool.expire(now=61) == 1
+    assert a.Hash not in pool and b.Hash in pool
+    # 加入新区块时也会先清理过期的
+    pool.add(c, now=100)
+    assert list(pool._entries) == [c.Hash]
+    assert pool.stats()["evicted"] == 2
+
+
+def test_full_pool_evicts_the_oldest(tree):
+    _, a, b, c, d = tree
+    pool = OrphanPool(max_count=2)
+    for block in (a, b, c):
+        pool.add(block)
+    assert a.Hash not in pool and len(pool) == 2
+    assert not OrphanPool(max_bytes=1).add(d)
+
+
+def test_node_connects_orphans_when_the_parent_arrives(chain, node):
+    genesis = node.blockchain.blocks[0]
+    coinbase = genesis.Transactions[0]
+    blocks = []
+    tx = coinbase
+    for height in range(1, 4):
+        tx = chain.spend(tx, vout=1 if tx.Vin else 0)
+        blocks.append(chain.mine([tx], blocks[-1].Hash if blocks else genesis.Hash, height))
+    for block in blocks[:0:-1]:
+        assert node._accept_block(block) == (400, "Orphan block.")
+    assert len(node.orphan_pool) == 2
+    assert node._accept_block(blocks[0]) == (200, "Block added.")
+    assert node.blockchain.current_hash == blocks[-1].Hash and len(node.orphan_pool) == 0
+    assert len(node.block_store) == 4
@@ -0,0 +1,74 @@
+import time
+
+import pytest
+import requests
+
+from peer import PeerClient, RecentFilter
+
+
+def test_recent_filter_forgets_the_oldest_hashes():
+    seen = RecentFilter(capacity=2)
+    assert seen.add("a") and seen.add("b")
+    assert not seen.add("a")
+    assert seen.add("c")
+    assert "a" not in seen and "b" in seen and "c" in seen and len(seen) == 2
+    seen.discard("b")
+    seen.discard("missing")
+    assert seen.add("b")
+
+
+class _FakeSession:
+    """按地址返回固定结果的 requests.Session 替身"""
+
+    def __init__(self, status=200, delay=0.0, error=None):
+        self.status = status
+        self.delay = delay
+        self.error = error
+        self.closed = False
+
+    def request(self, method, url, timeout=None, **kwargs):
+        time.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        response = requests.Response()
+        response.status_code = self.status
+        return response
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def client(monkeypatch):
+    sessions = {
+        "10.0.0.1:1": _FakeSession(delay=0.3),
+        "10.0.0.2:1": _FakeSession(delay=0.3),
+        "10.0.0.3:1": _FakeSession(error=requests.exceptions.ConnectionError("refused")),
+        "10.0.0.4:1": _FakeSession(status=503),
+    }
+    client = PeerClient()
+    monkeypatch.setattr(client, '_session', lambda address: sessions[address])
+    client.sessions = sessions
+    return client
+
+
+def test_broadcast_isolates_failing_peers(client):
+    begin = time.time()
+    results = client.broadcast(client.sessions, 'GET', '/heartbeat')
+    # 并发发送：总耗时约等于最慢的节点，而不是所有节点之和
+    assert time.time() - begin < 0.55
+    assert [results[a].ok for a in client.sessions] == [True, True, False, False]
+    assert results["10.0.0.3:1"].status is None and "refused" in results["10.0.0.3:1"].error
+    assert results["10.0.0.4:1"].status == 503
+    stats = client.latency_stats()
+    assert stats["10.0.0.1:1"]["last"] >= 0.3 and stats["10.0.0.1:1"]["failures"] == 0
+    assert stats["10.0.0.3:1"]["failures"] == 1
+
+
+def test_forget_closes_the_connection_pool():
+    client = PeerClient()
+    session = client._session("10.0.0.1:1")
+    assert client._session("10.0.0.1:1") is session
+    client.forget("10.0.0.1:1")
+    assert client._session("10.0.0.1:1") is not session
+    assert "10.0.0.1:1" not in client.latency_stats()
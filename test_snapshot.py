@@ -0,0 +1,20 @@
+from block import BlockChain
+from snapshot import ChainSnapshot, verify_snapshot
+
+
+def test_capture_is_independent_of_later_blocks(chain):
+    genesis = chain.genesis()
+    blocks = [genesis]
+    for tx in chain.chain_of_spends(genesis.Transactions[0], 3):
+        blocks.append(chain.mine([tx], blocks[-1].Hash, len(blocks)))
+    blockchain = BlockChain(blocks[:3], blocks[2].Hash, 3)
+    state = ChainSnapshot.capture(blockchain)
+    # 锁外编码期间区块链继续增长
+    blockchain.add_block(blocks[3])
+
+    snapshot = ChainSnapshot.decode(state.encode())
+    assert snapshot.height == 3 and snapshot.block_hash == blocks[2].Hash
+    assert verify_snapshot(snapshot, blocks)['ok']
+    assert snapshot.utxo_set.get(blocks[2].Transactions[0].Hash, 1) is not None
+    assert snapshot.utxo_set.get(blocks[3].Transactions[0].Hash, 1) is None
+    assert blocks[3].Transactions[0].Hash not in snapshot.tx_index
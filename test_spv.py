@@ -0,0 +1,46 @@
+import json
+import os
+
+import pytest
+
+from conftest import ChainHelper
+from spv import BloomFilter, SPVWallet, filter_matches
+from wallet import Wallet
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+
+def test_bloom_filter_contains_added_keys_after_round_trip(chain):
+    bloom = BloomFilter.for_elements(1, tweak=7)
+    bloom.add(bytes.fromhex(chain.wallet.pub_key))
+    bloom = BloomFilter.from_dict(json.loads(json.dumps(bloom.to_dict())))
+    assert bytes.fromhex(chain.wallet.pub_key) in bloom
+    assert filter_matches(bloom, chain.genesis().Transactions[0])
+
+
+@pytest.mark.parametrize('node', [os.path.join(DATA_DIR, 'bb.json')], indirect=True)
+def test_sync_funded_wallet_from_genesis(node, peers):
+    with open(os.path.join(DATA_DIR, 'wallet_a.json')) as f:
+        wallet = Wallet(**json.load(f))
+    spv = SPVWallet([wallet], '127.0.0.1:18333', genesis_hash=node.blockchain.current_hash, peers=peers)
+    assert spv.sync() == 1
+    assert spv.height == 1
+    assert spv.balance() == 100
+
+
+def test_sync_tracks_spends_in_new_blocks(chain, node, peers):
+    other = ChainHelper("2e" * 32).wallet
+    genesis = node.blockchain.blocks[0]
+    spv = SPVWallet([chain.wallet], '127.0.0.1:18333', genesis_hash=genesis.Hash, peers=peers)
+    assert spv.sync() == 1
+    assert spv.balance() == 10 ** 9
+
+    tx = genesis.Transactions[0]
+    for height in range(1, 4):
+        tx = chain.spend(tx, vout=1 if height > 1 else 0, pubkey=other.pub_key)
+        assert node._accept_block(chain.mine([tx], node.blockchain.current_hash, height))[0] == 200
+
+    assert spv.sync() == 3
+    assert spv.height == 4
+    assert spv.balance() == 10 ** 9 - 3
+    assert list(spv.utxos) == [(tx.Hash, 1)]
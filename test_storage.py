@@ -0,0 +1,96 @@
+import threading
+import time
+
+from storage import BlockStore, LazyBlockList
+
+
+def _blocks(chain, count):
+    genesis = chain.genesis()
+    blocks = [genesis]
+    for tx in chain.chain_of_spends(genesis.Transactions[0], count):
+        blocks.append(chain.mine([tx], blocks[-1].Hash, len(blocks)))
+    return blocks
+
+
+def test_reopen_keeps_every_block(chain, tmp_path):
+    blocks = _blocks(chain, 5)
+    store = BlockStore(str(tmp_path / 'store'), sync_every=1)
+    for block in blocks:
+        store.append(block)
+    store.close()
+
+    store = BlockStore(str(tmp_path / 'store'))
+    assert len(store) == len(blocks)
+    assert [block.Hash for block in store] == [block.Hash for block in blocks]
+    assert store.read(3).Transactions[0].Hash == blocks[3].Transactions[0].Hash
+    store.close()
+
+
+def test_reopen_after_truncate_and_lazy_load(chain, tmp_path):
+    blocks = _blocks(chain, 5)
+    store = BlockStore(str(tmp_path / 'store'))
+    for block in blocks:
+        store.append(block)
+    store.truncate(3)
+    store.append(blocks[3])
+    store.close()
+
+    store = BlockStore(str(tmp_path / 'store'))
+    blockchain = store.load_blockchain(lazy=True)
+    assert isinstance(blockchain.blocks, LazyBlockList)
+    assert blockchain.height == 4 and blockchain.current_hash == blocks[3].Hash
+    assert blockchain.header(2).Hash == blocks[2].Hash
+    assert blockchain.utxo_set.get(blocks[3].Transactions[0].Hash, 1) is not None
+    store.close()
+
+
+def test_torn_record_is_dropped_on_reopen(chain, tmp_path):
+    blocks = _blocks(chain, 2)
+    store = BlockStore(str(tmp_path / 'store'))
+    for block in blocks:
+        store.append(block)
+    store.close()
+    with open(store._segment_path(0), 'ab') as f:
+        f.write(b'\x40\x00\x00\x00partial')
+
+    store = BlockStore(str(tmp_path / 'store'))
+    assert len(store) == len(blocks)
+    store.append(chain.mine([chain.spend(blocks[-1].Transactions[0], vout=1)], blocks[-1].Hash, 3))
+    assert len(store) == 4 and store.read(3).PrevBlockHash == blocks[-1].Hash
+    store.close()
+
+
+def test_concurrent_saves_write_each_block_once(chain, node, monkeypatch):
+    genesis = node.blockchain.blocks[0]
+    for block in _blocks(chain, 6)[1:]:
+        node.blockchain.add_block(block)
+    append = node.block_store.append
+
+    def slow_append(block):
+        # 放大比较长度和追加之间的窗口
+        time.sleep(0.01)
+        append(block)
+    monkeypatch.setattr(node.block_store, 'append', slow_append)
+    threads = [threading.Thread(target=node._save) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(node.block_store) == node.blockchain.height == 7
+    assert [block.Hash for block in node.block_store] == [block.Hash for block in node.blockchain.blocks]
+    assert node.block_store.read(0).Hash == genesis.Hash
+
+
+def test_restarted_node_loads_lazily_and_keeps_appending(chain, node, tmp_path):
+    blocks = _blocks(chain, 3)
+    for block in blocks[1:]:
+        assert node._accept_block(block)[0] == 200
+    node.block_store.close()
+
+    restarted = type(node)(18333, str(tmp_path / 'genesis.json'))
+    assert isinstance(restarted.blockchain.blocks, LazyBlockList)
+    assert restarted.blockchain.current_hash == blocks[-1].Hash
+    assert restarted.blockchain.utxo_set.get(blocks[-1].Transactions[0].Hash, 1) is not None
+    tx = chain.spend(blocks[-1].Transactions[0], vout=1)
+    assert restarted._accept_block(chain.mine([tx], blocks[-1].Hash, 4))[0] == 200
+    assert len(restarted.block_store) == restarted.blockchain.height == 5
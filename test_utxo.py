@@ -0,0 +1,55 @@
+from block import Output
+from utxo import UTXOSet, UTXOView, addresses_for
+
+
+def test_index_tracks_balance_and_outputs(chain):
+    genesis = chain.genesis()
+    utxo_set = UTXOSet.from_blocks([genesis])
+    tx = chain.spend(genesis.Transactions[0], amount=5)
+    utxo_set.apply_transaction(tx)
+
+    key = utxo_set.index.resolve(pubkey=chain.wallet.pub_key)
+    assert utxo_set.index.balance(key) == 10 ** 9
+    assert utxo_set.index.count(key) == 2
+    assert [outpoint for outpoint, _ in utxo_set.index.outputs(key, offset=1, limit=5)] == [(tx.Hash, 1)]
+
+
+def test_address_mapping_is_explicit_and_pruned_with_the_last_output(chain):
+    genesis = chain.genesis()
+    utxo_set = UTXOSet.from_blocks([genesis])
+    index = utxo_set.index
+    assert index.resolve(address=chain.wallet.address) is None
+
+    index.map_addresses(addresses_for(index.unmapped()))
+    assert index.unmapped() == []
+    assert index.balance(index.resolve(address=chain.wallet.address)) == 10 ** 9
+
+    utxo_set.spend(genesis.Transactions[0].Hash, 0)
+    assert index.resolve(address=chain.wallet.address) is None
+    assert len(index) == 0 and not index._addresses and not index._address_of
+    # 输出花完后才算好的地址不再加入
+    utxo_set.add("00" * 32, 0, Output(1, chain.wallet.pub_key))
+    pending = addresses_for(index.unmapped())
+    utxo_set.spend("00" * 32, 0)
+    index.map_addresses(pending)
+    assert not index._addresses
+
+
+def test_view_does_not_touch_the_base_set(chain):
+    genesis = chain.genesis()
+    utxo_set = UTXOSet.from_blocks([genesis])
+    view = UTXOView(utxo_set)
+    tx = chain.spend(genesis.Transactions[0])
+    view.apply_transaction(tx)
+    assert view.get(genesis.Transactions[0].Hash, 0) is None
+    assert view.get(tx.Hash, 1) is not None
+    assert utxo_set.get(genesis.Transactions[0].Hash, 0) is not None
+    assert utxo_set.get(tx.Hash, 1) is None
+
+
+def test_balance_by_address_endpoint(chain, node):
+    client = node.app.test_client()
+    data = client.get(f'/balance?address={chain.wallet.address}').get_json()
+    assert data["balance"] == 10 ** 9 and data["count"] == 1
+    data = client.get(f'/utxos?address={chain.wallet.address}&limit=1').get_json()
+    assert data["total"] == 1 and data["next_offset"] is None
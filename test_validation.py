@@ -0,0 +1,103 @@
+import pytest
+
+from block import BlockChain, Output, Transaction
+from validation import BlockValidationError, ValidationPipeline
+from verifier import VerifyEngine
+
+
+@pytest.fixture
+def pipeline() -> ValidationPipeline:
+    return ValidationPipeline(VerifyEngine(max_workers=1))
+
+
+def test_valid_block_passes(chain, pipeline):
+    genesis = chain.genesis()
+    block = chain.mine([chain.spend(genesis.Transactions[0])], genesis.Hash, 1)
+    pipeline.check_block(block)
+    pipeline.check_transactions(block, BlockChain([genesis], genesis.Hash, 1))
+
+
+@pytest.mark.parametrize("pubkey", ["not-a-hex-pubkey", "abc", "AB" * 64])
+def test_output_pubkey_the_codec_cannot_encode_is_rejected(chain, pipeline, pubkey):
+    genesis = chain.genesis()
+    block = chain.mine([chain.spend(genesis.Transactions[0], pubkey=pubkey)], genesis.Hash, 1)
+    with pytest.raises(BlockValidationError) as e:
+        pipeline.check_block(block)
+    assert e.value.stage == 'format'
+    assert pipeline.stats()['format']['rejected'] == 1
+    assert pipeline.stats()['signatures']['count'] == 0
+
+
+def test_uppercase_signature_is_rejected(chain, pipeline):
+    genesis = chain.genesis()
+    tx = chain.spend(genesis.Transactions[0])
+    tx.Vin[0].signature = tx.Vin[0].signature.upper()
+    block = chain.mine([tx], genesis.Hash, 1)
+    with pytest.raises(BlockValidationError) as e:
+        pipeline.check_block(block)
+    assert e.value.stage == 'format'
+
+
+def test_node_rejects_unencodable_block_before_touching_state(chain, node):
+    genesis = node.blockchain.blocks[0]
+    block = chain.mine([chain.spend(genesis.Transactions[0], pubkey="not-a-hex-pubkey")], genesis.Hash, 1)
+    code, message = node._accept_block(block)
+    assert code == 400 and message.startswith('format')
+    assert node.blockchain.height == len(node.block_store) == 1
+    assert node.blockchain.utxo_set.get(genesis.Transactions[0].Hash, 0) is not None
+
+
+def test_node_rejects_unencodable_transaction(chain, node):
+    genesis = node.blockchain.blocks[0]
+    code, _ = node._accept_transaction(chain.spend(genesis.Transactions[0], pubkey="not-a-hex-pubkey"))
+    assert code == 400
+    assert len(node.mempool) == 0
+    results = node._accept_transactions([chain.spend(genesis.Transactions[0], pubkey="xyz").to_dict()])
+    assert results[0]["code"] == 400
+
+
+@pytest.mark.parametrize("change", [-10 ** 12, 0, float('nan'), float('-inf')])
+def test_non_positive_output_cannot_inflate_supply(chain, node, change):
+    genesis = node.blockchain.blocks[0]
+    coinbase = genesis.Transactions[0]
+    # 两个输出合计等于输入，第一个输出凭空多出 -change
+    tx = chain.spend(coinbase, amount=coinbase.Vout[0].value - change)
+    tx.Vout[1].value = change
+    tx.sign(chain.wallet.private_key)
+    tx._set_hash()
+    block = chain.mine([tx], genesis.Hash, 1)
+    code, message = node._accept_block(block)
+    assert code == 400 and message.startswith('format')
+    assert node.blockchain.height == 1
+    assert node._accept_transaction(tx)[0] == 400
+
+
+@pytest.mark.parametrize("parent_difficulty, difficulty", [(2, 1), (1, 2)])
+def test_block_must_keep_parent_difficulty(chain, pipeline, parent_difficulty, difficulty):
+    genesis = chain.genesis()
+    genesis.Difficulty = parent_difficulty
+    genesis.set_hash()
+    blockchain = BlockChain([genesis], genesis.Hash, 1)
+    block = chain.mine([chain.spend(genesis.Transactions[0])], genesis.Hash, 1, difficulty=difficulty)
+    pipeline.check_block(block)
+    with pytest.raises(BlockValidationError) as e:
+        blockchain.accept_block(block, check=pipeline.check_connect)
+    assert e.value.stage == 'header'
+    assert blockchain.height == 1 and not blockchain.side_blocks
+
+
+def _unfunded(chain, values):
+    tx = Transaction(Hash="", Vin=[], Vout=[Output(value, chain.wallet.pub_key) for value in values])
+    tx._set_hash()
+    return tx
+
+
+@pytest.mark.parametrize("values", [[0], [1000], [1000, -1000]])
+def test_admission_applies_block_rules(chain, node, pipeline, values):
+    tx = _unfunded(chain, values)
+    assert node._accept_transaction(tx)[0] == 400
+    assert node._accept_transactions([tx.to_dict()])[0]["code"] == 400
+    assert len(node.mempool) == 0
+    genesis = node.blockchain.blocks[0]
+    with pytest.raises(BlockValidationError):
+        pipeline.check_connect(chain.mine([tx], genesis.Hash, 1), node.blockchain)
@@ -0,0 +1,69 @@
+import pytest
+
+import verifier
+from verifier import SignatureCache, VerifyEngine, get_verify_engine
+
+
+@pytest.fixture
+def jobs(chain):
+    """有效签名、签名错误、公钥格式错误各若干"""
+    genesis = chain.genesis()
+    transactions = chain.chain_of_spends(genesis.Transactions[0], 6)
+    valid = [job for tx in transactions for job in tx.signature_jobs()]
+    pubkey, message, signature = valid[0]
+    return valid + [(pubkey, b"other message", signature), ("zz" * 64, message, signature), valid[1]]
+
+
+@pytest.fixture
+def fresh_cache(monkeypatch):
+    cache = SignatureCache()
+    monkeypatch.setattr(verifier, '_signature_cache', cache)
+    return cache
+
+
+def test_parallel_path_matches_serial_path(jobs, fresh_cache, monkeypatch):
+    serial = VerifyEngine(max_workers=1).verify_batch(jobs)
+    assert serial == [True] * 6 + [False, False, True]
+
+    monkeypatch.setattr(verifier, '_signature_cache', SignatureCache())
+    engine = VerifyEngine(max_workers=2, min_batch=1, chunk_size=2)
+    try:
+        assert engine._executor._mp_context.get_start_method() == 'spawn'
+        assert engine.verify_batch(jobs) == serial
+        # 工作进程校验成功的签名写回当前进程的缓存，失败的不缓存
+        assert verifier._signature_cache.signatures.stats()["size"] == 6
+    finally:
+        engine.shutdown()
+    # 进程池关闭后退回串行校验
+    assert engine.verify_batch(jobs) == serial
+
+
+def test_nodes_share_one_engine():
+    assert get_verify_engine() is get_verify_engine()
+
+
+def test_signature_cache_hits_and_evicts(jobs, fresh_cache):
+    cache = SignatureCache(max_keys=1, max_signatures=2)
+    first, second, third = jobs[:3]
+    assert cache.verify(*first) and cache.verify(*first)
+    assert cache.signatures.hits == 1 and cache.signatures.misses == 1
+    assert cache.is_verified(first)
+    # 超过容量时淘汰最久未使用的签名
+    assert cache.verify(*second) and cache.verify(*third)
+    assert not cache.is_verified(first) and cache.is_verified(third)
+    assert len(cache.keys) == 1 and len(cache.signatures) == 2
+
+
+def test_failed_signatures_are_not_cached(jobs, fresh_cache):
+    cache = SignatureCache()
+    bad = jobs[6]
+    assert not cache.verify(*bad) and not cache.verify(*bad)
+    assert not cache.is_verified(bad) and len(cache.signatures) == 0
+
+
+def test_transaction_signature_checks_use_the_shared_cache(chain, fresh_cache):
+    tx = chain.spend(chain.genesis().Transactions[0])
+    assert tx.verify_input_signature(tx.Vin[0])
+    assert tx.verify_input_signature(tx.Vin[0])
+    assert fresh_cache.stats()["signatures"]["hits"] == 1
+    assert fresh_cache.stats()["keys"]["size"] == 1
@@ -0,0 +1,241 @@
+from itertools import islice
+from typing import TYPE_CHECKING, Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
+
+from wallet import pubkey_to_address
+
+if TYPE_CHECKING:
+    # block 导入本模块，只在类型检查时反向导入
+    from block import Block, Output, Transaction
+
+# (txid, vout) 唯一确定一笔交易输出
+OutPoint = Tuple[str, int]
+# Output 内部保存的公钥：原始字节，不是规范 hex 时为原字符串
+PubKey = Union[bytes, str]
+
+
+def _pubkey_key(pubkey: str) -> PubKey:
+    '''hex 公钥转成 Output 内部保存的形式，与 block._to_bytes 一致'''
+    try:
+        raw = bytes.fromhex(pubkey)
+    except ValueError:
+        return pubkey
+    return raw if raw.hex() == pubkey else pubkey
+
+
+class AddressIndex:
+    """
+    公钥 -> 它拥有的未花费输出和余额，由 UTXOSet 在增删输出时同步维护
+
+    查询一个公钥的余额是 O(1)，列出它的未花费输出是 O(该公钥的输出数)，不需要扫描区块链。
+    钱包地址由公钥计算，加载区块链时不计算；按地址查询前由调用方取出新出现的公钥（unmapped），
+    在锁外计算地址（addresses_for）后再加入映射（map_addresses）。公钥的输出花完时映射一起删除
+    """
+
+    def __init__(self):
+        self._outputs: Dict[PubKey, Dict[OutPoint, 'Output']] = {}   # 按输出加入的顺序排列
+        self._balances: Dict[PubKey, float] = {}
+        self._addresses: Dict[str, PubKey] = {}
+        self._address_of: Dict[PubKey, str] = {}
+        self._unmapped: Set[bytes] = set()     # 还没有计算地址的公钥
+
+    def __len__(self) -> int:
+        return len(self._outputs)
+
+    def add(self, outpoint: OutPoint, output: 'Output') -> None:
+        key = output._pubkey
+        outputs = self._outputs.get(key)
+        if outputs is None:
+            outputs = self._outputs[key] = {}
+            self._balances[key] = 0
+            if isinstance(key, bytes):
+                self._unmapped.add(key)
+        outputs[outpoint] = output
+        self._balances[key] += output.value
+
+    def remove(self, outpoint: OutPoint, output: 'Output') -> None:
+        key = output._pubkey
+        outputs = self._outputs.get(key)
+        if outputs is None or outputs.pop(outpoint, None) is None:
+            return
+        if outputs:
+            self._balances[key] -= output.value
+        else:
+            # 输出花完时删除，避免空条目和浮点误差累积
+            del self._outputs[key]
+            del self._balances[key]
+            self._unmapped.discard(key)
+            address = self._address_of.pop(key, None)
+            if address is not None:
+                del self._addresses[address]
+
+    def unmapped(self) -> List[bytes]:
+        """还没有计算地址的公钥"""
+        return list(self._unmapped)
+
+    def map_addresses(self, addresses: Iterable[Tuple[bytes, str]]) -> None:
+        """加入 addresses_for 计算的 (公钥, 地址)，期间输出已经花完的公钥忽略"""
+        for key, address in addresses:
+            if key in self._unmapped:
+                self._unmapped.discard(key)
+                self._addresses[address] = key
+                self._address_of[key] = address
+
+    def resolve(self, pubkey: str = None, address: str = None) -> Optional[PubKey]:
+        """
+        按公钥（hex）或钱包地址找到索引中的键，没有未花费输出时返回 None
+        按地址查询只能找到已经 map_addresses 的公钥
+        """
+        if pubkey is not None:
+            key = _pubkey_key(pubkey)
+            return key if key in self._outputs else None
+        return self._addresses.get(address)
+
+    def balance(self, key: Optional[PubKey]) -> float:
+        return self._balances.get(key, 0)
+
+    def count(self, key: Optional[PubKey]) -> int:
+        return len(self._outputs.get(key, ()))
+
+    def outputs(self, key: Optional[PubKey], offset: int = 0, limit: int = None) -> List[Tuple[OutPoint, 'Output']]:
+        """
+        公钥的未花费输出，按加入顺序（先确认的在前）分页
+
+        :param offset: 跳过前 offset 个
+        :param limit: 最多返回的个数，默认全部
+        """
+        outputs = self._outputs.get(key, {})
+        stop = None if limit is None else offset + limit
+        return list(islice(outputs.items(), offset, stop))
+
+
+def addresses_for(keys: Iterable[bytes]) -> List[Tuple[bytes, str]]:
+    """计算公钥的钱包地址（每个一次 sha256 + ripemd160 + base58），不访问索引，可以在锁外调用"""
+    return [(key, pubkey_to_address(key.hex())) for key in keys]
+
+
+class UTXOSet:
+    """
+    未花费交易输出集合，由 BlockChain 持有，在 add_block 时增量更新
+
+    键为 (txid, vout)，值为对应的 Output 对象，查询和判断是否已花费都是 O(1)
+    index 按公钥索引同一批输出，用于查询余额
+    """
+
+    def __init__(self):
+        self._outputs: Dict[OutPoint, 'Output'] = {}
+        self.index: AddressIndex = AddressIndex()
+
+    def __len__(self) -> int:
+        return len(self._outputs)
+
+    def __contains__(self, outpoint: OutPoint) -> bool:
+        return outpoint in self._outputs
+
+    def items(self) -> Iterator[Tuple[OutPoint, 'Output']]:
+        return iter(self._outputs.items())
+
+    def copy_outputs(self) -> Dict[OutPoint, 'Output']:
+        """全部未花费输出的浅拷贝（字典复制，不逐条创建元组），用于在锁内取得快照"""
+        return self._outputs.copy()
+
+    def get(self, txid: str, vout: int) -> Optional['Output']:
+        """
+        查询一笔未花费的输出
+
+        :param txid: 哪一笔交易
+        :param vout: 交易中那一笔输出
+        :return: Output，如果不存在或已经被花费则返回 None
+        """
+        return self._outputs.get((txid, vout))
+
+    def add(self, txid: str, vout: int, output: 'Output') -> None:
+        outpoint = (txid, vout)
+        previous = self._outputs.get(outpoint)
+        if previous is not None:
+            self.index.remove(outpoint, previous)
+        self._outputs[outpoint] = output
+        self.index.add(outpoint, output)
+
+    def spend(self, txid: str, vout: int) -> Optional['Output']:
+        """标记一笔输出为已花费，返回被花费的 Output，不存在则返回 None"""
+        output = self._outputs.pop((txid, vout), None)
+        if output is not None:
+            self.index.remove((txid, vout), output)
+        return output
+
+    def apply_transaction(self, transaction: 'Transaction') -> List[Tuple[OutPoint, 'Output']]:
+        """
+        花费交易的所有输入，并加入交易的所有输出
+
+        :return: 被花费掉的 (outpoint, Output) 列表
+        """
+        spent = []
+        for input_obj in transaction.Vin:
+            output = self.spend(input_obj.txid, input_obj.vout)
+            if output is not None:
+                spent.append(((input_obj.txid, input_obj.vout), output))
+        for vout, output in enumerate(transaction.Vout):
+            self.add(transaction.Hash, vout, output)
+        return spent
+
+    def apply_block(self, block: 'Block') -> List[Tuple[OutPoint, 'Output']]:
+        """按区块内顺序应用所有交易，返回整个区块花费掉的输出"""
+        spent = []
+        for transaction in block.Transactions:
+            spent.extend(self.apply_transaction(transaction))
+        return spent
+
+    @staticmethod
+    def from_blocks(blocks: Iterable['Block']) -> 'UTXOSet':
+        """从头重放区块，构建 UTXO 集合"""
+        utxo_set = UTXOSet()
+        for block in blocks:
+            utxo_set.apply_block(block)
+        return utxo_set
+
+
+class UTXOView:
+    """
+    UTXOSet 之上的临时修改层：新增和花费只记录在本层，不改动底层集合
+
+    用于验证一组互相依赖的交易（同一区块内后面的交易花费前面交易的输出），
+    验证失败时直接丢弃即可。utxo_set 属性指向自己，可以代替 BlockChain 传给 Transaction.verify
+    """
+
+    def __init__(self, base: UTXOSet):
+        self.base = base
+        self._added: Dict[OutPoint, 'Output'] = {}
+        self._spent: Set[OutPoint] = set()
+
+    @property
+    def utxo_set(self) -> 'UTXOView':
+        return self
+
+    def __contains__(self, outpoint: OutPoint) -> bool:
+        return self.get(*outpoint) is not None
+
+    def get(self, txid: str, vout: int) -> Optional['Output']:
+        outpoint = (txid, vout)
+        if outpoint in self._added:
+            return self._added[outpoint]
+        if outpoint in self._spent:
+            return None
+        return self.base.get(txid, vout)
+
+    def add(self, txid: str, vout: int, output: 'Output') -> None:
+        self._added[(txid, vout)] = output
+
+    def spend(self, txid: str, vout: int) -> Optional['Output']:
+        outpoint = (txid, vout)
+        if outpoint in self._added:
+            return self._added.pop(outpoint)
+        output = None if outpoint in self._spent else self.base.get(txid, vout)
+        if output is not None:
+            self._spent.add(outpoint)
+        return output
+
+    def apply_transaction(self, transaction: 'Transaction') -> None:
+        for input_obj in transaction.Vin:
+            self.spend(input_obj.txid, input_obj.vout)
+        for vout, output in enumerate(transaction.Vout):
+            self.add(transaction.Hash, vout, output)
@@ -0,0 +1,177 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional
+
+from block import Block, Transaction
+from codec import check_block_format, check_transaction_format, decode_block
+from utxo import UTXOView
+from verifier import VerifyEngine
+
+# 流水线的各个阶段，按执行顺序排列，便宜的检查在前
+STAGES = ('decode', 'format', 'header', 'merkle', 'signatures', 'utxo')
+
+
+class BlockValidationError(Exception):
+    """区块在某个阶段验证失败"""
+
+    def __init__(self, stage: str, message: str):
+        super().__init__(f"{stage}: {message}")
+        self.stage = stage
+
+
+def check_transaction_rules(tx: Transaction) -> None:
+    """
+    交易进入交易池和随区块上链共用的规则，与链状态无关，不满足时抛出 ValueError
+    两条路径用同一个函数，交易池中不会出现打包后被其他节点拒绝的交易
+
+    - 字段格式和输出金额为正，见 codec.check_transaction_format
+    - 必须有输入：没有输入的交易凭空产生金额，只有创世区块中可以出现
+    """
+    check_transaction_format(tx)
+    if not tx.Vin:
+        raise ValueError(f"transaction {tx.Hash} has no inputs")
+
+
+class ValidationPipeline:
+    """
+    收到的区块按阶段验证，任何一个阶段失败就立即拒绝，不再执行后面更贵的阶段
+
+    1. decode      解析二进制或 JSON
+    2. format      哈希、公钥、签名是小写偶数长度的 hex，整数在范围内，输出金额为正，即 codec 能无损编码区块，
+                   否则区块接入后写区块存储、快照或 /sync 时才会失败
+    3. header      区块哈希（覆盖 merkle 根）、工作量证明、难度下限、时间戳；接入主链前还要求难度与父区块相同
+    4. merkle      重新计算每笔交易的哈希，与 merkle 树的叶子一致
+    5. signatures  全部输入的签名交给 VerifyEngine 多进程并行校验
+    6. utxo        按顺序检查每笔交易的输入未被花费、金额足够，由 BlockChain.accept_block 在接入主链前调用
+
+    1~5 与链的状态无关，在锁外执行；每个阶段的次数、耗时和拒绝数见 stats()
+    """
+
+    def __init__(self, verify_engine: VerifyEngine, min_difficulty: int = 1, max_future: float = 2 * 60 * 60):
+        """
+        :param verify_engine: 签名批量校验
+        :param min_difficulty: 接受的最低难度
+        :param max_future: 区块时间戳最多比本地时间超前的秒数
+        """
+        self.verify_engine = verify_engine
+        self.min_difficulty = min_difficulty
+        self.max_future = max_future
+        self._lock = threading.Lock()
+        self._timings: Dict[str, Dict[str, float]] = {
+            stage: {'count': 0, 'rejected': 0, 'seconds': 0.0} for stage in STAGES}
+
+    @contextmanager
+    def _stage(self, name: str):
+        begin = time.perf_counter()
+        rejected = False
+        try:
+            yield
+        except BlockValidationError:
+            rejected = True
+            raise
+        except Exception as e:
+            rejected = True
+            raise BlockValidationError(name, str(e))
+        finally:
+            elapsed = time.perf_counter() - begin
+            with self._lock:
+                timing = self._timings[name]
+                timing['count'] += 1
+                timing['seconds'] += elapsed
+                timing['rejected'] += rejected
+
+    def decode(self, data: bytes, binary: bool) -> Block:
+        """解析 /addBlock 的请求体：二进制区块或 {"block": {...}}"""
+        with self._stage('decode'):
+            if binary:
+                return decode_block(data)
+            return Block.from_dict(json.loads(data)['block'])
+
+    def check_format(self, block: Block) -> None:
+        with self._stage('format'):
+            check_block_format(block)
+
+    def check_header(self, block: Block) -> None:
+        with self._stage('header'):
+            if not block.Hash or not block.Transactions:
+                raise BlockValidationError('header', "empty block")
+            if block.Difficulty < self.min_difficulty:
+                raise BlockValidationError('header', f"difficulty {block.Difficulty} too low")
+            if not block.check_pow():
+                raise BlockValidationError('header', "invalid proof of work")
+            timestamp = block.Timestamp if block.Timestamp.tzinfo else block.Timestamp.replace(tzinfo=timezone.utc)
+            if timestamp > datetime.now(timezone.utc) + timedelta(seconds=self.max_future):
+                raise BlockValidationError('header', "timestamp too far in the future")
+
+    def check_merkle(self, block: Block, expected_root: Optional[str] = None) -> None:
+        """
+        交易哈希必须与交易内容一致且不重复。merkle 树由交易的 Hash 字段建立，
+        区块哈希覆盖了 merkle 根，所以这里通过后区块的全部内容都被工作量证明覆盖
+
+        :param expected_root: 已知的 merkle 根（例如先同步的区块头中的），给出时必须一致
+        """
+        with self._stage('merkle'):
+            seen = set()
+            for tx in block.Transactions:
+                if tx.hash() != tx.Hash:
+                    raise BlockValidationError('merkle', f"transaction hash mismatch {tx.Hash}")
+                if tx.Hash in seen:
+                    raise BlockValidationError('merkle', f"duplicate transaction {tx.Hash}")
+                seen.add(tx.Hash)
+            if expected_root is not None and block.merkle_root != expected_root:
+                raise BlockValidationError('merkle', "merkle root mismatch")
+
+    def check_signatures(self, block: Block) -> None:
+        with self._stage('signatures'):
+            jobs = [job for tx in block.Transactions for job in tx.signature_jobs()]
+            if not all(self.verify_engine.verify_batch(jobs)):
+                raise BlockValidationError('signatures', "invalid signature in block")
+
+    def check_block(self, block: Block, expected_root: Optional[str] = None) -> None:
+        """与链状态无关的阶段：格式 -> 区块头 -> merkle -> 签名"""
+        self.check_format(block)
+        self.check_header(block)
+        self.check_merkle(block, expected_root)
+        self.check_signatures(block)
+
+    def check_difficulty(self, block: Block, chain) -> None:
+        """
+        区块头只能证明区块满足它自己声明的难度，这里要求与父区块的难度相同，
+        否则低难度的区块几乎不需要工作量，却同样计入累计工作量
+
+        :param chain: BlockChain，最新区块必须是 block 的父区块
+        """
+        with self._stage('header'):
+            if chain.height > 0:
+                expected = chain.header(chain.height - 1).Difficulty
+                if block.Difficulty != expected:
+                    raise BlockValidationError('header', f"difficulty {block.Difficulty}, expected {expected}")
+
+    def check_connect(self, block: Block, chain) -> None:
+        """区块接入主链之前（包括重组时）的检查，作为 BlockChain.accept_block 的 check：难度 -> utxo"""
+        self.check_difficulty(block, chain)
+        self.check_transactions(block, chain)
+
+    def check_transactions(self, block: Block, chain) -> None:
+        """
+        utxo 阶段：在 chain 的当前 UTXO 集合上按顺序验证区块中的交易，
+        同一区块内后面的交易可以花费前面交易的输出。签名已经在 signatures 阶段校验过
+
+        :param chain: BlockChain，最新区块必须是 block 的父区块
+        """
+        with self._stage('utxo'):
+            view = UTXOView(chain.utxo_set)
+            for tx in block.Transactions:
+                try:
+                    check_transaction_rules(tx)
+                    tx.verify(view, check_signatures=False)
+                except Exception as e:
+                    raise BlockValidationError('utxo', f"transaction {tx.Hash}: {e}")
+                view.apply_transaction(tx)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {stage: dict(timing) for stage, timing in self._timings.items()}
@@ -0,0 +1,186 @@
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Hashable, List, Sequence, Tuple
+
+import ecdsa
+
+# (公钥 hex, 被签名的消息, 签名 hex)
+SignatureJob = Tuple[str, bytes, str]
+
+# 进程池一律用 spawn 启动工作进程：节点进程中有 Flask、打包等多个线程，
+# fork 出的子进程可能继承一把正被其他线程持有的锁而永远卡住
+MP_CONTEXT = multiprocessing.get_context('spawn')
+
+
+class LRUCache:
+    """线程安全的有界 LRU 缓存，超过容量时淘汰最久未使用的条目，并记录命中/未命中次数"""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.capacity:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def stats(self) -> Dict[str, int]:
+        return {"size": len(self._data), "capacity": self.capacity, "hits": self.hits, "misses": self.misses}
+
+
+class SignatureCache:
+    """
+    签名校验缓存
+
+    - 公钥 hex -> 解析好的 VerifyingKey，省去 VerifyingKey.from_string 的开销
+    - 校验成功的 (pubkey, message, signature)，同一笔交易再次校验时只需要一次字典查询
+
+    只缓存校验成功的结果，失败的签名每次都重新校验
+    """
+
+    def __init__(self, max_keys: int = 4096, max_signatures: int = 100000):
+        self.keys = LRUCache(max_keys)
+        self.signatures = LRUCache(max_signatures)
+
+    def verifying_key(self, pubkey: str) -> ecdsa.VerifyingKey:
+        verifying_key = self.keys.get(pubkey)
+        if verifying_key is None:
+            verifying_key = ecdsa.VerifyingKey.from_string(bytes.fromhex(pubkey), curve=ecdsa.SECP256k1)
+            self.keys.put(pubkey, verifying_key)
+        return verifying_key
+
+    def is_verified(self, job: SignatureJob) -> bool:
+        return self.signatures.get(job, False)
+
+    def add_verified(self, job: SignatureJob) -> None:
+        self.signatures.put(job, True)
+
+    def verify(self, pubkey: str, message: bytes, signature: str) -> bool:
+        if self.is_verified((pubkey, message, signature)):
+            return True
+        return self.check(pubkey, message, signature)
+
+    def check(self, pubkey: str, message: bytes, signature: str) -> bool:
+        """不查签名缓存，直接做 ECDSA 校验，成功后写入缓存"""
+        try:
+            ok = self.verifying_key(pubkey).verify(bytes.fromhex(signature), message)
+        except (ecdsa.BadSignatureError, ecdsa.MalformedPointError, ValueError):
+            return False
+        if ok:
+            self.add_verified((pubkey, message, signature))
+        return ok
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {"keys": self.keys.stats(), "signatures": self.signatures.stats()}
+
+
+_signature_cache = SignatureCache()
+
+
+def get_signature_cache() -> SignatureCache:
+    """进程内共享的签名缓存（进程池中的每个工作进程各有一份）"""
+    return _signature_cache
+
+
+def verify_signature(pubkey: str, message: bytes, signature: str) -> bool:
+    """校验单个签名，公钥或签名格式错误同样视为校验失败"""
+    return _signature_cache.verify(pubkey, message, signature)
+
+
+def _verify_chunk(jobs: Sequence[SignatureJob]) -> List[bool]:
+    """在工作进程中执行，校验一段签名"""
+    return [verify_signature(pubkey, message, signature) for pubkey, message, signature in jobs]
+
+
+class VerifyEngine:
+    """
+    批量 ECDSA 签名校验引擎
+
+    把 (pubkey, message, signature) 批量切分后分发到进程池的各个核上，
+    按输入顺序返回每个签名的校验结果。批量太小或只有一个核时直接在当前进程串行校验，
+    避免进程间通信的开销超过校验本身。
+    已经在 SignatureCache 中的签名不再发给进程池，新校验成功的签名会写回缓存
+    """
+
+    def __init__(self, max_workers: int = None, min_batch: int = 32, chunk_size: int = 64):
+        """
+        :param max_workers: 进程池大小，默认为 CPU 核数
+        :param min_batch: 少于该数量的批次直接串行校验
+        :param chunk_size: 每个任务包含的签名数量上限
+        """
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.min_batch = min_batch
+        self.chunk_size = chunk_size
+        # 创建引擎时就建立进程池，不在请求处理线程中临时创建
+        self._executor: ProcessPoolExecutor = ProcessPoolExecutor(
+            max_workers=self.max_workers, mp_context=MP_CONTEXT) if self.max_workers > 1 else None
+
+    def verify_batch(self, jobs: Sequence[SignatureJob]) -> List[bool]:
+        """
+        校验一批签名
+
+        :param jobs: (pubkey, message, signature) 列表
+        :return: 与 jobs 一一对应的校验结果
+        """
+        jobs = list(jobs)
+        results = [_signature_cache.is_verified(job) for job in jobs]
+        pending = [i for i, ok in enumerate(results) if not ok]
+        executor = self._executor
+        if executor is None or len(pending) < self.min_batch:
+            for i in pending:
+                results[i] = _signature_cache.check(*jobs[i])
+            return results
+        # 让每个工作进程至少分到一块，同时每块不超过 chunk_size
+        size = min(self.chunk_size, -(-len(pending) // self.max_workers))
+        chunks = [[jobs[i] for i in pending[k:k + size]] for k in range(0, len(pending), size)]
+        checked = []
+        for chunk_result in executor.map(_verify_chunk, chunks):
+            checked.extend(chunk_result)
+        for i, ok in zip(pending, checked):
+            results[i] = ok
+            if ok:
+                _signature_cache.add_verified(jobs[i])
+        return results
+
+    def shutdown(self) -> None:
+        """关闭进程池，之后的校验在当前进程中串行进行"""
+        executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()
+
+
+_default_engine: VerifyEngine = None
+_default_engine_lock = threading.Lock()
+
+
+def get_verify_engine() -> VerifyEngine:
+    """进程内共享的校验引擎，同一进程中的多个节点共用一个进程池"""
+    global _default_engine
+    with _default_engine_lock:
+        if _default_engine is None:
+            _default_engine = VerifyEngine()
+        return _default_engine
@@ -14,6 +14,36 @@ from hashlib import sha256, new as new_hash
 
 
 
+def pubkey_to_address(pub_key: str) -> str:
+    '''由公钥（hex）计算钱包地址'''
+    # 公钥生成比特币地址的完整过程，包含多次哈希操作
+    public_key_bytes = bytes.fromhex(pub_key)
+
+    # 第一次哈希（SHA256）
+    sha256_hash = sha256(public_key_bytes).digest()
+
+    # 第二次哈希（RIPEMD160）
+    ripemd160 = new_hash('ripemd160')
+    ripemd160.update(sha256_hash)
+    hash160 = ripemd160.digest()
+
+    # 添加版本字节（比特币主网版本字节为0x00）
+    versioned_hash = b'\x00' + hash160
+
+    # 进行两次哈希（SHA256）操作以获取校验和
+    first_sha256 = sha256(versioned_hash).digest()
+    second_sha256 = sha256(first_sha256).digest()
+
+    # 取前4个字节作为校验和
+    checksum = second_sha256[:4]
+
+    # 组合版本字节、哈希结果和校验和
+    address_bytes = versioned_hash + checksum
+
+    # 进行Base58编码得到最终的比特币地址
+    return b58encode_check(address_bytes).decode()
+
+
 @dataclass
 class Wallet:
     pub_key: str = None
@@ -29,32 +59,7 @@ class Wallet:
         public_key = private_key.get_verifying_key()
         self.pub_key = public_key.to_string().hex()
 
-        # 公钥生成比特币地址的完整过程，包含多次哈希操作
-        public_key_bytes = bytes.fromhex(self.pub_key)
-
-        # 第一次哈希（SHA256）
-        sha256_hash = sha256(public_key_bytes).digest()
-
-        # 第二次哈希（RIPEMD160）
-        ripemd160 = new_hash('ripemd160')
-        ripemd160.update(sha256_hash)
-        hash160 = ripemd160.digest()
-
-        # 添加版本字节（比特币主网版本字节为0x00）
-        versioned_hash = b'\x00' + hash160
-
-        # 进行两次哈希（SHA256）操作以获取校验和
-        first_sha256 = sha256(versioned_hash).digest()
-        second_sha256 = sha256(first_sha256).digest()
-
-        # 取前4个字节作为校验和
-        checksum = second_sha256[:4]
-
-        # 组合版本字节、哈希结果和校验和
-        address_bytes = versioned_hash + checksum
-
-        # 进行Base58编码得到最终的比特币地址
-        self.address = b58encode_check(address_bytes).decode()
+        self.address = pubkey_to_address(self.pub_key)
 
         return self
 